@@ -0,0 +1,57 @@
+"""IB engine process
+
+Owns the single IBHandler session (IB connection, callbacks, auto square-off)
+and publishes its state to API workers over a Unix socket. Run it with:
+
+    python -m app.engine
+
+and start the API with IB_ENGINE_SOCKET pointing at the same socket path.
+"""
+import asyncio
+import os
+import signal
+from pathlib import Path
+import nest_asyncio
+
+# ib_insync needs nested event loops; only the engine process pays for this
+nest_asyncio.apply()
+
+from app.trading.ib_handler import IBHandler
+from app.trading.ipc import EngineServer
+from app.trading.fake_gateway import ib_factory_from_env
+from app.models.settings import load_settings
+from app.loop_monitor import LOOP_MONITOR
+from app.logs import setup_logging
+from app.memory_monitor import MEMORY_MONITOR
+
+BASE_DIR = Path(__file__).resolve().parent
+SETTINGS_PATH = BASE_DIR / "settings.json"
+ENGINE_SOCKET = os.environ.get('IB_ENGINE_SOCKET', '/tmp/ib_engine.sock')
+
+async def run_engine():
+    setup_logging()
+    settings = load_settings(SETTINGS_PATH)
+    ib_handler = IBHandler(settings, ib_factory=ib_factory_from_env())
+    server = EngineServer(ib_handler, ENGINE_SOCKET)
+
+    LOOP_MONITOR.start()
+    MEMORY_MONITOR.start()
+    await ib_handler.connect()
+    asyncio.create_task(ib_handler.auto_square_off_task(), name='auto_square_off')
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    serve_task = asyncio.create_task(server.serve_forever())
+    await stop.wait()
+
+    print("Shutting down engine...")
+    serve_task.cancel()
+    await server.stop()
+    await ib_handler.disconnect()
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(run_engine())
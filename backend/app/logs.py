@@ -0,0 +1,168 @@
+"""Structured logging off the event loop
+
+Log calls on the loop only build a LogRecord and put it on a queue; a
+background thread formats it and writes it to:
+
+- stdout (what docker / start_backend.sh capture)
+- LOG_FILE as JSON lines, rotated by size
+- LOGS, an in-memory ring buffer served by /api/logs and the `logs`
+  WebSocket topic
+
+setup_logging() also routes `print` through the same queue, so the many
+existing prints no longer block the loop on a stdout write.
+
+Tick-rate messages should log at DEBUG, or be thinned with a Sampler:
+
+    if self._pnl_sample():
+        log.info("PnL %s", self.current_pnl)
+"""
+import atexit
+import collections
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOG_FILE = os.environ.get('LOG_FILE', 'logs/backend.jsonl')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 20 * 1024 * 1024))
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', 5))
+
+LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARNING': logging.WARNING, 'ERROR': logging.ERROR}
+
+def _entry(record, seq: int = None):
+    entry = {
+        'time': record.created,
+        'level': record.levelname,
+        'logger': record.name,
+        'message': record.getMessage(),
+    }
+    if seq is not None:
+        entry['seq'] = seq
+    fields = getattr(record, 'fields', None)
+    if fields:
+        entry['fields'] = fields
+    if record.exc_info:
+        entry['exception'] = logging.Formatter().formatException(record.exc_info)
+    return entry
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(_entry(record), default=str)
+
+class LogBuffer(logging.Handler):
+    """Ring buffer of the most recent records, queryable by time, sequence and level"""
+
+    def __init__(self, capacity: int = 5000):
+        super().__init__()
+        self.entries = collections.deque(maxlen=capacity)
+        self.seq = itertools.count(1)
+
+    def emit(self, record):
+        try:
+            self.entries.append(_entry(record, next(self.seq)))
+        except Exception:
+            self.handleError(record)
+
+    def query(self, since: float = None, level: str = None, after_seq: int = None, limit: int = 500):
+        """Entries newer than `since` (epoch seconds) or `after_seq`, at or above `level`, oldest first"""
+        minimum = LEVELS.get((level or 'DEBUG').upper(), logging.DEBUG)
+        matched = []
+        # Newest first so a small `limit` only touches the tail
+        for entry in reversed(self.entries.copy()):
+            if since is not None and entry['time'] <= since:
+                break
+            if after_seq is not None and entry['seq'] <= after_seq:
+                break
+            if LEVELS.get(entry['level'], logging.CRITICAL) >= minimum:
+                matched.append(entry)
+                if len(matched) >= limit:
+                    break
+        matched.reverse()
+        return matched
+
+    @property
+    def last_seq(self) -> int:
+        return self.entries[-1]['seq'] if self.entries else 0
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the writer thread"""
+
+    def prepare(self, record):
+        return record
+
+class Sampler:
+    """True for the first call and every `every`-th call after it"""
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        self.count = 0
+
+    def __call__(self) -> bool:
+        self.count += 1
+        return self.count % self.every == 1 or self.every == 1
+
+class StdoutToLog:
+    """File-like stand-in for sys.stdout that turns printed lines into log records"""
+
+    def __init__(self, logger, level=logging.INFO):
+        self.logger = logger
+        self.level = level
+        self.partial = ''
+        self.encoding = 'utf-8'
+
+    def write(self, text):
+        if not text:
+            return 0
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.logger.log(self.level, line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+LOGS = LogBuffer()
+_listener = None
+_lock = threading.Lock()
+
+def setup_logging(level: str = LOG_LEVEL, path: str = LOG_FILE, capture_stdout: bool = True):
+    """Install the queue pipeline on the root logger; safe to call more than once"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return LOGS
+
+        console = logging.StreamHandler(sys.__stdout__)
+        console.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        handlers = [console, LOGS]
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                rotating = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+                rotating.setFormatter(JsonFormatter())
+                handlers.append(rotating)
+            except OSError as e:
+                print(f"Error opening log file {path}: {e}")
+
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, *handlers)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        root.handlers = [_EnqueueHandler(records)]
+        root.setLevel(LEVELS.get(level, logging.INFO))
+
+        if capture_stdout:
+            sys.stdout = StdoutToLog(logging.getLogger('stdout'))
+        return LOGS
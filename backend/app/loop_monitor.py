@@ -0,0 +1,280 @@
+"""Event loop health: scheduling lag, slow callbacks and stall stack samples
+
+Everything in this process shares one event loop with the IB reader, so a
+slow callback delays fills, ticks and WebSocket sends alike. LOOP_MONITOR
+measures that continuously:
+
+- a probe task sleeps on a fixed interval and records how late it wakes up
+- every loop callback (task steps included) is timed; ones over
+  `slow_threshold` are aggregated by task or function name
+- functions wrapped with `wrap()` (the IB event callbacks) get per-name
+  timing on a sample of calls
+- a watchdog thread notices when the probe is overdue by `stall_threshold`
+  and samples the loop thread's stack while it is stuck
+
+Call `LOOP_MONITOR.start()` from inside the running loop; `report()` is what
+`/debug/loop` returns.
+"""
+import asyncio
+import collections
+import functools
+import inspect
+import os
+import sys
+import threading
+import time as time_lib
+import traceback
+from app.metrics import LOOP_LAG, LOOP_LAG_HISTOGRAM
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def describe_handle(handle) -> str:
+    """Readable name for a loop callback: the task name and coroutine for task steps"""
+    callback = getattr(handle, '_callback', None)
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return f"task {owner.get_name()} ({getattr(coro, '__qualname__', coro)})"
+    if isinstance(callback, functools.partial):
+        callback = callback.func
+    return getattr(callback, '__qualname__', None) or repr(callback)
+
+class CallbackStats:
+    """Timing of one wrapped callback; only every `sample_every`-th call is timed"""
+
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.calls = 0
+        self.sampled = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=512)
+
+    def observe(self, elapsed: float):
+        self.sampled += 1
+        self.total += elapsed
+        self.recent.append(elapsed)
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'calls': self.calls,
+            'sampled': self.sampled,
+            'meanMs': _ms(self.total / self.sampled) if self.sampled else 0.0,
+            'p95Ms': _ms(_percentile(self.recent, 95)),
+            'maxMs': _ms(self.max),
+        }
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.1, slow_threshold: float = 0.05, stall_threshold: float = 0.25,
+                 sample_every: int = 8, max_stalls: int = 20):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.stall_threshold = stall_threshold
+        self.sample_every = max(1, sample_every)
+
+        self.callbacks = {}  # name -> CallbackStats
+        self.slow = {}  # handle description -> [count, total, max, last seen]
+        self.lags = collections.deque(maxlen=600)
+        self.max_lag = 0.0
+        self.stalls = []  # Worst stalls, longest first
+        self.max_stalls = max_stalls
+        self.stall_count = 0
+
+        self.loop = None
+        self.loop_thread = None
+        self._probe = None
+        self._watchdog = None
+        self._deadline = None  # Monotonic time the probe should next wake by
+        self._current = None  # Loop callback running right now
+        self._stall = None  # Stall in progress, filled in by the watchdog
+        self._lock = threading.Lock()
+        self._original_run = None
+
+    @property
+    def running(self) -> bool:
+        return self._probe is not None and not self._probe.done()
+
+    def start(self):
+        """Start the lag probe, callback timing and the stall watchdog on the running loop"""
+        if self.running:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self._install()
+        self._probe = self.loop.create_task(self._run_probe(), name='loop_monitor')
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        if self._probe:
+            self._probe.cancel()
+            self._probe = None
+        self._deadline = None
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    def _install(self):
+        """Time every loop callback by wrapping Handle._run (TimerHandle inherits it)"""
+        if self._original_run is not None:
+            return
+        original = self._original_run = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            previous = monitor._current
+            monitor._current = handle
+            started = time_lib.perf_counter()
+            try:
+                return original(handle)
+            finally:
+                elapsed = time_lib.perf_counter() - started
+                monitor._current = previous
+                if elapsed >= monitor.slow_threshold:
+                    monitor._record_slow(handle, elapsed)
+
+        asyncio.events.Handle._run = _run
+
+    def _record_slow(self, handle, elapsed: float):
+        name = describe_handle(handle)
+        entry = self.slow.get(name)
+        if entry is None:
+            entry = self.slow[name] = [0, 0.0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        entry[3] = time_lib.time()
+
+    async def _run_probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            self._deadline = time_lib.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HISTOGRAM.observe(lag)
+            if lag >= self.stall_threshold:
+                self._finish_stall(lag)
+            elif self._stall is not None:
+                with self._lock:
+                    self._stall = None
+
+    def _finish_stall(self, lag: float):
+        with self._lock:
+            stall, self._stall = self._stall, None
+        if stall is None:
+            # Too short for the watchdog to catch; record it without stacks
+            stall = {'time': time_lib.time() - lag, 'during': None, 'stacks': []}
+        stall['durationMs'] = _ms(lag)
+        self.stall_count += 1
+        self.stalls.append(stall)
+        self.stalls.sort(key=lambda s: s['durationMs'], reverse=True)
+        del self.stalls[self.max_stalls:]
+
+    def _watch(self):
+        """Watchdog thread: sample the loop thread's stack while the probe is overdue"""
+        period = self.stall_threshold / 2
+        while True:
+            time_lib.sleep(period)
+            deadline = self._deadline
+            if deadline is None:
+                continue
+            overdue = time_lib.monotonic() - deadline
+            if overdue < self.stall_threshold:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = [f"{os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in traceback.extract_stack(frame)[-25:]]
+            current = self._current
+            with self._lock:
+                if self._stall is None:
+                    self._stall = {
+                        'time': time_lib.time() - overdue,
+                        'during': describe_handle(current) if current is not None else None,
+                        'stacks': [],
+                    }
+                if len(self._stall['stacks']) < 5 and stack not in self._stall['stacks']:
+                    self._stall['stacks'].append(stack)
+
+    def wrap(self, name: str, func):
+        """Wrap a callback (sync or async) with sampled timing under `name`"""
+        is_async = inspect.iscoroutinefunction(func)
+        stats = self.callbacks.get(name)
+        if stats is None:
+            stats = self.callbacks[name] = CallbackStats(name, 'async' if is_async else 'sync')
+        sample_every = self.sample_every
+
+        if is_async:
+            @functools.wraps(func)
+            async def timed_async(*args, **kwargs):
+                stats.calls += 1
+                if stats.calls % sample_every:
+                    return await func(*args, **kwargs)
+                started = time_lib.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    stats.observe(time_lib.perf_counter() - started)
+            return timed_async
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            stats.calls += 1
+            if stats.calls % sample_every:
+                return func(*args, **kwargs)
+            started = time_lib.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.observe(time_lib.perf_counter() - started)
+        return timed
+
+    def report(self, top: int = 20):
+        lags = list(self.lags)
+        slow = sorted(self.slow.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        return {
+            'running': self.running,
+            'thresholds': {
+                'intervalMs': _ms(self.interval),
+                'slowCallbackMs': _ms(self.slow_threshold),
+                'stallMs': _ms(self.stall_threshold),
+                'sampleEvery': self.sample_every,
+            },
+            'lag': {
+                'currentMs': _ms(lags[-1]) if lags else 0.0,
+                'p50Ms': _ms(_percentile(lags, 50)),
+                'p99Ms': _ms(_percentile(lags, 99)),
+                'maxMs': _ms(self.max_lag),
+                'samples': len(lags),
+            },
+            'callbacks': sorted((s.as_dict() for s in self.callbacks.values()), key=lambda s: s['maxMs'], reverse=True),
+            'slowCallbacks': [
+                {'name': name, 'count': count, 'totalMs': _ms(total), 'maxMs': _ms(worst), 'lastSeen': last}
+                for name, (count, total, worst, last) in slow
+            ],
+            'stallCount': self.stall_count,
+            'stalls': list(self.stalls),
+        }
+
+LOOP_MONITOR = LoopMonitor(
+    slow_threshold=float(os.environ.get('LOOP_SLOW_CALLBACK_MS', 50)) / 1000,
+    stall_threshold=float(os.environ.get('LOOP_STALL_MS', 250)) / 1000,
+    sample_every=int(os.environ.get('LOOP_MONITOR_SAMPLE', 8)),
+)
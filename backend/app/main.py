@@ -1,19 +1,23 @@
-from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect, status
+from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect, status, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from datetime import datetime, time
 import json
 import pytz
-import nest_asyncio
 import asyncio
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
-
-from app.trading.ib_handler import IBHandler
-from app.models.settings import Settings
+from app.models.settings import Settings, load_settings, save_settings
+from app.logs import LOGS, setup_logging
+from app.metrics import REGISTRY, render
+from app.loop_monitor import LOOP_MONITOR
+from app.memory_monitor import MEMORY_MONITOR
+from app.profiler import PROFILER, FORMATS, ProfilerBusy
+from app.trading.bars import parse_size
+from app.trading.bar_store import HISTORY_BAR_SIZES
 import asyncio
 from fastapi import BackgroundTasks
 import os
+import hmac
 from pathlib import Path
 
 import math
@@ -41,24 +45,38 @@ app.add_middleware(
 BASE_DIR = Path(__file__).resolve().parent
 SETTINGS_PATH = BASE_DIR / "settings.json"
 
-# Create settings file if it doesn't exist
-if not SETTINGS_PATH.exists():
-    default_settings = Settings(
-        trading_enabled=True,
-        quantity=1,
-        dte=0,
-        otm_strikes=2,
-        default_strike=0.0
-    )
-    with open(SETTINGS_PATH, "w") as f:
-        json.dump(default_settings.dict(), f)
-
-# Load settings
-with open(SETTINGS_PATH, "r") as f:
-    settings = Settings(**json.load(f))
-
-# Initialize IB Handler with settings
-ib_handler = IBHandler(settings)
+# When set, the IB session lives in a separate engine process (python -m app.engine)
+# and this app is a stateless worker, so uvicorn can run with --workers N
+ENGINE_SOCKET = os.environ.get('IB_ENGINE_SOCKET')
+
+# Debug endpoints that run code in the process (profiling) need this token in X-Admin-Token;
+# they are disabled when it isn't set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Logging goes through a background writer; prints are captured into it too
+setup_logging()
+
+# Load settings, creating the file if it doesn't exist
+settings = load_settings(SETTINGS_PATH)
+
+if ENGINE_SOCKET:
+    from app.trading.ipc import EngineClient
+    ib_handler = EngineClient(ENGINE_SOCKET, settings)
+else:
+    import nest_asyncio
+
+    # Apply nest_asyncio to allow nested event loops
+    nest_asyncio.apply()
+
+    from app.trading.ib_handler import IBHandler
+    from app.trading.fake_gateway import ib_factory_from_env
+
+    # Initialize IB Handler with settings
+    ib_handler = IBHandler(settings, ib_factory=ib_factory_from_env())
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or '', ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
 # Track active WebSocket connections
 active_connections = []
@@ -105,9 +123,12 @@ async def send_data_updates(websocket: WebSocket):
 
 @app.on_event("startup")
 async def startup_event():
+    LOOP_MONITOR.start()
+    MEMORY_MONITOR.start()
     await ib_handler.connect()
-    # Start auto square-off task
-    asyncio.create_task(ib_handler.auto_square_off_task())
+    # Start auto square-off task (the engine process runs its own)
+    if not ENGINE_SOCKET:
+        asyncio.create_task(ib_handler.auto_square_off_task(), name='auto_square_off')
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -129,6 +150,7 @@ async def shutdown_event():
 
 @app.post("/api/signal")
 async def handle_signal(signal: dict):
+    settings = ib_handler.settings
     if not settings.trading_enabled:
         return {"status": "error", "message": "Trading is disabled"}
     
@@ -149,6 +171,7 @@ async def handle_signal(signal: dict):
 
 @app.post("/api/quick-trade")
 async def handle_quick_trade(signal: dict):
+    settings = ib_handler.settings
     if not settings.trading_enabled:
         return {"status": "error", "message": "Trading is disabled"}
     
@@ -167,6 +190,22 @@ async def handle_quick_trade(signal: dict):
     
     return await ib_handler.quick_trade_spy(signal)
 
+@app.post("/api/combo")
+async def handle_combo(signal: dict):
+    """Legs resolved together and sent as native combo orders; see app/trading/combos.py"""
+    if not ib_handler.settings.trading_enabled:
+        return {"status": "error", "message": "Trading is disabled"}
+    return await ib_handler.place_combo(signal)
+
+@app.get("/api/combos")
+async def get_combos():
+    """Recent combos with the fills of each leg"""
+    try:
+        return await ib_handler.get_combos()
+    except Exception as e:
+        print(f"Error in get_combos endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get combos")
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     print("WebSocket connection attempt...")
@@ -180,12 +219,21 @@ async def websocket_endpoint(websocket: WebSocket):
             try:
                 message = await websocket.receive_text()
                 print(f"Received message from client: {message}")
-                # Handle any client messages if needed
-                await websocket.send_json({
+                ack = {
                     "type": "acknowledgment",
                     "message": "Message received",
                     "timestamp": time_lib.time()
-                })
+                }
+                # {"action": "subscribe" | "unsubscribe", "topic": "logs"} opts in to extra message types
+                try:
+                    request = json.loads(message)
+                except ValueError:
+                    request = None
+                if isinstance(request, dict) and request.get("action") in ("subscribe", "unsubscribe") and request.get("topic"):
+                    await getattr(ib_handler, request["action"])(websocket, request["topic"])
+                    ack["topic"] = request["topic"]
+                    ack["action"] = request["action"]
+                await websocket.send_json(ack)
             except WebSocketDisconnect:
                 print("Client disconnected normally")
                 break
@@ -227,6 +275,22 @@ async def get_positions():
 async def get_orders():
     return await ib_handler.get_orders()
 
+@app.get("/api/orders/latency")
+async def get_order_latency(source: Optional[str] = None):
+    """p50/p95/p99 latency (ms) from signal arrival to each order stage"""
+    try:
+        return await ib_handler.get_order_latency(source)
+    except Exception as e:
+        print(f"Error in get_order_latency endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get order latency")
+
+@app.get("/api/orders/{order_id}/timeline")
+async def get_order_timeline(order_id: int):
+    timeline = await ib_handler.get_order_timeline(order_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="No timeline for this order")
+    return timeline
+
 class PositionClose(BaseModel):
     position_id: int
 
@@ -253,18 +317,129 @@ async def cancel_order(data: OrderCancel):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/risk")
+async def get_risk():
+    """Risk limits, exposure per underlying and recent rejections"""
+    try:
+        return await ib_handler.get_risk()
+    except Exception as e:
+        print(f"Error in get_risk endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get risk state")
+
+class TriggerCreate(BaseModel):
+    kind: str = 'price'  # price, trailing or pnl
+    position_id: Optional[int] = None  # Position closed when the trigger fires
+    symbol: Optional[str] = None  # Watch this underlying (e.g. SPY) instead of the position's price
+    op: Optional[str] = None  # above or below
+    level: Optional[float] = None
+    distance: Optional[float] = None
+    percent: bool = False
+    pnl: Optional[float] = None
+
+@app.get("/api/triggers")
+async def get_triggers():
+    try:
+        return await ib_handler.get_triggers()
+    except Exception as e:
+        print(f"Error in get_triggers endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get triggers")
+
+@app.post("/api/triggers")
+async def add_trigger(data: TriggerCreate):
+    result = await ib_handler.add_trigger(data.dict())
+    if result["status"] == "error":
+        raise HTTPException(status_code=400, detail=result["message"])
+    return result
+
+@app.delete("/api/triggers/{trigger_id}")
+async def remove_trigger(trigger_id: int):
+    result = await ib_handler.remove_trigger(trigger_id)
+    if result["status"] == "error":
+        raise HTTPException(status_code=404, detail=result["message"])
+    return result
+
+@app.get("/api/logs")
+async def get_logs(since: Optional[float] = None, level: Optional[str] = None, limit: int = 500, process: str = 'engine'):
+    """Recent log entries newer than `since` (epoch seconds) at or above `level`"""
+    try:
+        limit = max(1, min(limit, 5000))
+        if ENGINE_SOCKET and process == 'api':
+            return LOGS.query(since=since, level=level, limit=limit)
+        return await ib_handler.get_logs(since, level, limit)
+    except Exception as e:
+        print(f"Error in get_logs endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get logs")
+
+@app.get("/api/bars")
+async def get_bars(symbol: Optional[str] = None, con_id: Optional[int] = None, size: str = '5s',
+                   since: Optional[float] = None, until: Optional[float] = None, limit: int = 1000,
+                   partial: bool = False):
+    """OHLCV bars (`1s`, `5s` or `1m`) starting in [since, until); without symbol or con_id, what's available"""
+    try:
+        seconds = parse_size(size)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid bar size {size}")
+    try:
+        bars = await ib_handler.get_bars(symbol, con_id, seconds, since, until, max(1, min(limit, 10000)), partial)
+    except Exception as e:
+        print(f"Error in get_bars endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get bars")
+    if bars is None:
+        raise HTTPException(status_code=404, detail=f"No bars for {symbol or con_id}")
+    return bars
+
+@app.get("/api/history")
+async def get_history(symbol: Optional[str] = None, con_id: Optional[int] = None, size: str = '1m',
+                      since: Optional[float] = None, until: Optional[float] = None, limit: int = 1000,
+                      partial: bool = False):
+    """Historical bars from the local store, fetching only what it's missing; without symbol or con_id, what's stored"""
+    try:
+        seconds = parse_size(size)
+    except ValueError:
+        seconds = None
+    if seconds not in HISTORY_BAR_SIZES:
+        raise HTTPException(status_code=400, detail=f"Invalid bar size {size}")
+    try:
+        bars = await ib_handler.get_history(symbol, con_id, seconds, since, until, max(1, min(limit, 100000)), partial)
+    except Exception as e:
+        print(f"Error in get_history endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get historical bars")
+    if bars is None:
+        raise HTTPException(status_code=404, detail=f"No contract for {symbol or con_id}")
+    return bars
+
+@app.get("/api/strategies")
+async def get_strategies():
+    """Loaded strategies with their indicator state, signal counts and compute time"""
+    try:
+        return await ib_handler.get_strategies()
+    except Exception as e:
+        print(f"Error in get_strategies endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get strategies")
+
+@app.post("/api/strategies/{name}/enable", dependencies=[Depends(require_admin)])
+async def enable_strategy(name: str):
+    return await _set_strategy_enabled(name, True)
+
+@app.post("/api/strategies/{name}/disable", dependencies=[Depends(require_admin)])
+async def disable_strategy(name: str):
+    return await _set_strategy_enabled(name, False)
+
+async def _set_strategy_enabled(name: str, enabled: bool):
+    result = await ib_handler.set_strategy_enabled(name, enabled)
+    if result["status"] == "error":
+        raise HTTPException(status_code=404, detail=result["message"])
+    return result
+
 @app.get("/api/settings")
 async def get_settings():
-    return settings
+    return ib_handler.settings
 
 @app.post("/api/settings")
 async def update_settings(new_settings: Settings):
-    global settings
-    settings = new_settings
-    ib_handler.settings = new_settings  # Update IBHandler settings
-    with open(SETTINGS_PATH, "w") as f:
-        json.dump(settings.dict(), f)
-    return settings
+    await ib_handler.update_settings(new_settings)  # Update IBHandler settings
+    save_settings(SETTINGS_PATH, new_settings)
+    return new_settings
 
 @app.get("/api/spy-price")
 async def get_spy_price():
@@ -277,6 +452,122 @@ async def get_spy_price():
         print(f"Error in get_spy_price endpoint: {e}")
         raise HTTPException(status_code=500, detail="Failed to get SPY price")
 
+@app.get("/api/instruments")
+async def get_instruments():
+    try:
+        return await ib_handler.get_instruments()
+    except Exception as e:
+        print(f"Error in get_instruments endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get instruments")
+
+@app.get("/api/ib/pool")
+async def get_pool_status():
+    try:
+        return await ib_handler.get_pool_status()
+    except Exception as e:
+        print(f"Error in get_pool_status endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get pool status")
+
+@app.get("/api/executions")
+async def get_executions(limit: int = 100, cursor: Optional[str] = None, since: Optional[float] = None,
+                         con_id: Optional[int] = None, symbol: Optional[str] = None):
+    """Paginated execution history, newest first; pass `next` back as `cursor` for the next page"""
+    try:
+        limit = max(1, min(limit, 1000))
+        return await ib_handler.get_executions(limit, cursor, since, con_id, symbol)
+    except Exception as e:
+        print(f"Error in get_executions endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get executions")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of this process (and the engine's, when split)"""
+    if not ENGINE_SOCKET:
+        return render(REGISTRY.collect())
+
+    local = REGISTRY.collect({'process': f'api-{os.getpid()}'})
+    try:
+        engine = await ib_handler.get_metrics({'process': 'engine'})
+    except Exception as e:
+        print(f"Error fetching engine metrics: {e}")
+        engine = []
+    return render(engine, local)
+
+@app.get("/debug/loop")
+async def debug_loop():
+    """Event loop lag, slow callbacks and stack samples from stalls (the engine's too, when split)"""
+    if not ENGINE_SOCKET:
+        return LOOP_MONITOR.report()
+
+    report = {'api': LOOP_MONITOR.report()}
+    try:
+        report['engine'] = await ib_handler.get_loop_health()
+    except Exception as e:
+        print(f"Error fetching engine loop health: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get engine loop health")
+    return report
+
+@app.get("/debug/memory")
+async def debug_memory():
+    """RSS, tasks by coroutine, collection sizes, growth trends and tracemalloc diffs"""
+    if not ENGINE_SOCKET:
+        return MEMORY_MONITOR.report()
+
+    report = {'api': MEMORY_MONITOR.report()}
+    try:
+        report['engine'] = await ib_handler.get_memory_report()
+    except Exception as e:
+        print(f"Error fetching engine memory report: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get engine memory report")
+    return report
+
+def _profile_response(profile, fmt):
+    if fmt == 'collapsed':
+        return PlainTextResponse(profile)
+    return profile
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin)])
+async def debug_profile(seconds: float = 10.0, format: str = 'collapsed', interval_ms: float = 5.0, target: str = 'engine'):
+    """Sample CPU stacks for `seconds`; `target=api` profiles this worker instead of the engine"""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    interval = max(interval_ms, 1.0) / 1000
+    try:
+        if ENGINE_SOCKET and target == 'api':
+            profile = await PROFILER.profile(seconds, interval, format)
+        else:
+            profile = await ib_handler.profile_cpu(seconds, format, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error in debug_profile endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to profile")
+    return _profile_response(profile, format)
+
+@app.post("/debug/profile/signal", dependencies=[Depends(require_admin)])
+async def debug_profile_signal(signal: dict, format: str = 'collapsed'):
+    """Process one signal (it trades like /api/signal) and return its result and CPU profile"""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if not ib_handler.settings.trading_enabled:
+        return {"status": "error", "message": "Trading is disabled"}
+    try:
+        return await ib_handler.profile_signal(signal, format)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"Error in debug_profile_signal endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to profile signal")
+
+@app.get("/api/square-off/runs")
+async def get_square_off_runs():
+    """Timelines of recent auto square-off runs"""
+    try:
+        return await ib_handler.get_square_off_runs()
+    except Exception as e:
+        print(f"Error in get_square_off_runs endpoint: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get square-off runs")
+
 class BuyOrderRequest(BaseModel):
     position_id: int
     quantity: int
@@ -0,0 +1,208 @@
+"""Memory and task-leak diagnostics for long-running sessions
+
+MEMORY_MONITOR samples, on a fixed interval:
+
+- process RSS and, when tracing is on, tracemalloc's current/peak
+- asyncio tasks grouped by coroutine name
+- sizes of registered collections (IBHandler registers its own)
+
+and keeps the history so growth over the day is visible. With tracemalloc
+on, a snapshot is taken every `snapshot_interval` and diffed against both
+the first snapshot and the previous one, by allocation site.
+
+Soak mode (MEMORY_SOAK=1) samples every few seconds, turns tracemalloc on
+and flags every series that keeps growing. Use it while running
+load_test.py against the simulated gateway.
+"""
+import asyncio
+import collections
+import gc
+import os
+import resource
+import time as time_lib
+import tracemalloc
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak, not current, but the best we have off Linux (kilobytes on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def task_counts():
+    """Live asyncio tasks grouped by coroutine name"""
+    counts = collections.Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        counts[getattr(coro, '__qualname__', type(coro).__name__)] += 1
+    return counts
+
+def trend(values, times):
+    """Least-squares slope per hour, the share of changes that were rises, and the number of changes"""
+    n = len(values)
+    if n < 2:
+        return 0.0, 0.0, 0
+    mean_t = sum(times) / n
+    mean_v = sum(values) / n
+    var = sum((t - mean_t) ** 2 for t in times)
+    slope = sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values)) / var if var else 0.0
+    rising = sum(1 for a, b in zip(values, values[1:]) if b > a)
+    steps = sum(1 for a, b in zip(values, values[1:]) if b != a)
+    return slope * 3600, (rising / steps if steps else 0.0), steps
+
+class MemoryMonitor:
+    def __init__(self, interval: float = 60.0, snapshot_interval: float = 600.0, history: int = 1440,
+                 trace: bool = False, soak: bool = False, top: int = 20):
+        self.soak = soak
+        self.interval = 5.0 if soak else interval
+        self.snapshot_interval = 60.0 if soak else snapshot_interval
+        self.trace = trace or soak
+        self.top = top
+        self.samples = collections.deque(maxlen=history)
+        self.sources = {}  # name -> callable returning {collection: size}
+        self.baseline = None
+        self.previous = None
+        self.diffs = {}
+        self._task = None
+        self._last_snapshot = 0.0
+
+    def register(self, name: str, source):
+        """Add a callable returning {collection name: size} to every sample"""
+        self.sources[name] = source
+
+    def unregister(self, name: str):
+        self.sources.pop(name, None)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self._task = asyncio.get_running_loop().create_task(self._run(), name='memory_monitor')
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                self.sample()
+                if tracemalloc.is_tracing() and time_lib.monotonic() - self._last_snapshot >= self.snapshot_interval:
+                    self.snapshot()
+            except Exception as e:
+                print(f"Error sampling memory: {e}")
+            await asyncio.sleep(self.interval)
+
+    def collection_sizes(self):
+        sizes = {}
+        for name, source in list(self.sources.items()):
+            try:
+                for key, size in source().items():
+                    sizes[f'{name}.{key}'] = size
+            except Exception as e:
+                print(f"Error reading collection sizes from {name}: {e}")
+        return sizes
+
+    def sample(self):
+        tasks = task_counts()
+        sample = {
+            'time': time_lib.time(),
+            'rss': rss_bytes(),
+            'tasks': sum(tasks.values()),
+            'taskGroups': dict(tasks),
+            'collections': self.collection_sizes(),
+            'gcObjects': len(gc.get_objects()) if self.soak else None,
+        }
+        if tracemalloc.is_tracing():
+            sample['traced'], sample['tracedPeak'] = tracemalloc.get_traced_memory()
+        self.samples.append(sample)
+        return sample
+
+    def snapshot(self):
+        """Take a tracemalloc snapshot and diff it against the first and previous ones"""
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),  # Our own sample history
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        self._last_snapshot = time_lib.monotonic()
+        if self.baseline is None:
+            self.baseline = snapshot
+        else:
+            self.diffs['sinceStart'] = self._diff(snapshot, self.baseline)
+        if self.previous is not None:
+            self.diffs['sincePrevious'] = self._diff(snapshot, self.previous)
+        self.previous = snapshot
+
+    def _diff(self, snapshot, other):
+        stats = snapshot.compare_to(other, 'lineno')
+        return [{
+            'site': str(stat.traceback[0]),
+            'sizeDiff': stat.size_diff,
+            'size': stat.size,
+            'countDiff': stat.count_diff,
+        } for stat in stats[:self.top] if stat.size_diff]
+
+    def series(self):
+        """Every sampled value as (name, [(time, value)])"""
+        series = collections.defaultdict(list)
+        for sample in self.samples:
+            t = sample['time']
+            series['rss'].append((t, sample['rss']))
+            series['tasks'].append((t, sample['tasks']))
+            if sample.get('traced') is not None:
+                series['traced'].append((t, sample['traced']))
+            if sample.get('gcObjects') is not None:
+                series['gcObjects'].append((t, sample['gcObjects']))
+            for name, count in sample['taskGroups'].items():
+                series[f'task:{name}'].append((t, count))
+            for name, size in sample['collections'].items():
+                series[name].append((t, size))
+        return series
+
+    def growth(self, min_samples: int = 5, min_rising: float = 0.7, min_changes: int = 3):
+        """Series that keep growing: positive slope and mostly rises among several changes"""
+        flagged = []
+        for name, points in self.series().items():
+            if len(points) < min_samples:
+                continue
+            times, values = [p[0] for p in points], [p[1] for p in points]
+            per_hour, rising, changes = trend(values, times)
+            if per_hour > 0 and rising >= min_rising and changes >= min_changes and values[-1] > values[0]:
+                flagged.append({
+                    'series': name,
+                    'first': values[0],
+                    'last': values[-1],
+                    'perHour': round(per_hour, 1),
+                    'risingSteps': round(rising, 2),
+                })
+        return sorted(flagged, key=lambda f: f['risingSteps'] * f['perHour'], reverse=True)
+
+    def report(self, history: int = 60):
+        current = self.sample() if not self.samples or not self.running else self.samples[-1]
+        return {
+            'running': self.running,
+            'soak': self.soak,
+            'tracing': tracemalloc.is_tracing(),
+            'intervalSeconds': self.interval,
+            'current': current,
+            'growth': self.growth(),
+            'tracemalloc': self.diffs,
+            'history': [
+                {k: s.get(k) for k in ('time', 'rss', 'tasks', 'traced')}
+                for s in list(self.samples)[-history:]
+            ],
+        }
+
+MEMORY_MONITOR = MemoryMonitor(
+    interval=float(os.environ.get('MEMORY_SAMPLE_SECONDS', 60)),
+    trace=os.environ.get('MEMORY_TRACEMALLOC') == '1',
+    soak=os.environ.get('MEMORY_SOAK') == '1',
+)
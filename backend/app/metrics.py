@@ -0,0 +1,236 @@
+"""Minimal Prometheus-style metrics registry
+
+Metrics are plain dicts keyed by label values, so recording a sample is a
+dict lookup and an add. /metrics renders them in the text exposition format.
+"""
+import time as time_lib
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _label_str(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, '') for n in self.labelnames)
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, self.labelnames, key, value) for key, value in self.values.items()]
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+        self.function = None
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Compute the value at scrape time; the function returns a number or {label tuple: number}"""
+        self.function = function
+
+    def samples(self):
+        values = dict(self.values)
+        if self.function:
+            try:
+                result = self.function()
+                if isinstance(result, dict):
+                    values.update(result)
+                else:
+                    values[()] = result
+            except Exception as e:
+                print(f"Error evaluating gauge {self.name}: {e}")
+        return [(self.name, self.labelnames, key, value) for key, value in values.items()]
+
+class _HistogramTimer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time_lib.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time_lib.perf_counter() - self.start, **self.labels)
+        return False
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def time(self, **labels):
+        """Context manager that observes the elapsed seconds"""
+        return _HistogramTimer(self, labels)
+
+    def samples(self):
+        samples = []
+        bucket_labels = self.labelnames + ('le',)
+        for key, data in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', bucket_labels, key + (repr(float(bound)),), cumulative))
+            samples.append((f'{self.name}_bucket', bucket_labels, key + ('+Inf',), data[-1]))
+            samples.append((f'{self.name}_sum', self.labelnames, key, data[-2]))
+            samples.append((f'{self.name}_count', self.labelnames, key, data[-1]))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collect(self, const_labels=None):
+        """Serializable snapshot of every metric, so another process can merge it
+
+        `const_labels` are added to every sample, e.g. to tell processes apart.
+        """
+        extra_names = list(const_labels or {})
+        extra_values = [str(v) for v in (const_labels or {}).values()]
+        return [
+            {
+                'name': metric.name,
+                'type': metric.type,
+                'help': metric.documentation,
+                'samples': [
+                    [name, extra_names + list(labelnames), extra_values + list(key), value]
+                    for name, labelnames, key, value in metric.samples()
+                ]
+            }
+            for metric in self.metrics.values()
+        ]
+
+def render(*collections):
+    """Text exposition format for one or more Registry.collect() results
+
+    A family collected by several processes is written as one block, since
+    the format requires a family's samples to be contiguous.
+    """
+    merged = {}  # name -> (family, samples of every collection)
+    for families in collections:
+        for family in families:
+            entry = merged.get(family['name'])
+            if entry is None:
+                merged[family['name']] = (family, list(family['samples']))
+            else:
+                entry[1].extend(family['samples'])
+    lines = []
+    for name, (family, samples) in merged.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for sample_name, labelnames, values, value in samples:
+            lines.append(f"{sample_name}{_label_str(labelnames, values)} {float(value)!r}")
+    return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# Gateway and signal path latency
+IB_REQUEST_LATENCY = REGISTRY.histogram(
+    'ib_request_latency_seconds', 'Latency of IB gateway requests', ['request'])
+SIGNAL_STAGE_LATENCY = REGISTRY.histogram(
+    'signal_stage_latency_seconds', 'Latency of each stage of signal handling', ['path', 'stage'])
+
+# Trading activity
+ORDERS_PLACED = REGISTRY.counter('orders_placed_total', 'Orders sent to the gateway', ['source'])
+FILLS = REGISTRY.counter('fills_total', 'Executions received', ['sec_type'])
+IB_ERRORS = REGISTRY.counter('ib_errors_total', 'Errors reported by the gateway', ['code'])
+RECONNECTS = REGISTRY.counter('ib_reconnects_total', 'Reconnect attempts to the gateway')
+RISK_REJECTIONS = REGISTRY.counter('risk_rejections_total', 'Orders blocked by pre-trade risk checks', ['reason'])
+
+# Strategy runtime
+STRATEGY_COMPUTE = REGISTRY.histogram(
+    'strategy_compute_seconds', 'Time spent in one strategy callback', ['strategy'],
+    buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1))
+STRATEGY_SIGNALS = REGISTRY.counter('strategy_signals_total', 'Signals emitted by strategies', ['strategy'])
+
+# Broadcast path
+WEBSOCKET_SEND_FAILURES = REGISTRY.counter('websocket_send_failures_total', 'Failed WebSocket sends')
+BROADCAST_LATENCY = REGISTRY.histogram(
+    'broadcast_fanout_seconds', 'Time to send one update to all WebSocket clients')
+
+# Process health
+QUEUE_DEPTH = REGISTRY.gauge('queue_depth', 'Items waiting in internal queues', ['queue'])
+SUBSCRIPTIONS = REGISTRY.gauge('ib_subscriptions', 'Active gateway subscriptions', ['kind'])
+CONNECTED_CLIENTS = REGISTRY.gauge('websocket_clients', 'Connected WebSocket clients')
+LOOP_LAG = REGISTRY.gauge('event_loop_lag_seconds', 'Most recent event loop scheduling lag')
+LOOP_LAG_HISTOGRAM = REGISTRY.histogram('event_loop_lag_histogram_seconds', 'Event loop scheduling lag')
+
+class StageTimer:
+    """Observe the duration of consecutive stages of one signal"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.start = self.last = time_lib.perf_counter()
+
+    def mark(self, stage: str):
+        now = time_lib.perf_counter()
+        SIGNAL_STAGE_LATENCY.observe(now - self.last, path=self.path, stage=stage)
+        self.last = now
+
+    def finish(self):
+        SIGNAL_STAGE_LATENCY.observe(time_lib.perf_counter() - self.start, path=self.path, stage='total')
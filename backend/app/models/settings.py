@@ -1,13 +1,44 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, Optional
+from pathlib import Path
+import json
 
 class Settings(BaseModel):
     trading_enabled: bool = True
     spy_quantity: int = 1
     mes_quantity: int = 1
+    instrument_quantities: Dict[str, int] = {}  # Default size of instruments without their own setting, e.g. {"QQQ": 2}
     dte: int = 0  # 0 for closest expiry, 1 for next expiry
     otm_strikes: int = 3  # Updated to 3 to include OTM-3
     call_strike_selection: str = "ATM"  # Can be "ATM", "OTM-1", "OTM-2", "OTM-3"
     put_strike_selection: str = "ATM"   # Can be "ATM", "OTM-1", "OTM-2", "OTM-3"
     auto_square_off_enabled: bool = True
-    auto_square_off_time: str = "15:55"  # Default time in HH:MM format
\ No newline at end of file
+    auto_square_off_time: str = "15:55"  # Default time in HH:MM format
+    # Pre-trade risk limits; 0 means no limit
+    risk_enabled: bool = True
+    max_net_contracts: int = 0  # Per underlying, positions plus working orders
+    max_notional: float = 0.0  # Per underlying, premium for options
+    max_daily_loss: float = 0.0  # Realized, net of commissions; blocks new exposure once reached
+    max_orders_per_window: int = 0
+    order_window_seconds: float = 60.0
+    underlying_risk_limits: Dict[str, Dict[str, float]] = {}  # e.g. {"MES": {"max_net_contracts": 4}}
+
+def load_settings(path: Path) -> Settings:
+    """Load settings from disk, creating the file with defaults if it doesn't exist"""
+    if not path.exists():
+        default_settings = Settings(
+            trading_enabled=True,
+            quantity=1,
+            dte=0,
+            otm_strikes=2,
+            default_strike=0.0
+        )
+        save_settings(path, default_settings)
+
+    with open(path, "r") as f:
+        return Settings(**json.load(f))
+
+def save_settings(path: Path, settings: Settings):
+    """Persist settings to disk"""
+    with open(path, "w") as f:
+        json.dump(settings.dict(), f)
@@ -0,0 +1,161 @@
+"""On-demand sampling CPU profiler
+
+While a profile is running, a background thread samples the stack of every
+thread in the process (the event loop, which runs the IB reader, the IB
+callbacks and the WebSocket tasks, plus executor threads) at a fixed
+interval. Samples on the loop thread are rooted at the loop callback that was
+running, as reported by the loop monitor. Nothing is installed or sampled
+between profiles.
+
+The sampler only runs when it gets the GIL, which a busy loop thread hands
+over at the interpreter switch interval; that interval is shortened for the
+duration of a profile so samples aren't biased towards the loop's select().
+
+Output is either collapsed stacks (one `frame;frame;frame count` line per
+distinct stack, for flamegraph.pl or speedscope) or a speedscope JSON
+document with one sampled profile per thread.
+"""
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time as time_lib
+from app.loop_monitor import LOOP_MONITOR, describe_handle
+
+FORMATS = ('collapsed', 'speedscope')
+MAX_SECONDS = 60.0
+
+# Leaf frames that mean the thread is waiting, not running
+IDLE_FRAMES = {'select', 'poll', 'wait', '_worker', '_watch'}
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = collections.Counter()  # (thread name, frames...) -> count
+        self.interval = 0.005
+        self.started = 0.0
+        self.elapsed = 0.0
+        self.sample_count = 0
+        self._switch_interval = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: float = 0.005, include_idle: bool = False):
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        self.samples = collections.Counter()
+        self.interval = interval
+        self.sample_count = 0
+        self._stop.clear()
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, interval / 10))
+        self.started = time_lib.perf_counter()
+        self._thread = threading.Thread(target=self._sample, args=(include_idle,), name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.elapsed = time_lib.perf_counter() - self.started
+        sys.setswitchinterval(self._switch_interval)
+        self._lock.release()
+
+    def _sample(self, include_idle: bool):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            loop_thread = LOOP_MONITOR.loop_thread
+            current = LOOP_MONITOR._current
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                root = names.get(ident, str(ident))
+                if ident == loop_thread and current is not None:
+                    root = f"{root};[{describe_handle(current)}]"
+                self.samples[(root, *stack)] += 1
+            self.sample_count += 1
+
+    async def profile(self, seconds: float, interval: float = 0.005, fmt: str = 'collapsed', include_idle: bool = False):
+        """Sample the whole process for `seconds` and return the profile in `fmt`"""
+        seconds = min(max(seconds, 0.1), MAX_SECONDS)
+        self.start(interval, include_idle)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.stop()
+        return self.render(fmt)
+
+    async def profile_call(self, call, interval: float = 0.001, fmt: str = 'collapsed', include_idle: bool = False):
+        """Sample the process while awaiting `call()`; returns (result, profile)
+
+        `call` is only invoked once the profiler has started, so a busy
+        profiler doesn't leave a coroutine behind that is never awaited.
+        """
+        self.start(interval, include_idle)
+        try:
+            result = await call()
+        finally:
+            self.stop()
+        return result, self.render(fmt)
+
+    def render(self, fmt: str):
+        if fmt == 'speedscope':
+            return self.speedscope()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self, name: str = 'backend'):
+        frames, index = [], {}
+        by_thread = collections.defaultdict(list)
+        for (root, *stack), count in self.samples.items():
+            ids = []
+            for label in root.split(';')[1:] + stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append({'name': label})
+                ids.append(index[label])
+            by_thread[root.split(';')[0]].append((ids, count))
+
+        profiles = []
+        for thread, stacks in sorted(by_thread.items()):
+            profiles.append({
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(self.elapsed, 6),
+                'samples': [ids for ids, _ in stacks],
+                'weights': [count * self.interval for _, count in stacks],
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"{name} {self.elapsed:.2f}s, {self.sample_count} samples",
+            'exporter': 'app.profiler',
+            'shared': {'frames': frames},
+            'profiles': profiles,
+        }
+
+PROFILER = SamplingProfiler()
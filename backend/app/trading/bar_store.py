@@ -0,0 +1,275 @@
+"""On-disk historical bar cache
+
+Bars fetched with reqHistoricalData are kept per contract and bar size under
+BAR_STORE_DIR (default `bar_store`), one append-only file of native float64
+values per column:
+
+    bar_store/<conId>/<size>s/{time,open,high,low,close,volume}
+
+Columns are read through mmap, so a ranged query is a binary search on the
+time column and a slice of each column, without loading the files. Each
+query first brings the file up to date: only the tail after the last stored
+bar is missing, and it is taken from the live bar aggregator when that has
+been building bars since before the tail starts, otherwise requested from
+the gateway in chunks no longer than IB allows for the bar size. Data already
+on disk never goes back to the gateway, and neither does a tail that came
+back empty: each file keeps the time it is synced through. A chunk that
+fails (pacing, farm down, timeout) stops the fetch there, so the range from
+it on is requested again by the next query.
+"""
+import asyncio
+import math
+import mmap
+import os
+import struct
+import time as time_lib
+from array import array
+from bisect import bisect_left
+from datetime import datetime, date, timezone
+from app.trading.bars import COLUMNS
+from app.trading.pacing import Pacer
+
+# Bar size in seconds -> reqHistoricalData barSizeSetting
+HISTORY_BAR_SIZES = {
+    1: '1 secs', 5: '5 secs', 15: '15 secs', 30: '30 secs',
+    60: '1 min', 300: '5 mins', 900: '15 mins', 1800: '30 mins',
+    3600: '1 hour', 86400: '1 day',
+}
+
+# Longest duration IB serves in one request per bar size; also how far back an empty file starts
+MAX_REQUEST_SECONDS = {
+    1: 1800, 5: 3600, 15: 14400, 30: 28800,
+    60: 86400, 300: 7 * 86400, 900: 14 * 86400, 1800: 30 * 86400,
+    3600: 30 * 86400, 86400: 365 * 86400,
+}
+
+# Requests per tail fetch; a tail longer than this many chunks is left with a gap before it
+MAX_CHUNKS = 10
+
+ITEM = struct.calcsize('d')
+
+def duration_string(seconds: float) -> str:
+    seconds = max(1, math.ceil(seconds))
+    if seconds <= 86400:
+        return f'{seconds} S'
+    return f'{math.ceil(seconds / 86400)} D'
+
+def bar_time(value) -> float:
+    """Epoch seconds of a BarData date (UTC datetime for intraday bars, date for daily ones)"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+    return float(value)
+
+class BarFile:
+    """Bars of one contract and size: append-only column files read through mmap"""
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.files = [open(os.path.join(path, column), 'a+b') for column in COLUMNS]
+        # A crash between column writes leaves some columns longer; keep the rows every column has
+        self.count = min(os.fstat(f.fileno()).st_size for f in self.files) // ITEM
+        for f in self.files:
+            f.truncate(self.count * ITEM)
+        self.maps = None
+        self.first = self._time_at(0) if self.count else None
+        self.last = self._time_at(self.count - 1) if self.count else None
+        self.synced = self._read_synced()
+
+    def _read_synced(self):
+        try:
+            with open(os.path.join(self.path, 'synced')) as f:
+                return float(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def mark_synced(self, t: float):
+        """Record that every bar starting before `t` is stored, so a quiet tail isn't requested again"""
+        path = os.path.join(self.path, 'synced')
+        with open(path + '.tmp', 'w') as f:
+            f.write(repr(t))
+        os.replace(path + '.tmp', path)
+        self.synced = t
+
+    def _time_at(self, i: int) -> float:
+        return struct.unpack('d', os.pread(self.files[0].fileno(), ITEM, i * ITEM))[0]
+
+    def append(self, bars):
+        """Append bars (tuples in COLUMNS order) that start after the last stored one"""
+        if not bars:
+            return
+        # Time goes last, so a partial write never shows up as a complete row
+        for index in (1, 2, 3, 4, 5, 0):
+            f = self.files[index]
+            f.write(array('d', [bar[index] for bar in bars]).tobytes())
+            f.flush()
+        self._unmap()
+        if self.first is None:
+            self.first = bars[0][0]
+        self.last = bars[-1][0]
+        self.count += len(bars)
+
+    def read(self, since: float = None, until: float = None, limit: int = None):
+        """Bars starting in [since, until), oldest first, at most the last `limit` of them"""
+        if not self.count:
+            return []
+        if self.maps is None:
+            self.maps = [mmap.mmap(f.fileno(), self.count * ITEM, access=mmap.ACCESS_READ) for f in self.files]
+        views = [memoryview(m).cast('d') for m in self.maps]
+        try:
+            times = views[0]
+            first = bisect_left(times, since) if since is not None else 0
+            last = bisect_left(times, until) if until is not None else self.count
+            if limit is not None and last - first > limit:
+                first = last - limit
+            return list(zip(*(view[first:last].tolist() for view in views)))
+        finally:
+            for view in views:
+                view.release()
+
+    def _unmap(self):
+        if self.maps is not None:
+            for m in self.maps:
+                m.close()
+            self.maps = None
+
+    def close(self):
+        self._unmap()
+        for f in self.files:
+            f.close()
+
+class BarStore:
+    def __init__(self, root: str, pool, live=None, pacer: Pacer = None):
+        self.root = root
+        self.pool = pool
+        self.live = live  # BarAggregator of this session
+        # IB allows 60 historical requests per 10 minutes
+        self.pacer = pacer or Pacer(rate=60 / 600, burst=6)
+        self.files = {}  # (conId, size) -> BarFile
+        self.locks = {}  # (conId, size) -> asyncio.Lock, so one tail is fetched at a time
+        self.contracts = {}  # conId -> qualified Contract
+        self.requests = 0
+        self.fetched_bars = 0
+        self.live_bars = 0
+        self.hits = 0
+        self.errors = 0
+
+    def file(self, con_id: int, size: int) -> BarFile:
+        stored = self.files.get((con_id, size))
+        if stored is None:
+            stored = self.files[(con_id, size)] = BarFile(os.path.join(self.root, str(con_id), f'{size}s'))
+        return stored
+
+    async def bars(self, contract, size: int, since: float = None, until: float = None,
+                   limit: int = None, include_partial: bool = False):
+        """Bars of a contract starting in [since, until), bringing the file up to date first if needed"""
+        stored = self.file(contract.conId, size)
+        if until is None or stored.last is None or until > stored.last + size:
+            await self.sync(contract, size)
+        else:
+            self.hits += 1
+        bars = [dict(zip(COLUMNS, row)) for row in stored.read(since, until, limit)]
+        partial = self.live.partial(contract.conId, size) if self.live and include_partial else None
+        if partial is not None and (stored.last is None or partial[0] > stored.last) and \
+                (until is None or partial[0] < until):
+            bars.append({**dict(zip(COLUMNS, partial)), 'partial': True})
+        return bars
+
+    async def sync(self, contract, size: int, now: float = None) -> int:
+        """Append the complete bars missing after the last stored one; returns how many were added"""
+        key = (contract.conId, size)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            stored = self.file(*key)
+            now = time_lib.time() if now is None else now
+            end = now - now % size  # Bars starting before this are complete
+            start = stored.last + size if stored.count else end - MAX_REQUEST_SECONDS[size]
+            if stored.synced is not None:
+                # The tail after the last bar may hold none (closed market, halted contract)
+                start = max(start, stored.synced)
+            if start >= end:
+                self.hits += 1
+                return 0
+            live = self.live.closed_since(contract.conId, size, start) if self.live else None
+            if live is not None:
+                bars = [bar for bar in live if bar[0] < end]
+                stored.append(bars)
+                stored.mark_synced(end)
+                self.live_bars += len(bars)
+                return len(bars)
+            added, synced = await self._fetch(stored, contract, size, start, end, now)
+            if synced > start:
+                stored.mark_synced(synced)
+            return added
+
+    async def _fetch(self, stored: BarFile, contract, size: int, start: float, end: float, now: float):
+        """Request [start, end) chunk by chunk; returns the bars added and the time the fetch got through"""
+        window = MAX_REQUEST_SECONDS[size]
+        chunk_start = max(start, end - MAX_CHUNKS * window)
+        added = 0
+        while chunk_start < end:
+            chunk_end = min(chunk_start + window, end)
+            await self.pacer.acquire()
+            if chunk_end == end:
+                request_end, duration = '', now - chunk_start
+            else:
+                request_end, duration = datetime.fromtimestamp(chunk_end, timezone.utc), chunk_end - chunk_start
+            self.requests += 1
+            try:
+                result = await self.pool.req_historical_data(
+                    contract, request_end, duration_string(duration), HISTORY_BAR_SIZES[size])
+            except Exception as e:
+                print(f"Error fetching {size}s bars of {contract.localSymbol or contract.symbol}: {e!r}")
+                self.errors += 1
+                break
+            last = stored.last if stored.last is not None else -1.0
+            bars = []
+            for bar in result or []:
+                t = bar_time(bar.date)
+                if chunk_start <= t < chunk_end and t > last:
+                    bars.append((t, bar.open, bar.high, bar.low, bar.close, max(bar.volume, 0.0)))
+                    last = t
+            stored.append(bars)
+            added += len(bars)
+            chunk_start = chunk_end
+        self.fetched_bars += added
+        return added, chunk_start
+
+    def contents(self):
+        """Every stored (contract, size) with its bar count and time range"""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for con_id in sorted(os.listdir(self.root)):
+            if not con_id.isdigit():
+                continue
+            for size_dir in sorted(os.listdir(os.path.join(self.root, con_id))):
+                size = int(size_dir.rstrip('s'))
+                stored = self.file(int(con_id), size)
+                contract = self.contracts.get(int(con_id))
+                entries.append({
+                    'conId': int(con_id),
+                    'symbol': (contract.localSymbol or contract.symbol) if contract else None,
+                    'size': size,
+                    'bars': stored.count,
+                    'first': stored.first,
+                    'last': stored.last,
+                })
+        return entries
+
+    def stats(self):
+        return {
+            'files': len(self.files),
+            'requests': self.requests,
+            'fetchedBars': self.fetched_bars,
+            'liveBars': self.live_bars,
+            'hits': self.hits,
+            'errors': self.errors,
+        }
+
+    def close(self):
+        for stored in self.files.values():
+            stored.close()
+        self.files.clear()
@@ -0,0 +1,262 @@
+"""Streaming tick-to-bar aggregation
+
+Trades from market_data_monitor are folded into 1s, 5s and 1m OHLCV bars
+for every instrument with a market data subscription (SPY and the open
+positions). Each (instrument, bar size) keeps its closed bars in a
+preallocated columnar ring, so a day of bars costs a fixed amount of memory
+and a tick is a handful of float compares.
+
+A bar closes on the first trade after its end, or when the handler's
+once-a-second flush finds it has ended. Closed bars are published on the
+`bars.1s`, `bars.5s` and `bars.1m` WebSocket topics and served by
+/api/bars.
+"""
+import collections
+import time as time_lib
+from array import array
+
+# Bar size in seconds -> closed bars kept per instrument
+BAR_SIZES = {1: 3600, 5: 4680, 60: 1440}
+
+SIZE_NAMES = {1: '1s', 5: '5s', 60: '1m'}
+SIZES_BY_NAME = {name: size for size, name in SIZE_NAMES.items()}
+
+# Tick types that carry a trade: last and delayed last
+TRADE_TICKS = (4, 68)
+
+COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+class BarRing:
+    """Fixed-capacity ring of bars stored as one array per column"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.columns = [array('d', [0.0]) * capacity for _ in COLUMNS]
+        self.start = 0  # Physical index of the oldest bar
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *bar):
+        index = (self.start + self.count) % self.capacity
+        for column, value in zip(self.columns, bar):
+            column[index] = value
+        if self.count < self.capacity:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def _physical(self, i: int) -> int:
+        return (self.start + i) % self.capacity
+
+    def time_at(self, i: int) -> float:
+        return self.columns[0][self._physical(i)]
+
+    def bisect(self, t: float) -> int:
+        """Logical index of the first bar starting at or after `t`"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time_at(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def rows(self, first: int, last: int):
+        """Bars [first, last) as tuples, oldest first"""
+        columns = self.columns
+        return [tuple(column[self._physical(i)] for column in columns) for i in range(first, last)]
+
+class BarSeries:
+    """Bars of one size for one instrument: the bar being built plus the closed ones"""
+
+    def __init__(self, size: int, capacity: int):
+        self.size = size
+        self.ring = BarRing(capacity)
+        self.bar_start = None
+        self.open = self.high = self.low = self.close = 0.0
+        self.volume = 0.0
+
+    def add(self, price: float, quantity: float, now: float):
+        """Fold in a trade; returns the bar it closed, if any"""
+        start = now - now % self.size
+        closed = None
+        if self.bar_start is not None and start != self.bar_start:
+            closed = self._close()
+        if self.bar_start is None:
+            self.bar_start = start
+            self.open = self.high = self.low = price
+            self.volume = 0.0
+        elif price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += quantity
+        return closed
+
+    def close_if_due(self, now: float):
+        if self.bar_start is not None and now >= self.bar_start + self.size:
+            return self._close()
+        return None
+
+    def _close(self):
+        bar = (self.bar_start, self.open, self.high, self.low, self.close, self.volume)
+        self.ring.append(*bar)
+        self.bar_start = None
+        return bar
+
+    def partial(self):
+        if self.bar_start is None:
+            return None
+        return (self.bar_start, self.open, self.high, self.low, self.close, self.volume)
+
+def _row(row, **extra):
+    return {**dict(zip(COLUMNS, row)), **extra}
+
+class BarAggregator:
+    def __init__(self, sizes: dict = None):
+        self.sizes = dict(sizes or BAR_SIZES)
+        self.series = {}  # conId -> [BarSeries per size]
+        self.names = {}  # conId -> symbol the instrument is shown and queried by
+        self.by_name = {}  # symbol -> conId
+        self.closed = collections.deque(maxlen=10000)  # (conId, size, bar) closed since the last drain
+        self.trades = 0
+        # Called synchronously as bars close and trades arrive (the strategy runtime)
+        self.bar_listeners = []  # f(conId, symbol, size, bar)
+        self.trade_listeners = []  # f(conId, symbol, price, quantity, now)
+
+    def _series_for(self, con_id: int, name: str):
+        series = self.series.get(con_id)
+        if series is None:
+            series = self.series[con_id] = [BarSeries(size, capacity) for size, capacity in self.sizes.items()]
+            self.names[con_id] = name
+            self.by_name[name] = con_id
+        return series
+
+    def on_trade(self, con_id: int, name: str, price: float, quantity: float, now: float = None):
+        now = time_lib.time() if now is None else now
+        self.trades += 1
+        for series in self._series_for(con_id, name):
+            bar = series.add(price, quantity, now)
+            if bar is not None:
+                self._closed(con_id, series.size, bar)
+        for listener in self.trade_listeners:
+            listener(con_id, name, price, quantity, now)
+
+    def _closed(self, con_id: int, size: int, bar):
+        self.closed.append((con_id, size, bar))
+        for listener in self.bar_listeners:
+            listener(con_id, self.names[con_id], size, bar)
+
+    def on_ticker(self, ticker, now: float = None):
+        """Fold the trades of one pendingTickers update into the bars"""
+        contract = ticker.contract
+        if not contract.conId:
+            return
+        name = contract.localSymbol.replace(' ', '') if contract.secType == 'OPT' else contract.symbol
+        if ticker.ticks:
+            for tick in ticker.ticks:
+                if tick.tickType in TRADE_TICKS and tick.price > 0:
+                    self.on_trade(contract.conId, name, tick.price, tick.size if tick.size > 0 else 0.0, now)
+        elif ticker.last > 0:
+            # Simulated and replayed tickers set fields without tick-by-tick data
+            size = ticker.lastSize
+            self.on_trade(contract.conId, name, ticker.last, size if size > 0 else 0.0, now)
+
+    def close_due(self, now: float = None):
+        """Close bars whose time is up even though no trade has arrived since"""
+        now = time_lib.time() if now is None else now
+        for con_id, series_list in self.series.items():
+            for series in series_list:
+                bar = series.close_if_due(now)
+                if bar is not None:
+                    self._closed(con_id, series.size, bar)
+
+    def drain(self):
+        """Bars closed since the last drain, as {size name: [bar, ...]}"""
+        if not self.closed:
+            return {}
+        grouped = {}
+        for con_id, size, bar in self.closed:
+            grouped.setdefault(SIZE_NAMES.get(size, f'{size}s'), []).append(
+                _row(bar, conId=con_id, symbol=self.names[con_id]))
+        self.closed.clear()
+        return grouped
+
+    def resolve(self, symbol: str = None, con_id: int = None):
+        if con_id is not None:
+            return con_id if con_id in self.series else None
+        if symbol is None:
+            return None
+        return self.by_name.get(symbol.replace(' ', '').upper())
+
+    def query(self, con_id: int, size: int, since: float = None, until: float = None,
+              limit: int = None, include_partial: bool = False):
+        """Closed bars of one instrument starting in [since, until), oldest first"""
+        series = self._series(con_id, size)
+        if series is None:
+            return []
+        ring = series.ring
+        first = ring.bisect(since) if since is not None else 0
+        last = ring.bisect(until) if until is not None else len(ring)
+        if limit is not None and last - first > limit:
+            first = last - limit
+        bars = [_row(row) for row in ring.rows(first, last)]
+        partial = series.partial() if include_partial else None
+        if partial is not None and (until is None or partial[0] < until):
+            bars.append(_row(partial, partial=True))
+        return bars
+
+    def _series(self, con_id: int, size: int):
+        series_list = self.series.get(con_id)
+        if series_list is None or size not in self.sizes:
+            return None
+        return series_list[list(self.sizes).index(size)]
+
+    def closed_since(self, con_id: int, size: int, start: float):
+        """Closed bars starting at or after `start`, if this session's bars reach back before it
+
+        The oldest bar may have started before the first trade was seen, so
+        bars are only handed out when it is older than `start`; otherwise None.
+        """
+        series = self._series(con_id, size)
+        if series is None or not len(series.ring) or series.ring.time_at(0) >= start:
+            return None
+        ring = series.ring
+        return ring.rows(ring.bisect(start), len(ring))
+
+    def partial(self, con_id: int, size: int):
+        series = self._series(con_id, size)
+        return series.partial() if series is not None else None
+
+    def instruments(self):
+        return [{
+            'conId': con_id,
+            'symbol': self.names[con_id],
+            'bars': {SIZE_NAMES.get(s.size, f'{s.size}s'): len(s.ring) for s in series_list},
+        } for con_id, series_list in self.series.items()]
+
+    def stats(self):
+        return {
+            'instruments': len(self.series),
+            'trades': self.trades,
+            'pendingClosed': len(self.closed),
+        }
+
+# Unit suffixes accepted by parse_size
+SIZE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_size(size) -> int:
+    """'5s', '1m', '1h', '1d' or seconds -> seconds"""
+    if isinstance(size, str):
+        if size in SIZES_BY_NAME:
+            return SIZES_BY_NAME[size]
+        if size[-1:] in SIZE_UNITS and size[:-1].isdigit():
+            return int(size[:-1]) * SIZE_UNITS[size[-1]]
+    size = int(size)
+    if size <= 0:
+        raise ValueError(f"Invalid bar size {size}")
+    return size
@@ -0,0 +1,126 @@
+"""Multi-leg combo orders
+
+A combo signal lists its legs, each shaped like a /api/signal payload:
+
+    {"legs": [
+        {"symbol": "SPY", "action": "Buy"},
+        {"symbol": "SPY", "action": "Buy", "side": "SELL", "strike_selection": "OTM-2"},
+        {"symbol": "MES", "action": "Sell", "quantity": 1}
+    ]}
+
+`action` picks the contract as for a signal (call or put for an option, buy
+or sell for a future). `side` overrides the order side, for the short leg of
+a spread, and `strike_selection` the strike setting. All legs are resolved at
+once through the instruments' cached resolvers.
+
+Legs on the same underlying and security type go out as one native BAG
+order, which IB fills as a unit, so there is no leg risk between them. IB
+can't combine e.g. a future with an equity option, so every such group is its
+own order, placed in the same pass without waiting on the others. Either way
+the combo is one risk check, one notification and one resync.
+
+ComboBook follows each leg's fills: IB reports a BAG's legs as separate
+executions under the BAG's orderId, plus one for the combo at its net price.
+"""
+import functools
+import itertools
+import math
+import time as time_lib
+from collections import OrderedDict
+from ib_insync import Contract, ComboLeg
+
+SIDES = ('BUY', 'SELL')
+
+def combo_key(contract):
+    """Legs with the same key can trade as one BAG"""
+    return (contract.symbol, contract.secType, contract.currency)
+
+def group_legs(legs):
+    """Split (contract, side, quantity) legs into groups that can each be one order, in first-leg order"""
+    groups = {}
+    for leg in legs:
+        groups.setdefault(combo_key(leg[0]), []).append(leg)
+    return list(groups.values())
+
+def bag(legs):
+    """BAG contract of (contract, side, quantity) legs sharing an underlying, and the combo quantity to order"""
+    size = functools.reduce(math.gcd, (int(quantity) for _, _, quantity in legs))
+    first = legs[0][0]
+    contract = Contract(
+        secType='BAG', symbol=first.symbol, currency=first.currency,
+        # Option combos route SMART; futures spreads trade on the futures' exchange
+        exchange=first.exchange if first.secType == 'FUT' else 'SMART',
+    )
+    contract.comboLegs = [
+        ComboLeg(conId=leg.conId, ratio=int(quantity) // size, action=side, exchange=leg.exchange)
+        for leg, side, quantity in legs
+    ]
+    return contract, size
+
+class ComboBook:
+    def __init__(self, history: int = 200):
+        self.combos = OrderedDict()  # combo id -> record
+        self.legs = {}  # (orderId, leg conId) -> (record, leg)
+        self.ids = itertools.count(1)
+        self.history = history
+
+    def start(self, signal: dict):
+        combo_id = next(self.ids)
+        record = self.combos[combo_id] = {
+            'id': combo_id,
+            'time': time_lib.time(),
+            'signal': signal,
+            'orders': [],
+            'legs': [],
+            'status': 'working',
+            'filledAt': None,
+            'legSkew': None,  # Seconds between the first and last leg completing
+        }
+        while len(self.combos) > self.history:
+            _, evicted = self.combos.popitem(last=False)
+            for leg in evicted['legs']:
+                self.legs.pop((leg['orderId'], leg['conId']), None)
+        return record
+
+    def add_order(self, record, order_id: int, legs, native: bool):
+        """Track the (contract, side, quantity) legs an order trades"""
+        record['orders'].append({'orderId': order_id, 'native': native, 'legs': len(legs)})
+        for contract, side, quantity in legs:
+            leg = {
+                'symbol': contract.symbol,
+                'localSymbol': contract.localSymbol,
+                'conId': contract.conId,
+                'side': side,
+                'quantity': float(quantity),
+                'orderId': order_id,
+                'filled': 0.0,
+                'avgPrice': None,
+                'filledAt': None,
+            }
+            record['legs'].append(leg)
+            self.legs[(order_id, contract.conId)] = (record, leg)
+
+    def on_fill(self, trade, fill):
+        entry = self.legs.get((trade.order.orderId, fill.contract.conId))
+        if entry is None:
+            return
+        record, leg = entry
+        execution = fill.execution
+        shares, price = float(execution.shares), float(execution.price)
+        filled = leg['filled'] + shares
+        leg['avgPrice'] = round(((leg['avgPrice'] or 0.0) * leg['filled'] + price * shares) / filled, 4)
+        leg['filled'] = filled
+        if filled < leg['quantity']:
+            return
+        leg['filledAt'] = time_lib.time()
+        if all(l['filledAt'] for l in record['legs']):
+            times = [l['filledAt'] for l in record['legs']]
+            record['status'] = 'filled'
+            record['filledAt'] = max(times)
+            record['legSkew'] = round(max(times) - min(times), 6)
+
+    def get(self, combo_id: int):
+        return self.combos.get(combo_id)
+
+    def report(self):
+        return list(reversed(self.combos.values()))
@@ -0,0 +1,374 @@
+"""Binary journal of every inbound IB event
+
+Events go into fixed-size, memory-mapped segment files. Recording an event
+is a marshal.dumps of a small tuple plus two copies into the mapping, so it
+costs a few microseconds and never waits on disk; the kernel writes dirty
+pages back on its own and they survive a process crash. Segments are
+created, flushed and deleted on a background thread.
+
+Segment layout:
+
+    header   64 bytes: magic, sequence, wall-clock and monotonic start, pid
+    records  <payload length:u32><monotonic time:f64><kind:u8><marshal payload>
+
+A zero length marks the end of the written part. Contracts are written once
+per segment as CONTRACT records and referenced by conId afterwards.
+
+Read a journal with iter_events(), or from the command line:
+
+    python -m app.trading.event_journal event_journal --kind order fill
+"""
+import argparse
+import json
+import marshal
+import mmap
+import os
+import struct
+import sys
+import time as time_lib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MAGIC = b'IBEVJ1\x00\x00'
+SEGMENT_HEADER = struct.Struct('<8sQddI')  # magic, sequence, wall start, monotonic start, pid
+HEADER_SIZE = 64
+RECORD_HEADER = struct.Struct('<IdB')  # payload length, monotonic time, kind
+
+# Record kinds
+SESSION = 1
+CONTRACT = 2
+TICKER = 3
+ORDER = 4
+POSITION = 5
+PORTFOLIO = 6
+PNL = 7
+PNL_SINGLE = 8
+ERROR = 9
+FILL = 10
+COMMISSION = 11
+SIGNAL = 12
+
+KIND_NAMES = {
+    SESSION: 'session', CONTRACT: 'contract', TICKER: 'ticker', ORDER: 'order', POSITION: 'position',
+    PORTFOLIO: 'portfolio', PNL: 'pnl', PNL_SINGLE: 'pnl_single', ERROR: 'error', FILL: 'fill',
+    COMMISSION: 'commission', SIGNAL: 'signal',
+}
+KINDS_BY_NAME = {name: kind for kind, name in KIND_NAMES.items()}
+
+# Payload field names, for readers that want dicts
+FIELDS = {
+    SESSION: ('event', 'detail'),
+    CONTRACT: ('conId', 'secType', 'symbol', 'localSymbol', 'lastTradeDateOrContractMonth', 'strike', 'right',
+               'multiplier', 'exchange', 'currency'),
+    TICKER: ('conId', 'bid', 'ask', 'last', 'close', 'bidSize', 'askSize', 'lastSize'),
+    ORDER: ('orderId', 'permId', 'conId', 'action', 'totalQuantity', 'orderType', 'lmtPrice', 'auxPrice', 'status',
+            'filled', 'remaining', 'avgFillPrice'),
+    POSITION: ('account', 'conId', 'position', 'avgCost'),
+    PORTFOLIO: ('conId', 'position', 'marketPrice', 'marketValue', 'averageCost', 'unrealizedPNL', 'realizedPNL'),
+    PNL: ('dailyPnL', 'unrealizedPnL', 'realizedPnL'),
+    PNL_SINGLE: ('conId', 'dailyPnL', 'unrealizedPnL', 'realizedPnL', 'position', 'value'),
+    ERROR: ('reqId', 'errorCode', 'errorString', 'conId'),
+    FILL: ('execId', 'orderId', 'permId', 'conId', 'side', 'shares', 'price', 'execTime', 'cumQty', 'avgPrice', 'acctNumber'),
+    COMMISSION: ('execId', 'commission', 'currency', 'realizedPNL'),
+    SIGNAL: ('source', 'signal'),
+}
+
+def _num(value):
+    # IB uses nan and None for unset values; keep the payload to plain floats
+    return float(value) if value is not None else float('nan')
+
+def _definition(contract):
+    """Marshalled CONTRACT record of a contract"""
+    return marshal.dumps((
+        contract.conId, contract.secType, contract.symbol, contract.localSymbol,
+        contract.lastTradeDateOrContractMonth, _num(contract.strike), contract.right,
+        contract.multiplier, contract.exchange, contract.currency,
+    ))
+
+class EventJournal:
+    """Append-only, memory-mapped, rotating journal of inbound IB events"""
+
+    def __init__(self, directory: str, segment_size: int = 16 * 1024 * 1024, max_segments: int = 32,
+                 flush_interval: float = 1.0):
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self.enabled = False
+        self.records = 0
+        self.dropped = 0
+        self._executor = None
+        self._mm = None
+        self._file = None
+        self._pos = 0
+        self._sequence = 0
+        self._spare = None  # Future of the next pre-created segment
+        self._known_contracts = set()
+        self._last_flush = 0.0
+
+    # Segment management
+
+    def open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='event-journal')
+        existing = segment_paths(self.directory)
+        self._sequence = int(existing[-1].stem.split('-')[1]) if existing else 0
+        self._start_segment(self._create_segment(self._sequence + 1))
+        self.enabled = True
+        self.record_session('open', {'pid': os.getpid()})
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.record_session('close', None)
+        self.enabled = False
+        self._release(self._mm, self._file)
+        self._mm = self._file = None
+        if self._spare is not None:
+            spare = self._spare.result()
+            self._release(spare[2], spare[1], delete=spare[0])
+            self._spare = None
+        self._executor.shutdown(wait=True)
+
+    def _create_segment(self, sequence: int):
+        """Create and map a zero-filled segment; runs on the journal thread except for the first one"""
+        path = self.directory / f'events-{sequence:08d}.seg'
+        f = open(path, 'w+b')
+        f.truncate(self.segment_size)
+        mm = mmap.mmap(f.fileno(), self.segment_size)
+        return path, f, mm, sequence
+
+    def _start_segment(self, segment):
+        path, f, mm, sequence = segment
+        SEGMENT_HEADER.pack_into(mm, 0, MAGIC, sequence, time_lib.time(), time_lib.monotonic(), os.getpid())
+        self._file, self._mm, self._sequence = f, mm, sequence
+        self._pos = HEADER_SIZE
+        self._known_contracts = set()
+        self._spare = self._executor.submit(self._create_segment, sequence + 1)
+        self._executor.submit(self._prune)
+
+    def _rotate(self):
+        old_mm, old_file = self._mm, self._file
+        # The spare is created as soon as the previous rotation happens, so this rarely waits
+        self._start_segment(self._spare.result())
+        self._executor.submit(self._release, old_mm, old_file)
+
+    def _release(self, mm, f, delete=None):
+        try:
+            if mm is not None:
+                mm.flush()
+                mm.close()
+            if f is not None:
+                f.close()
+            if delete is not None:
+                os.unlink(delete)
+        except Exception as e:
+            print(f"Error releasing event journal segment: {e}")
+
+    def _prune(self):
+        for path in segment_paths(self.directory)[:-self.max_segments]:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                print(f"Error deleting event journal segment {path}: {e}")
+
+    def _flush(self):
+        try:
+            mm = self._mm
+            if mm is not None:
+                mm.flush()
+        except (ValueError, OSError):
+            pass  # Segment rotated and closed meanwhile
+
+    # Recording
+
+    def _append(self, kind: int, payload: tuple, contract=None):
+        """Write a record; `contract` is the one its conId refers to, defined ahead of it in every segment"""
+        if not self.enabled:
+            return
+        try:
+            records = [(kind, marshal.dumps(payload))]
+            if contract is not None and contract.conId not in self._known_contracts:
+                records.insert(0, (CONTRACT, _definition(contract)))
+        except ValueError:
+            self.dropped += 1
+            return
+        size = sum(RECORD_HEADER.size + len(data) for _, data in records)
+        if self._pos + size + RECORD_HEADER.size > self.segment_size:
+            # The definition and the record go in the same segment, so a new one needs both
+            if contract is not None and len(records) == 1:
+                records.insert(0, (CONTRACT, _definition(contract)))
+                size += RECORD_HEADER.size + len(records[0][1])
+            if HEADER_SIZE + size + RECORD_HEADER.size > self.segment_size:
+                self.dropped += 1
+                return
+            self._rotate()
+        for record_kind, data in records:
+            self._write(record_kind, data)
+        if len(records) > 1:
+            self._known_contracts.add(contract.conId)
+
+    def _write(self, kind: int, data: bytes):
+        mm = self._mm
+        start = self._pos + RECORD_HEADER.size
+        end = start + len(data)
+        # Payload first, then the header, so a crash never leaves a half record with a length
+        mm[start:end] = data
+        now = time_lib.monotonic()
+        RECORD_HEADER.pack_into(mm, self._pos, len(data), now, kind)
+        self._pos = end
+        self.records += 1
+        if now - self._last_flush >= self.flush_interval:
+            self._last_flush = now
+            self._executor.submit(self._flush)
+
+    def record_session(self, event: str, detail):
+        self._append(SESSION, (event, json.dumps(detail, default=str)))
+
+    def record_signal(self, source: str, signal):
+        self._append(SIGNAL, (source, json.dumps(signal, default=str)))
+
+    def on_tickers(self, tickers):
+        if not self.enabled:
+            return
+        for t in tickers:
+            self._append(TICKER, (
+                t.contract.conId, _num(t.bid), _num(t.ask), _num(t.last), _num(t.close),
+                _num(t.bidSize), _num(t.askSize), _num(t.lastSize),
+            ), t.contract)
+
+    def on_order(self, trade):
+        if not self.enabled:
+            return
+        order, status = trade.order, trade.orderStatus
+        self._append(ORDER, (
+            order.orderId, order.permId, trade.contract.conId, order.action, _num(order.totalQuantity),
+            order.orderType, _num(order.lmtPrice), _num(order.auxPrice), status.status, _num(status.filled),
+            _num(status.remaining), _num(status.avgFillPrice),
+        ), trade.contract)
+
+    def on_position(self, position):
+        if not self.enabled:
+            return
+        self._append(POSITION, (position.account, position.contract.conId, _num(position.position),
+                                _num(position.avgCost)), position.contract)
+
+    def on_portfolio(self, item):
+        if not self.enabled:
+            return
+        self._append(PORTFOLIO, (
+            item.contract.conId, _num(item.position), _num(item.marketPrice), _num(item.marketValue),
+            _num(item.averageCost), _num(item.unrealizedPNL), _num(item.realizedPNL),
+        ), item.contract)
+
+    def on_pnl(self, pnl):
+        self._append(PNL, (_num(pnl.dailyPnL), _num(pnl.unrealizedPnL), _num(pnl.realizedPnL)))
+
+    def on_pnl_single(self, pnl):
+        self._append(PNL_SINGLE, (pnl.conId, _num(pnl.dailyPnL), _num(pnl.unrealizedPnL), _num(pnl.realizedPnL),
+                                  _num(pnl.position), _num(pnl.value)))
+
+    def on_error(self, reqId, errorCode, errorString, contract):
+        self._append(ERROR, (reqId, errorCode, errorString, contract.conId if contract else 0))
+
+    def on_exec_details(self, trade, fill):
+        if not self.enabled:
+            return
+        e = fill.execution
+        exec_time = e.time or fill.time
+        self._append(FILL, (
+            e.execId, e.orderId, e.permId, fill.contract.conId, e.side, _num(e.shares), _num(e.price),
+            exec_time.timestamp() if exec_time else 0.0, _num(e.cumQty), _num(e.avgPrice), e.acctNumber,
+        ), fill.contract)
+
+    def on_commission_report(self, trade, fill, report):
+        self._append(COMMISSION, (report.execId, _num(report.commission), report.currency, _num(report.realizedPNL)))
+
+    def attach(self, ib):
+        """Record every inbound event of an IB client; safe to call again after reconnects"""
+        for event, handler in self._handlers(ib):
+            event -= handler
+            event += handler
+
+    def detach(self, ib):
+        for event, handler in self._handlers(ib):
+            event -= handler
+
+    def _handlers(self, ib):
+        return [
+            (ib.pendingTickersEvent, self.on_tickers),
+            (ib.openOrderEvent, self.on_order),
+            (ib.orderStatusEvent, self.on_order),
+            (ib.positionEvent, self.on_position),
+            (ib.updatePortfolioEvent, self.on_portfolio),
+            (ib.pnlEvent, self.on_pnl),
+            (ib.pnlSingleEvent, self.on_pnl_single),
+            (ib.errorEvent, self.on_error),
+            (ib.execDetailsEvent, self.on_exec_details),
+            (ib.commissionReportEvent, self.on_commission_report),
+        ]
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'directory': str(self.directory),
+            'segment': self._sequence,
+            'segmentUsed': self._pos,
+            'segmentSize': self.segment_size,
+            'records': self.records,
+            'dropped': self.dropped,
+        }
+
+def segment_paths(directory):
+    return sorted(Path(directory).glob('events-*.seg'))
+
+def read_segment(path):
+    """Yield (wall time, kind, payload tuple) from one segment, lazily"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER_SIZE:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, _, wall_start, mono_start, _ = SEGMENT_HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                return
+            pos = HEADER_SIZE
+            while pos + RECORD_HEADER.size <= size:
+                length, ts, kind = RECORD_HEADER.unpack_from(mm, pos)
+                if length == 0:
+                    return
+                start = pos + RECORD_HEADER.size
+                if start + length > size:
+                    return
+                yield wall_start + (ts - mono_start), kind, marshal.loads(mm[start:start + length])
+                pos = start + length
+
+def iter_events(directory, since: float = None, kinds=None, as_dicts: bool = False):
+    """Stream events from all segments in order, optionally filtered by wall time and kind"""
+    kinds = set(kinds) if kinds else None
+    for path in segment_paths(directory):
+        for ts, kind, payload in read_segment(path):
+            if since is not None and ts < since:
+                continue
+            if kinds is not None and kind not in kinds:
+                continue
+            if as_dicts:
+                yield {'time': ts, 'kind': KIND_NAMES.get(kind, kind), **dict(zip(FIELDS.get(kind, ()), payload))}
+            else:
+                yield ts, kind, payload
+
+def main():
+    parser = argparse.ArgumentParser(description="Print an IB event journal as JSON lines")
+    parser.add_argument('directory')
+    parser.add_argument('--since', type=float, help="Epoch seconds")
+    parser.add_argument('--kind', nargs='+', choices=sorted(KINDS_BY_NAME))
+    args = parser.parse_args()
+    kinds = [KINDS_BY_NAME[k] for k in args.kind] if args.kind else None
+    try:
+        for event in iter_events(args.directory, args.since, kinds, as_dicts=True):
+            print(json.dumps(event, default=str))
+    except BrokenPipeError:
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
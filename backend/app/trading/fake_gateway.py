@@ -0,0 +1,871 @@
+"""In-process simulated IB Gateway
+
+Implements the part of the ib_insync `IB` surface that IBHandler and the
+connection pool use, backed by one shared FakeGateway holding prices,
+positions and executions. Use it in place of a live gateway:
+
+    gateway = FakeGateway(seed=1, tick_rate=50, fill_model='partial')
+    handler = IBHandler(settings, ib_factory=gateway.client)
+
+Latencies, tick rates and fills are driven by a seeded random generator,
+so runs are repeatable. Failures can be injected with inject_error(),
+simulate_connectivity_loss(), fail_next() and the pacing limit.
+"""
+import asyncio
+import copy
+import math
+import os
+import random
+import time as time_lib
+from collections import deque
+from datetime import datetime, date, timedelta, timezone
+from eventkit import Event
+from ib_insync import IB, Stock, Future, Option, Ticker, Trade, OrderStatus, Execution, Fill, CommissionReport, \
+    Position, PortfolioItem, PnL, PnLSingle, OptionChain, ContractDetails, TradeLogEntry, BarData, BarDataList, util
+
+# Instruments the gateway knows about; futures and options are listed on demand
+UNDERLYINGS = {
+    'SPY': {'secType': 'STK', 'exchange': 'SMART', 'primaryExchange': 'ARCA', 'conId': 756733, 'price': 500.0, 'tick': 0.01},
+    'QQQ': {'secType': 'STK', 'exchange': 'SMART', 'primaryExchange': 'NASDAQ', 'conId': 320227571, 'price': 430.0, 'tick': 0.01},
+    'IWM': {'secType': 'STK', 'exchange': 'SMART', 'primaryExchange': 'ARCA', 'conId': 9579970, 'price': 210.0, 'tick': 0.01},
+    'MES': {'secType': 'FUT', 'exchange': 'CME', 'multiplier': '5', 'price': 5000.0, 'tick': 0.25},
+    'ES': {'secType': 'FUT', 'exchange': 'CME', 'multiplier': '50', 'price': 5000.0, 'tick': 0.25},
+    'MNQ': {'secType': 'FUT', 'exchange': 'CME', 'multiplier': '2', 'price': 18000.0, 'tick': 0.25},
+    'NQ': {'secType': 'FUT', 'exchange': 'CME', 'multiplier': '20', 'price': 18000.0, 'tick': 0.25},
+}
+
+MONTH_CODES = 'FGHJKMNQUVXZ'
+
+# Simulated request latencies in seconds
+DEFAULT_LATENCY = {
+    'connect': 0.01,
+    'qualifyContracts': 0.002,
+    'reqSecDefOptParams': 0.005,
+    'reqContractDetails': 0.003,
+    'reqTickers': 0.005,
+    'reqHistoricalData': 0.05,
+    'reqPositions': 0.002,
+    'reqExecutions': 0.005,
+    'ack': 0.001,
+    'fill': 0.005,
+}
+
+ERROR_MESSAGES = {
+    100: 'Max rate of messages per second has been exceeded:max=50 rec=51 (1)',
+    200: 'No security definition has been found for the request',
+    201: 'Order rejected - reason:Simulated rejection',
+    1100: 'Connectivity between IB and Trader Workstation has been lost.',
+    1102: 'Connectivity between IB and Trader Workstation has been restored - data maintained.',
+    10275: 'Positions are not available for this account.',
+}
+
+FILL_MODELS = ('immediate', 'partial', 'reject')
+
+# Historical request strings -> seconds
+DURATION_UNITS = {'S': 1, 'D': 86400, 'W': 7 * 86400, 'M': 30 * 86400, 'Y': 365 * 86400}
+BAR_SIZE_UNITS = {'sec': 1, 'secs': 1, 'min': 60, 'mins': 60, 'hour': 3600, 'hours': 3600, 'day': 86400}
+
+def third_friday(year: int, month: int) -> date:
+    first = date(year, month, 1)
+    return first + timedelta(days=(4 - first.weekday()) % 7 + 14)
+
+class FakeIB:
+    """One simulated client connection; mirrors the ib_insync IB methods the app calls"""
+
+    def __init__(self, gateway: 'FakeGateway'):
+        self.gateway = gateway
+        self.client_id = None
+        self.connected = False
+        self.market_data_type = 1
+        self.tickers = {}  # conId -> Ticker
+        self._trades = {}  # orderId -> Trade
+        self.pnl = None
+        self.pnl_singles = {}  # conId -> PnLSingle
+        self._next_order_id = 1
+        self._next_req_id = 1
+        self._sent = deque()  # Send times inside the last second, for pacing
+
+        self.connectedEvent = Event('connectedEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+        self.openOrderEvent = Event('openOrderEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.commissionReportEvent = Event('commissionReportEvent')
+        self.positionEvent = Event('positionEvent')
+        self.updatePortfolioEvent = Event('updatePortfolioEvent')
+        self.pendingTickersEvent = Event('pendingTickersEvent')
+        self.pnlEvent = Event('pnlEvent')
+        self.pnlSingleEvent = Event('pnlSingleEvent')
+        self.errorEvent = Event('errorEvent')
+
+    # Connection
+
+    async def connectAsync(self, host='127.0.0.1', port=4001, clientId=1, timeout=4, readonly=False, account=''):
+        await self.gateway._delay('connect')
+        if not self.gateway.accepting:
+            raise ConnectionRefusedError(f"Simulated gateway refused connection on {host}:{port}")
+        if any(c.connected and c.client_id == clientId for c in self.gateway.clients):
+            raise ConnectionError(f"Client id {clientId} is already in use")
+        self.client_id = clientId
+        self.connected = True
+        self.gateway._attach(self)
+        self.connectedEvent.emit()
+        return self
+
+    def isConnected(self) -> bool:
+        return self.connected
+
+    def disconnect(self):
+        if not self.connected:
+            return
+        self.connected = False
+        self.tickers.clear()
+        self.pnl = None
+        self.pnl_singles.clear()
+        self.gateway._detach(self)
+        self.disconnectedEvent.emit()
+
+    def _send(self, count: int = 1):
+        """Account for outgoing messages; too many per second triggers error 100"""
+        if not self.connected:
+            raise ConnectionError('Not connected')
+        limit = self.gateway.max_msg_rate
+        if not limit:
+            return
+        now = time_lib.monotonic()
+        sent = self._sent
+        for _ in range(count):
+            sent.append(now)
+        while sent and now - sent[0] > 1.0:
+            sent.popleft()
+        if len(sent) > limit:
+            self.gateway.pacing_violations += 1
+            self._error(-1, 100)
+
+    def _req_id(self) -> int:
+        req_id = self._next_req_id
+        self._next_req_id += 1
+        return req_id
+
+    def _error(self, reqId, code, message=None, contract=None):
+        self.errorEvent.emit(reqId, code, message or ERROR_MESSAGES.get(code, 'Simulated error'), contract)
+
+    def reqMarketDataType(self, marketDataType: int):
+        self._send()
+        self.market_data_type = marketDataType
+
+    # Reference data
+
+    async def qualifyContractsAsync(self, *contracts):
+        self._send(len(contracts))
+        await self.gateway._delay('qualifyContracts')
+        qualified = []
+        for contract in contracts:
+            resolved = self.gateway.resolve(contract)
+            if resolved is None:
+                self._error(self._req_id(), 200, contract=contract)
+                continue
+            util.dataclassUpdate(contract, resolved)
+            qualified.append(contract)
+        return qualified
+
+    async def reqSecDefOptParamsAsync(self, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        self._send()
+        await self.gateway._delay('reqSecDefOptParams')
+        spec = UNDERLYINGS.get(underlyingSymbol)
+        if not spec or spec['secType'] != underlyingSecType:
+            self._error(self._req_id(), 200)
+            return []
+        return [self.gateway.option_chain(underlyingSymbol, underlyingConId)]
+
+    async def reqContractDetailsAsync(self, contract):
+        self._send()
+        await self.gateway._delay('reqContractDetails')
+        if contract.secType == 'FUT' and not contract.conId and not contract.lastTradeDateOrContractMonth:
+            # A future without a month lists every month, like the real gateway
+            listed = self.gateway.listed_futures(contract.symbol)
+        else:
+            resolved = self.gateway.resolve(contract)
+            listed = [resolved] if resolved is not None else []
+        if not listed:
+            self._error(self._req_id(), 200, contract=contract)
+        return [ContractDetails(
+            contract=copy.copy(resolved),
+            marketName=resolved.tradingClass,
+            contractMonth=resolved.lastTradeDateOrContractMonth[:6] if resolved.secType == 'FUT' else '',
+            realExpirationDate=resolved.lastTradeDateOrContractMonth,
+            minTick=self.gateway.min_tick(resolved),
+            orderTypes='LMT,MKT,STP,TRAIL',
+            validExchanges=resolved.exchange,
+            underConId=UNDERLYINGS.get(resolved.symbol, {}).get('conId', 0),
+        ) for resolved in listed]
+
+    # Market data
+
+    def reqMktData(self, contract, genericTickList='', snapshot=False, regulatorySnapshot=False, mktDataOptions=None):
+        self._send()
+        resolved = self.gateway.resolve(contract)
+        ticker = Ticker(contract=contract)
+        if resolved is None:
+            self._error(self._req_id(), 200, contract=contract)
+            return ticker
+        self.tickers[resolved.conId] = ticker
+        self.gateway._update_ticker(ticker, resolved)
+        return ticker
+
+    async def reqTickersAsync(self, *contracts):
+        """Snapshot tickers; `volumes` on the gateway sets the day's volume by conId"""
+        self._send(len(contracts))
+        await self.gateway._delay('reqTickers')
+        tickers = []
+        for contract in contracts:
+            resolved = self.gateway.resolve(contract)
+            if resolved is None:
+                self._error(self._req_id(), 200, contract=contract)
+                continue
+            ticker = Ticker(contract=contract)
+            self.gateway._update_ticker(ticker, resolved)
+            ticker.volume = self.gateway.volumes.get(resolved.conId, float('nan'))
+            tickers.append(ticker)
+        return tickers
+
+    def cancelMktData(self, contract):
+        self._send()
+        self.tickers.pop(contract.conId, None)
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime, durationStr, barSizeSetting, whatToShow,
+                                     useRTH, formatDate=1, keepUpToDate=False, chartOptions=(), timeout=60):
+        """Bars ending at `endDateTime` ('' = now); the same bar time always has the same prices"""
+        self._send()
+        bars = BarDataList()
+        bars.reqId = self._req_id()
+        await self.gateway._delay('reqHistoricalData')
+        resolved = self.gateway.resolve(contract)
+        if resolved is None:
+            self._error(bars.reqId, 200, contract=contract)
+            return bars
+        count, unit = durationStr.split()
+        duration = int(count) * DURATION_UNITS[unit]
+        count, unit = barSizeSetting.split()
+        size = int(count) * BAR_SIZE_UNITS[unit]
+        end = endDateTime.timestamp() if isinstance(endDateTime, datetime) else time_lib.time()
+        self.gateway.history_requests.append((resolved.conId, end - duration, end, size))
+        start = end - duration
+        first = start - start % size
+        bars.extend(self.gateway.history_bar(resolved, t, size) for t in range(int(first), int(end), size))
+        return bars
+
+    # Orders
+
+    def placeOrder(self, contract, order):
+        self._send()
+        self.gateway.account = self.gateway.account or order.account or None
+        if not order.orderId:
+            order.orderId = self._next_order_id
+            self._next_order_id += 1
+        order.clientId = self.client_id
+        order.permId = self.gateway._perm_id()
+        status = OrderStatus(orderId=order.orderId, status='PendingSubmit', remaining=order.totalQuantity)
+        trade = Trade(contract, order, status, [], [TradeLogEntry(datetime.now(timezone.utc), 'PendingSubmit', '')])
+        self._trades[order.orderId] = trade
+        asyncio.get_event_loop().create_task(self.gateway._work_order(self, trade))
+        return trade
+
+    def cancelOrder(self, order):
+        self._send()
+        trade = self._trades.get(order.orderId)
+        if trade and trade.orderStatus.status not in ('Filled', 'Cancelled', 'Inactive'):
+            trade.orderStatus.status = 'PendingCancel'
+            asyncio.get_event_loop().create_task(self.gateway._cancel_order(self, trade))
+        return trade
+
+    def trades(self):
+        return list(self._trades.values())
+
+    def openTrades(self):
+        return [t for t in self._trades.values() if t.orderStatus.status not in ('Filled', 'Cancelled', 'Inactive')]
+
+    # Account
+
+    def positions(self, account=''):
+        return self.gateway.position_list(account)
+
+    async def reqPositionsAsync(self):
+        self._send()
+        await self.gateway._delay('reqPositions')
+        if self.gateway.positions_unavailable:
+            self._error(-1, 10275)
+            return []
+        return self.gateway.position_list()
+
+    def portfolio(self, account=''):
+        return self.gateway.portfolio_items(account)
+
+    async def reqExecutionsAsync(self, execFilter=None):
+        self._send()
+        await self.gateway._delay('reqExecutions')
+        since = None
+        if execFilter is not None and execFilter.time:
+            since = datetime.strptime(execFilter.time, '%Y%m%d-%H:%M:%S').replace(tzinfo=timezone.utc)
+        acct = execFilter.acctCode if execFilter is not None else ''
+        return [
+            fill for fill in self.gateway.executions
+            if (not acct or fill.execution.acctNumber == acct) and (since is None or fill.time >= since)
+        ]
+
+    def reqPnL(self, account, modelCode=''):
+        self._send()
+        if self.gateway.positions_unavailable:
+            self._error(-1, 10275)
+        self.pnl = PnL(account=account, modelCode=modelCode)
+        return self.pnl
+
+    def cancelPnL(self, account, modelCode=''):
+        self._send()
+        self.pnl = None
+
+    def reqPnLSingle(self, account, modelCode, conId):
+        self._send()
+        if self.gateway.positions_unavailable:
+            self._error(-1, 10275)
+        pnl_single = PnLSingle(account=account, modelCode=modelCode, conId=conId)
+        self.pnl_singles[conId] = pnl_single
+        return pnl_single
+
+    def cancelPnLSingle(self, account, modelCode, conId):
+        self._send()
+        self.pnl_singles.pop(conId, None)
+
+class FakeGateway:
+    """Shared simulated market and account behind every FakeIB client
+
+    - latency: per-request delay in seconds, merged over DEFAULT_LATENCY
+    - jitter: random extra delay as a fraction of each latency
+    - tick_rate: price updates per second per subscribed instrument
+    - fill_model: 'immediate' (one fill), 'partial' (`partial_fills` slices)
+      or 'reject' (orders go Inactive with error 201)
+    - slippage: price units added against the taker on every fill
+    - max_msg_rate: messages per second per client before error 100 (0 = off)
+
+    Without an `account` the gateway adopts the account of the first order.
+    """
+
+    def __init__(self, account: str = None, seed: int = 0, latency: dict = None, jitter: float = 0.0,
+                 tick_rate: float = 4.0, volatility: float = 0.0002, fill_model: str = 'immediate',
+                 partial_fills: int = 3, slippage: float = 0.0, commission: float = 0.65,
+                 max_msg_rate: int = 50, pnl_interval: float = 1.0):
+        if fill_model not in FILL_MODELS:
+            raise ValueError(f"Unknown fill model {fill_model!r}; expected one of {FILL_MODELS}")
+        self.account = account
+        self.rng = random.Random(seed)
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.jitter = jitter
+        self.tick_rate = tick_rate
+        self.volatility = volatility
+        self.fill_model = fill_model
+        self.partial_fills = max(1, partial_fills)
+        self.slippage = slippage
+        self.commission = commission
+        self.max_msg_rate = max_msg_rate
+        self.pnl_interval = pnl_interval
+
+        self.accepting = True
+        self.positions_unavailable = False
+        self.pacing_violations = 0
+        self.clients = []
+        self.prices = {symbol: spec['price'] for symbol, spec in UNDERLYINGS.items()}
+        self.contracts = {}  # conId -> qualified Contract
+        self._contract_keys = {}  # (secType, symbol, expiry, strike, right) -> conId
+        self.positions = {}  # conId -> [quantity, average price]
+        self.volumes = {}  # conId -> day volume reported by snapshot tickers
+        self.history_requests = []  # (conId, start, end, bar size) of every reqHistoricalData
+        self.realized = {}  # conId -> realized PnL today
+        self.executions = []
+        self._next_con_id = 900000000
+        self._next_perm_id = 1000000
+        self._next_exec_id = 1
+        self._failures = {}  # request name -> deque of exceptions to raise
+        self._task = None
+
+        for symbol, spec in UNDERLYINGS.items():
+            if spec['secType'] == 'STK':
+                contract = Stock(symbol, spec['exchange'], 'USD', primaryExchange=spec['primaryExchange'],
+                                 conId=spec['conId'], localSymbol=symbol, tradingClass=symbol)
+                self._register(contract, ('STK', symbol, '', 0.0, ''))
+
+    def client(self) -> FakeIB:
+        """Factory for new client connections, usable as IBHandler's ib_factory"""
+        return FakeIB(self)
+
+    # Failure injection
+
+    def inject_error(self, code: int, message: str = None, reqId: int = -1):
+        """Emit an error to every connected client"""
+        for client in list(self.clients):
+            client._error(reqId, code, message)
+
+    async def simulate_connectivity_loss(self, duration: float):
+        """Gateway loses its upstream link: 1100, orders stall, then 1102"""
+        self.inject_error(1100)
+        self.accepting = False
+        await asyncio.sleep(duration)
+        self.accepting = True
+        self.inject_error(1102)
+
+    def fail_next(self, request: str, exception: Exception = None, count: int = 1):
+        """Make the next `count` calls of an async request raise, e.g. fail_next('qualifyContracts')"""
+        queue = self._failures.setdefault(request, deque())
+        for _ in range(count):
+            queue.append(exception or asyncio.TimeoutError())
+
+    async def _delay(self, request: str):
+        failures = self._failures.get(request)
+        if failures:
+            raise failures.popleft()
+        seconds = self.latency.get(request, 0)
+        if self.jitter:
+            seconds += seconds * self.jitter * self.rng.random()
+        if seconds:
+            await asyncio.sleep(seconds)
+        else:
+            await asyncio.sleep(0)
+
+    # Client lifecycle
+
+    def _attach(self, client: FakeIB):
+        if client not in self.clients:
+            self.clients.append(client)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def _detach(self, client: FakeIB):
+        if client in self.clients:
+            self.clients.remove(client)
+        if not self.clients and self._task:
+            self._task.cancel()
+            self._task = None
+
+    def close(self):
+        for client in list(self.clients):
+            client.disconnect()
+
+    # Contracts
+
+    def _register(self, contract, key):
+        self.contracts[contract.conId] = contract
+        self._contract_keys[key] = contract.conId
+        return contract
+
+    def _new_con_id(self) -> int:
+        self._next_con_id += 1
+        return self._next_con_id
+
+    def resolve(self, contract):
+        """Qualified copy of a contract, listing futures and options on first use"""
+        if contract.conId:
+            found = self.contracts.get(contract.conId)
+            return copy.copy(found) if found else None
+
+        spec = UNDERLYINGS.get(contract.symbol)
+        if not spec:
+            return None
+        sec_type = contract.secType
+        if sec_type == 'STK' and spec['secType'] == 'STK':
+            return copy.copy(self.contracts[spec['conId']])
+        if sec_type == 'FUT' and spec['secType'] == 'FUT':
+            return copy.copy(self._future(contract.symbol, contract.lastTradeDateOrContractMonth))
+        if sec_type == 'OPT' and spec['secType'] == 'STK':
+            return copy.copy(self._option(contract))
+        return None
+
+    def seed_position(self, contract, quantity: float, avg_price: float):
+        """Start with an open position, as if opened before this session"""
+        resolved = self.resolve(contract)
+        if resolved is None:
+            raise ValueError(f"Unknown contract {contract}")
+        self.positions[resolved.conId] = [float(quantity), float(avg_price)]
+        return resolved
+
+    def _future(self, symbol, expiry):
+        if not expiry or len(expiry) < 6:
+            return None
+        year, month = int(expiry[:4]), int(expiry[4:6])
+        key = ('FUT', symbol, f'{year:04d}{month:02d}', 0.0, '')
+        if key in self._contract_keys:
+            return self.contracts[self._contract_keys[key]]
+        spec = UNDERLYINGS[symbol]
+        last_trade = expiry if len(expiry) == 8 else third_friday(year, month).strftime('%Y%m%d')
+        contract = Future(
+            symbol=symbol, lastTradeDateOrContractMonth=last_trade, exchange=spec['exchange'], currency='USD',
+            multiplier=spec['multiplier'], conId=self._new_con_id(),
+            localSymbol=f"{symbol}{MONTH_CODES[month - 1]}{year % 10}", tradingClass=symbol,
+        )
+        return self._register(contract, key)
+
+    def listed_futures(self, symbol, count: int = 4):
+        """The next `count` quarterly months of a future, nearest first"""
+        spec = UNDERLYINGS.get(symbol)
+        if not spec or spec['secType'] != 'FUT':
+            return []
+        today = datetime.now().date()
+        year, month = today.year, today.month
+        listed = []
+        while len(listed) < count:
+            if month % 3 == 0 and third_friday(year, month) >= today:
+                listed.append(self._future(symbol, f'{year:04d}{month:02d}'))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return listed
+
+    def _option(self, contract):
+        expiry, strike, right = contract.lastTradeDateOrContractMonth, float(contract.strike or 0), contract.right
+        if len(expiry or '') != 8 or right not in ('C', 'P') or strike <= 0 or strike != round(strike):
+            return None
+        key = ('OPT', contract.symbol, expiry, strike, right)
+        if key in self._contract_keys:
+            return self.contracts[self._contract_keys[key]]
+        option = Option(
+            symbol=contract.symbol, lastTradeDateOrContractMonth=expiry, strike=strike, right=right,
+            exchange='SMART', currency='USD', multiplier='100', conId=self._new_con_id(),
+            localSymbol=f"{contract.symbol:<6}{expiry[2:]}{right}{int(strike * 1000):08d}", tradingClass=contract.symbol,
+        )
+        return self._register(option, key)
+
+    def option_chain(self, symbol, underlying_con_id):
+        """Daily expirations for two weeks and $1 strikes around the current price"""
+        today = datetime.now().date()
+        expirations = []
+        day = today
+        while len(expirations) < 10:
+            if day.weekday() < 5:
+                expirations.append(day.strftime('%Y%m%d'))
+            day += timedelta(days=1)
+        center = round(self.prices[symbol])
+        strikes = [float(k) for k in range(center - 50, center + 51)]
+        return OptionChain('SMART', underlying_con_id, symbol, '100', expirations, strikes)
+
+    def min_tick(self, contract) -> float:
+        if contract.secType == 'OPT':
+            return 0.01
+        return UNDERLYINGS.get(contract.symbol, {}).get('tick', 0.01)
+
+    def _multiplier(self, contract) -> float:
+        return float(contract.multiplier) if contract.multiplier else 1.0
+
+    # Prices
+
+    def mark(self, contract) -> float:
+        underlying = self.prices[contract.symbol]
+        if contract.secType != 'OPT':
+            return underlying
+        intrinsic = max(0.0, underlying - contract.strike) if contract.right == 'C' else max(0.0, contract.strike - underlying)
+        time_value = 1.5 * math.exp(-abs(underlying - contract.strike) / 10)
+        return round(max(0.01, intrinsic + time_value), 2)
+
+    def history_bar(self, contract, t: int, size: int):
+        """Bar of `size` seconds starting at `t`, seeded by contract and time so every request agrees"""
+        rng = random.Random(contract.conId * 1000003 + t * 7 + size)
+        base = self.mark(contract) if contract.secType == 'OPT' else UNDERLYINGS[contract.symbol]['price']
+        tick = self.min_tick(contract)
+        center = base * (1 + 0.002 * math.sin(t / 3600.0))
+        open_, close = (round(center * (1 + rng.gauss(0, self.volatility)) / tick) * tick for _ in range(2))
+        high = max(open_, close) + tick * rng.randint(0, 3)
+        low = max(tick, min(open_, close) - tick * rng.randint(0, 3))
+        volume = float(rng.randint(1, 50) * size)
+        date = datetime.fromtimestamp(t, timezone.utc) if size < 86400 else datetime.fromtimestamp(t, timezone.utc).date()
+        return BarData(date=date, open=round(open_, 2), high=round(high, 2), low=round(low, 2), close=round(close, 2),
+                       volume=volume, average=round((high + low) / 2, 2), barCount=int(volume // 10) + 1)
+
+    def _update_ticker(self, ticker, contract):
+        price = self.mark(contract)
+        spread = self.min_tick(contract)
+        ticker.time = datetime.now(timezone.utc)
+        ticker.last = price
+        ticker.bid = round(price - spread, 2)
+        ticker.ask = round(price + spread, 2)
+        ticker.bidSize = ticker.askSize = 10
+        ticker.lastSize = 1
+        if ticker.close != ticker.close:  # nan until the first update
+            ticker.close = price
+
+    async def _run(self):
+        """Random-walk prices and push ticks, PnL updates and resting-order fills"""
+        interval = 1.0 / self.tick_rate if self.tick_rate else 1.0
+        next_pnl = time_lib.monotonic() + self.pnl_interval
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                if self.tick_rate:
+                    for symbol, spec in UNDERLYINGS.items():
+                        price = self.prices[symbol] * (1 + self.rng.gauss(0, self.volatility))
+                        self.prices[symbol] = round(round(price / spec['tick']) * spec['tick'], 2)
+                    for client in list(self.clients):
+                        updated = set()
+                        for conId, ticker in client.tickers.items():
+                            contract = self.contracts.get(conId)
+                            if contract:
+                                self._update_ticker(ticker, contract)
+                                updated.add(ticker)
+                        if updated:
+                            client.pendingTickersEvent.emit(updated)
+                if time_lib.monotonic() >= next_pnl:
+                    next_pnl += self.pnl_interval
+                    self._publish_pnl()
+        except asyncio.CancelledError:
+            pass
+
+    # Orders and fills
+
+    def _perm_id(self) -> int:
+        self._next_perm_id += 1
+        return self._next_perm_id
+
+    def _set_status(self, client, trade, status, message=''):
+        trade.orderStatus.status = status
+        trade.log.append(TradeLogEntry(datetime.now(timezone.utc), status, message))
+        client.orderStatusEvent.emit(trade)
+        client.openOrderEvent.emit(trade)
+
+    async def _work_order(self, client, trade):
+        try:
+            await self._delay('ack')
+            if not client.connected:
+                return
+            if self.fill_model == 'reject':
+                client._error(trade.order.orderId, 201)
+                self._set_status(client, trade, 'Inactive', ERROR_MESSAGES[201])
+                return
+            self._set_status(client, trade, 'Submitted')
+
+            if trade.order.orderType == 'LMT':
+                # Resting limit orders are checked against the market at fill-latency intervals
+                while trade.orderStatus.status == 'Submitted' and client.connected:
+                    if self._marketable(trade):
+                        break
+                    await self._delay('fill')
+            slices = self.partial_fills if self.fill_model == 'partial' else 1
+            quantity = float(trade.order.totalQuantity)
+            for n in range(slices):
+                await self._delay('fill')
+                if trade.orderStatus.status not in ('Submitted', 'PreSubmitted') or not client.connected:
+                    return
+                while not self.accepting:
+                    await asyncio.sleep(0.05)
+                remaining = quantity - trade.orderStatus.filled
+                shares = remaining if n == slices - 1 else max(1.0, math.floor(quantity / slices))
+                shares = min(shares, remaining)
+                if shares > 0:
+                    self._fill(client, trade, shares)
+        except Exception as e:
+            print(f"Simulated gateway error working order {trade.order.orderId}: {e}")
+
+    def _marketable(self, trade) -> bool:
+        price = self.mark(self.contracts.get(trade.contract.conId) or trade.contract)
+        if trade.order.action == 'BUY':
+            return price <= trade.order.lmtPrice
+        return price >= trade.order.lmtPrice
+
+    async def _cancel_order(self, client, trade):
+        await self._delay('ack')
+        if trade.orderStatus.status == 'PendingCancel':
+            self._set_status(client, trade, 'Cancelled')
+
+    def _fill(self, client, trade, shares):
+        if trade.contract.secType == 'BAG':
+            return self._fill_combo(client, trade, shares)
+        contract = self.contracts.get(trade.contract.conId) or self.resolve(trade.contract)
+        order = trade.order
+        spread = self.min_tick(contract)
+        buy = order.action == 'BUY'
+        price = self.mark(contract) + (spread + self.slippage) * (1 if buy else -1)
+        if order.orderType == 'LMT':
+            price = min(price, order.lmtPrice) if buy else max(price, order.lmtPrice)
+        price = round(price, 2)
+
+        status = trade.orderStatus
+        cum_qty = status.filled + shares
+        avg_price = (status.avgFillPrice * status.filled + price * shares) / cum_qty
+        now = datetime.now(timezone.utc)
+        exec_id = f"{order.permId:08x}.{self._next_exec_id:08x}.01.01"
+        self._next_exec_id += 1
+        execution = Execution(
+            execId=exec_id, time=now, acctNumber=order.account or self.account, exchange=contract.exchange,
+            side='BOT' if buy else 'SLD', shares=shares, price=price, permId=order.permId,
+            clientId=client.client_id, orderId=order.orderId, cumQty=cum_qty, avgPrice=round(avg_price, 4),
+        )
+        fill = Fill(contract, execution, CommissionReport(), now)
+        realized = self._apply_position(contract, shares if buy else -shares, price)
+
+        status.filled = cum_qty
+        status.remaining = float(order.totalQuantity) - cum_qty
+        status.avgFillPrice = avg_price
+        status.lastFillPrice = price
+        trade.fills.append(fill)
+        self.executions.append(fill)
+        client.execDetailsEvent.emit(trade, fill)
+        self._set_status(client, trade, 'Filled' if status.remaining <= 0 else 'Submitted')
+
+        report = fill.commissionReport
+        report.execId = exec_id
+        report.commission = round(self.commission * shares, 2)
+        report.currency = 'USD'
+        report.realizedPNL = realized
+        client.commissionReportEvent.emit(trade, fill, report)
+        self._publish_position(contract.conId)
+
+    def _fill_combo(self, client, trade, shares):
+        """Fill `shares` combos: an execution per leg at its own price, then one for the BAG at the net price"""
+        order = trade.order
+        buy = order.action == 'BUY'
+        status = trade.orderStatus
+        cum_qty = status.filled + shares
+        now = datetime.now(timezone.utc)
+        net = 0.0
+        for leg in trade.contract.comboLegs:
+            contract = self.contracts[leg.conId]
+            leg_buy = (leg.action == 'BUY') == buy
+            price = round(self.mark(contract) + (self.min_tick(contract) + self.slippage) * (1 if leg_buy else -1), 2)
+            net += price * leg.ratio * (1 if leg.action == 'BUY' else -1)
+            leg_shares = shares * leg.ratio
+            exec_id = f"{order.permId:08x}.{self._next_exec_id:08x}.01.01"
+            self._next_exec_id += 1
+            execution = Execution(
+                execId=exec_id, time=now, acctNumber=order.account or self.account, exchange=contract.exchange,
+                side='BOT' if leg_buy else 'SLD', shares=leg_shares, price=price, permId=order.permId,
+                clientId=client.client_id, orderId=order.orderId, cumQty=cum_qty * leg.ratio, avgPrice=price,
+            )
+            fill = Fill(contract, execution, CommissionReport(), now)
+            realized = self._apply_position(contract, leg_shares if leg_buy else -leg_shares, price)
+            trade.fills.append(fill)
+            self.executions.append(fill)
+            client.execDetailsEvent.emit(trade, fill)
+            report = fill.commissionReport
+            report.execId = exec_id
+            report.commission = round(self.commission * leg_shares, 2)
+            report.currency = 'USD'
+            report.realizedPNL = realized
+            client.commissionReportEvent.emit(trade, fill, report)
+            self._publish_position(contract.conId)
+
+        net = round(net, 4)
+        avg_price = (status.avgFillPrice * status.filled + net * shares) / cum_qty
+        exec_id = f"{order.permId:08x}.{self._next_exec_id:08x}.01.01"
+        self._next_exec_id += 1
+        execution = Execution(
+            execId=exec_id, time=now, acctNumber=order.account or self.account, exchange=trade.contract.exchange,
+            side='BOT' if buy else 'SLD', shares=shares, price=net, permId=order.permId,
+            clientId=client.client_id, orderId=order.orderId, cumQty=cum_qty, avgPrice=round(avg_price, 4),
+        )
+        fill = Fill(trade.contract, execution, CommissionReport(), now)
+        status.filled = cum_qty
+        status.remaining = float(order.totalQuantity) - cum_qty
+        status.avgFillPrice = avg_price
+        status.lastFillPrice = net
+        trade.fills.append(fill)
+        self.executions.append(fill)
+        client.execDetailsEvent.emit(trade, fill)
+        self._set_status(client, trade, 'Filled' if status.remaining <= 0 else 'Submitted')
+
+    def _apply_position(self, contract, quantity, price) -> float:
+        """Average-cost position update, as IB reports it; returns realized PnL"""
+        multiplier = self._multiplier(contract)
+        position, avg = self.positions.get(contract.conId, [0.0, 0.0])
+        realized = 0.0
+        if position == 0 or (position > 0) == (quantity > 0):
+            total = position + quantity
+            avg = (avg * position + price * quantity) / total
+            position = total
+        else:
+            closed = min(abs(quantity), abs(position))
+            realized = (price - avg) * closed * multiplier * (1 if position > 0 else -1)
+            position += quantity
+            if position == 0:
+                avg = 0.0
+            elif (position > 0) != (position - quantity > 0):
+                avg = price  # Flipped through zero
+        self.positions[contract.conId] = [position, avg]
+        self.realized[contract.conId] = self.realized.get(contract.conId, 0.0) + realized
+        return realized
+
+    # Account updates
+
+    def _position_contract(self, conId):
+        # Position messages carry contracts without an exchange, so the app requalifies them
+        contract = copy.copy(self.contracts[conId])
+        contract.exchange = ''
+        return contract
+
+    def _is_account(self, account) -> bool:
+        return not account or not self.account or account == self.account
+
+    def position_list(self, account=''):
+        return [
+            Position(self.account, self._position_contract(conId), position,
+                     avg * self._multiplier(self.contracts[conId]))
+            for conId, (position, avg) in self.positions.items()
+            if position and self._is_account(account)
+        ]
+
+    def portfolio_items(self, account=''):
+        items = []
+        for conId, (position, avg) in self.positions.items():
+            if not position or not self._is_account(account):
+                continue
+            contract = self.contracts[conId]
+            multiplier = self._multiplier(contract)
+            mark = self.mark(contract)
+            items.append(PortfolioItem(
+                contract, position, mark, mark * position * multiplier, avg * multiplier,
+                (mark - avg) * position * multiplier, self.realized.get(conId, 0.0), self.account
+            ))
+        return items
+
+    def _publish_position(self, conId):
+        position, avg = self.positions[conId]
+        contract = self.contracts[conId]
+        multiplier = self._multiplier(contract)
+        update = Position(self.account, self._position_contract(conId), position, avg * multiplier)
+        item = next((i for i in self.portfolio_items() if i.contract.conId == conId), None)
+        for client in list(self.clients):
+            client.positionEvent.emit(update)
+            if item:
+                client.updatePortfolioEvent.emit(item)
+
+    def _publish_pnl(self):
+        if self.positions_unavailable:
+            return
+        unrealized_by_con = {}
+        for conId, (position, avg) in self.positions.items():
+            contract = self.contracts[conId]
+            unrealized_by_con[conId] = (self.mark(contract) - avg) * position * self._multiplier(contract)
+        unrealized = sum(unrealized_by_con.values())
+        realized = sum(self.realized.values())
+        for client in list(self.clients):
+            if client.pnl is not None:
+                client.pnl.dailyPnL = unrealized + realized
+                client.pnl.unrealizedPnL = unrealized
+                client.pnl.realizedPnL = realized
+                client.pnlEvent.emit(client.pnl)
+            for conId, pnl_single in client.pnl_singles.items():
+                position, avg = self.positions.get(conId, [0.0, 0.0])
+                contract = self.contracts.get(conId)
+                pnl_single.position = position
+                pnl_single.unrealizedPnL = unrealized_by_con.get(conId, 0.0)
+                pnl_single.realizedPnL = self.realized.get(conId, 0.0)
+                pnl_single.dailyPnL = pnl_single.unrealizedPnL + pnl_single.realizedPnL
+                pnl_single.value = self.mark(contract) * position * self._multiplier(contract) if contract else 0.0
+                client.pnlSingleEvent.emit(pnl_single)
+
+def ib_factory_from_env():
+    """IB client factory: the live gateway unless IB_FAKE_GATEWAY is set
+
+    IB_FAKE_SEED, IB_FAKE_TICK_RATE and IB_FAKE_FILL_MODEL tune the simulation.
+    """
+    if not os.environ.get('IB_FAKE_GATEWAY'):
+        return IB
+    gateway = FakeGateway(
+        seed=int(os.environ.get('IB_FAKE_SEED', 0)),
+        tick_rate=float(os.environ.get('IB_FAKE_TICK_RATE', 4)),
+        fill_model=os.environ.get('IB_FAKE_FILL_MODEL', 'immediate'),
+    )
+    print("Using simulated IB gateway")
+    return gateway.client
@@ -5,15 +5,72 @@ import pytz
 import math
 import random
 import aiohttp
+import os
+import json
 import time as time_lib
+import logging
+from collections import OrderedDict
 from typing import Dict, Set
 from fastapi import WebSocket
 from starlette.websockets import WebSocketState
+from app.trading.pool import IBConnectionPool
+from app.trading.journal import ExecutionJournal
+from app.trading.lots import LotBook
+from app.trading.pacing import Pacer
+from app.trading.square_off import SquareOffScheduler
+from app.trading.timeline import TimelineStore
+from app.trading.order_store import OrderStore
+from app.trading.event_journal import EventJournal
+from app.trading.instruments import INSTRUMENTS, OptionResolver, lookup, resolver_for
+from app.trading.bars import BarAggregator
+from app.trading.bar_store import BarStore
+from app.trading.strategies import StrategyRuntime
+from app.trading.triggers import TriggerEngine, TRIGGER_KINDS, TRIGGER_OPS
+from app.trading.risk import RiskEngine, order_legs
+from app.trading.combos import ComboBook, SIDES, bag, group_legs
+from app.loop_monitor import LOOP_MONITOR
+from app.profiler import PROFILER
+from app.memory_monitor import MEMORY_MONITOR
+from app.logs import LOGS, Sampler
+from app.metrics import (
+    IB_REQUEST_LATENCY, ORDERS_PLACED, FILLS, IB_ERRORS, RECONNECTS, WEBSOCKET_SEND_FAILURES,
+    BROADCAST_LATENCY, QUEUE_DEPTH, SUBSCRIPTIONS, CONNECTED_CLIENTS, REGISTRY, StageTimer
+)
+
+log = logging.getLogger(__name__)
+
+# ib_insync wrapper state that grows with the session, sized by /debug/memory
+IB_WRAPPER_COLLECTIONS = (
+    'trades', 'permId2Trade', 'fills', 'tickers', 'reqId2Ticker', 'reqId2Subscriber', 'reqId2PnL',
+    'reqId2PnlSingle', 'portfolio', 'positions', '_futures', '_results',
+)
+
+# Entered contracts kept streaming for decision prices after their positions close
+MAX_QUOTE_SUBSCRIPTIONS = int(os.environ.get('MAX_QUOTE_SUBSCRIPTIONS', 20))
+# Seconds an entry waits for a new contract's first quote when a notional limit needs its price
+QUOTE_WAIT_SECONDS = float(os.environ.get('QUOTE_WAIT_SECONDS', 2.0))
+
+# IB event callbacks timed by the loop monitor
+MONITORED_CALLBACKS = (
+    'order_status_monitor', 'on_order_status', 'position_monitor', 'portfolio_monitor', 'market_data_monitor',
+    'pnl_callback', 'on_pnl_single_update', 'on_exec_details', 'on_commission_report', 'on_error', 'on_disconnect',
+)
 
 class IBHandler:
-    def __init__(self, settings):
-        self.ib = IB()
+    def __init__(self, settings, ib_factory=IB):
+        self.ib = ib_factory()
         self.settings = settings
+        self.host = '127.0.0.1'
+        self.port = 4001
+        self.client_id = random.randint(1, 1000)
+
+        # Extra clients for reference-data requests; orders stay on self.ib
+        self.pool = IBConnectionPool(
+            self.ib, self.host, self.port,
+            size=int(os.environ.get('IB_POOL_SIZE', 3)),
+            client_id_base=random.randint(1001, 9000),
+            ib_factory=ib_factory
+        )
         self.market_data_tickers = {}
         self.pnl = None
         self.pnl_singles = {}  # Store PnLSingle subscriptions by conId
@@ -26,10 +83,18 @@ class IBHandler:
         }
         self.open_orders = {}
         self.positions = {}  # Store positions with conId as key
-        self.current_spy_price = 610.0  # Set default price to 610
+        self.position_contracts = {}  # Qualified Contract objects by conId, ready for closing orders
+        self.marks = {}  # Position conId -> last price as quoted (marketPrice is scaled for display)
+        self.quote_subscriptions = OrderedDict()  # conId -> entered contract streamed for decision prices
+        self.underlying_prices = {'SPY': 610.0}  # Option underlyings' last prices by symbol; SPY defaults to 610
+        self.underlying_symbols = {}  # conId of a subscribed underlying -> instrument symbol
+        self.resolvers = {}  # Instrument symbol -> resolver with its cached contracts
         self.active_websockets = []  # Changed from set() to list
+        self.subscriptions = {}  # websocket -> topics it asked for (logs, ...) besides state updates
         self.update_queue = asyncio.Queue()
         self.is_streaming = False
+        self.background_tasks = {}  # name -> task started by connect(), at most one each
+        self.events_registered = False  # Whether connect() has registered the IB callbacks
         
         # Hardcoded account ID
         self.account = 'U4252435'
@@ -38,38 +103,77 @@ class IBHandler:
         self.telegram_token = "8075397061:AAGorHxVqKDupzMPYFSZigpqkXT3CCbS-v8"
         self.telegram_chat_id = "-4627066193"
         
-        # Clear logs on startup
-        self.clear_logs()
-        
         # New attribute for PnL subscriptions
         self.pnl_subscriptions_allowed = True
-        
-    def clear_logs(self):
-        """Clear log files on startup"""
-        try:
-            # Clear backend.log
-            with open('backend.log', 'w') as f:
-                f.write('')
-            print("Cleared backend.log")
-            
-            # Clear frontend.log if it exists
-            try:
-                with open('frontend.log', 'w') as f:
-                    f.write('')
-                print("Cleared frontend.log")
-            except FileNotFoundError:
-                pass  # Frontend log might not exist
-        except Exception as e:
-            print(f"Error clearing logs: {e}")
 
+        # Persistent record of fills and commissions
+        self.journal = ExecutionJournal(os.environ.get('EXECUTION_JOURNAL_PATH', 'executions.db'))
+
+        # Local FIFO lots so realized PnL doesn't depend on PnL subscriptions
+        self.lots = LotBook()
+        self.pnl_received = False  # Whether reqPnL has delivered data this session
+        self._pnl_sample = Sampler(int(os.environ.get('LOG_TICK_SAMPLE', 100)))  # Tick-rate messages at INFO
+
+        # Pre-trade limits checked in _place_order, from exposure kept up to date by fills and order events
+        self.risk = RiskEngine(settings, self.lots)
+
+        # Recent multi-leg orders with the fills of each leg
+        self.combos = ComboBook()
+
+        # Outgoing order rate limiting and timer-driven square-off
+        self.pacer = Pacer()
+        self.square_off = SquareOffScheduler(self)
+
+        # Per-signal order lifecycle traces
+        self.timelines = TimelineStore(self.journal)
+
+        # 1s/5s/1m OHLCV bars of every subscribed instrument, built from the tick stream
+        self.bars = BarAggregator()
+
+        # Historical bars on disk, topped up from the live bars or the gateway on each query
+        self.history = BarStore(os.environ.get('BAR_STORE_DIR', 'bar_store'), self.pool, self.bars)
+
+        # Price, trailing-stop and PnL triggers evaluated on every tick; fired ones queue a close
+        self.triggers = TriggerEngine()
+        self.trigger_queue = asyncio.Queue()
+
+        # In-process strategies fed by the bar and trade stream; their signals go through process_signal
+        self.strategies = StrategyRuntime(self._dispatch_strategy_signal, allowed=lambda: self.settings.trading_enabled)
+        self.strategies.load()
+        self.bars.bar_listeners.append(self.strategies.on_bar)
+        self.bars.trade_listeners.append(self.strategies.on_trade)
+
+        # Live orders by orderId/permId; finished ones move to a bounded archive and the journal
+        self.orders = OrderStore(self.journal, self.ib)
+
+        # Binary journal of every inbound IB event, for forensics and replay
+        self.events = EventJournal(os.environ.get('EVENT_JOURNAL_DIR', 'event_journal'))
+
+        # Gauges read at scrape time
+        QUEUE_DEPTH.set_function(lambda: {
+            ('update',): self.update_queue.qsize(),
+            ('journal',): self.journal.queue.qsize(),
+        })
+        SUBSCRIPTIONS.set_function(lambda: {
+            ('market_data',): len(self.market_data_tickers),
+            ('pnl',): 1 if self.pnl else 0,
+            ('pnl_single',): len(self.pnl_singles),
+        })
+        CONNECTED_CLIENTS.set_function(lambda: len(self.active_websockets))
+
+        # Sampled timing of every IB callback; wrapped once here so += and -= see the same object
+        for name in MONITORED_CALLBACKS:
+            setattr(self, name, LOOP_MONITOR.wrap(name, getattr(self, name)))
+        MEMORY_MONITOR.register('handler', self.collection_sizes)
+        
     async def connect(self):
         try:
             print("Attempting to connect to IB Gateway...")
-            print(f"Target: 127.0.0.1:4001")
+            print(f"Target: {self.host}:{self.port}")
             
             # Try to connect with increased timeout
             try:
-                await self.ib.connectAsync('127.0.0.1', 4001, clientId=random.randint(1,1000), timeout=30)
+                await self.ib.connectAsync(self.host, self.port, clientId=self.client_id, timeout=30)
                 print("Successfully connected to IB Gateway")
             except asyncio.TimeoutError:
                 print("Connection timed out. Please check:")
@@ -88,27 +192,49 @@ class IBHandler:
             self.ib.reqMarketDataType(4)  # 3 = Delayed frozen, 4 = Delayed, 1 = Live
             print("Set market data type to delayed frozen")
             
-            # Register all callbacks
-            self.ib.openOrderEvent += self.order_status_monitor
-            self.ib.positionEvent += self.position_monitor
-            self.ib.updatePortfolioEvent += self.portfolio_monitor
-            self.ib.pendingTickersEvent += self.market_data_monitor
-            self.ib.pnlEvent += self.pnl_callback
-            self.ib.pnlSingleEvent += self.on_pnl_single_update
-            self.ib.errorEvent += self.on_error
-            self.ib.disconnectedEvent += self.on_disconnect
-            print("Registered all callbacks")
+            # Record inbound events before the handlers below see them
+            try:
+                if not self.events.enabled:
+                    self.events.open()
+                self.events.attach(self.ib)
+                self.events.record_session('connect', {'clientId': self.client_id})
+            except Exception as e:
+                print(f"Error opening event journal: {e}")
+
+            # Register all callbacks, once; connect() runs again on every reconnect
+            if not self.events_registered:
+                for event, handler in self._callbacks():
+                    event += handler
+                self.events_registered = True
+                print("Registered all callbacks")
+
+            # Orders already working at connect arrived before the callbacks were registered
+            for trade in self.ib.openTrades():
+                self.order_status_monitor(trade)
+
+            # Rebuild local lots from the journal, then journal any fills we missed while disconnected
+            self.journal.start()
+            await self.rebuild_lots()
+            await self.sync_executions()
+
+            # Bring up the reference-data pool before the qualification burst below
+            await self.pool.connect()
             
-            # Initialize SPY market data
-            await self.initialize_spy_market_data()
+            # Initialize SPY market data, and that of every instrument a strategy watches
+            await self.initialize_market_data(INSTRUMENTS['SPY'])
+            for symbol in self.strategies.symbols():
+                instrument = lookup(symbol)
+                if instrument is not None:
+                    await self.initialize_market_data(instrument)
             
             # Get initial positions with error handling
             print("Getting initial positions...")
             try:
                 positions = self.ib.positions(account=self.account)  # Specify account explicitly
                 if positions:
-                    for position in positions:
-                        await self.position_monitor(position)
+                    # Qualify all positions concurrently across the pool
+                    await asyncio.gather(*(self.position_monitor(position) for position in positions))
+                    self.reconcile_lots(positions)
                 else:
                     print("No positions found or positions not yet available")
             except Exception as e:
@@ -123,7 +249,7 @@ class IBHandler:
                 print("PnL data may not be available until account is fully approved")
 
             # Start the update broadcaster
-            asyncio.create_task(self.broadcast_updates())
+            self._start_background_tasks()
             
             print("Initial data sync complete")
             return
@@ -131,26 +257,70 @@ class IBHandler:
             print(f"Connection error: {e}")
             raise
 
-    async def initialize_spy_market_data(self):
-        """Initialize SPY market data subscription"""
+    def _callbacks(self):
+        """IB events and the handlers connect() registers on them"""
+        return [
+            (self.ib.openOrderEvent, self.order_status_monitor),
+            (self.ib.orderStatusEvent, self.on_order_status),
+            (self.ib.positionEvent, self.position_monitor),
+            (self.ib.updatePortfolioEvent, self.portfolio_monitor),
+            (self.ib.pendingTickersEvent, self.market_data_monitor),
+            (self.ib.pnlEvent, self.pnl_callback),
+            (self.ib.pnlSingleEvent, self.on_pnl_single_update),
+            (self.ib.execDetailsEvent, self.on_exec_details),
+            (self.ib.commissionReportEvent, self.on_commission_report),
+            (self.ib.errorEvent, self.on_error),
+            (self.ib.disconnectedEvent, self.on_disconnect),
+        ]
+
+    def _start_background_tasks(self):
+        """Start each long-running task that isn't already running; connect() runs again on every reconnect"""
+        for name, factory in (
+            ('broadcast_updates', self.broadcast_updates),
+            ('stream_logs', self.stream_logs),
+            ('stream_bars', self.stream_bars),
+            ('trigger_orders', self.trigger_orders),
+        ):
+            task = self.background_tasks.get(name)
+            if task is None or task.done():
+                self.background_tasks[name] = asyncio.create_task(factory(), name=name)
+
+    @property
+    def current_spy_price(self) -> float:
+        return self.underlying_prices['SPY']
+
+    @current_spy_price.setter
+    def current_spy_price(self, price: float):
+        self.underlying_prices['SPY'] = price
+
+    async def initialize_market_data(self, instrument, wait: float = 1.0):
+        """Subscribe to an instrument's price (option underlying or front-month future) and wait up to `wait` seconds for it"""
+        symbol = instrument.symbol
         try:
-            if 'SPY' not in self.market_data_tickers:  # Only initialize if not already done
+            if symbol not in self.market_data_tickers:  # Only initialize if not already done
                 self.ib.reqMarketDataType(4)  # Ensure delayed data
                 await asyncio.sleep(0.1)
                 
-                spy = Stock(symbol='SPY', exchange='SMART', currency='USD')
-                qualified = await self.ib.qualifyContractsAsync(spy)
-                if qualified:
-                    self.market_data_tickers['SPY'] = self.ib.reqMktData(qualified[0])
-                    print("Successfully subscribed to SPY delayed market data")
-                    await asyncio.sleep(1)  # Give time for initial data
+                resolver = self.resolver(instrument)
+                underlying = await (resolver.underlying_contract() if instrument.is_option else resolver.resolve())
+                self.underlying_symbols[underlying.conId] = symbol
+                self.market_data_tickers[symbol] = self.ib.reqMktData(underlying)
+                print(f"Successfully subscribed to {symbol} delayed market data")
+                # Give time for initial data; last is nan until the first tick
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + wait
+                while not self.market_data_tickers[symbol].last > 0 and loop.time() < deadline:
+                    await asyncio.sleep(0.05)
+                self.market_data_monitor([self.market_data_tickers[symbol]])
         except Exception as e:
-            print(f"Error initializing SPY market data: {e}")
+            print(f"Error initializing {symbol} market data: {e}")
 
     def market_data_monitor(self, tickers):
         """Monitor market data updates"""
         try:
+            now = time_lib.time()
             for ticker in tickers:
+                self.bars.on_ticker(ticker, now)
                 contract = ticker.contract
                 conId = contract.conId
                 if conId in self.positions:
@@ -163,30 +333,34 @@ class IBHandler:
                             self.positions[conId]['marketPrice'] = float(price)
                         else:
                             self.positions[conId]['marketPrice'] = float(price)
+                        self.marks[conId] = float(price)
+                        self._check_triggers(conId, float(price))
                             
                         # print(f"Updated market price for {contract.localSymbol}: {self.positions[conId]['marketPrice']}")
                         
-                elif contract.symbol == 'SPY' and contract.secType == 'STK':
-                    # Handle SPY underlying price updates
+                elif conId in self.underlying_symbols:
+                    # Handle underlying price updates (SPY, QQQ, ..., and futures strategies watch)
                     price = ticker.last
                     if price and price > 0:
-                        self.current_spy_price = float(price)
+                        self.underlying_prices[self.underlying_symbols[conId]] = float(price)
+                        self._check_triggers(conId, float(price))
                         
-        except Exception as e:
-            print(f"Error in market data monitor: {e}")
-            print(f"Ticker data: {vars(ticker) if ticker else 'No ticker'}")
+        except Exception:
+            log.exception("Error in market data monitor")
 
     def order_status_monitor(self, trade):
         try:
+            self.orders.update(trade)
             order = trade.order
             status = trade.orderStatus
             contract = trade.contract
+            local_symbol = contract.localSymbol or f"{contract.symbol} {contract.secType}"  # BAGs have none
             
             # Track all orders initially, remove only when fully processed
             self.open_orders[order.orderId] = {
                 'orderId': order.orderId,
                 'contract': {
-                    'localSymbol': contract.localSymbol,
+                    'localSymbol': local_symbol,
                     'secType': contract.secType,
                 },
                 'action': order.action,
@@ -207,13 +381,13 @@ class IBHandler:
             if status.status == 'Filled' and order.totalQuantity != 0:
                 message = (
                     f"🔔 <b>Trade Executed</b>\n\n"
-                    f"Symbol: {contract.localSymbol}\n"
+                    f"Symbol: {local_symbol}\n"
                     f"Action: {order.action}\n"
                     f"Quantity: {order.totalQuantity}\n"
                     f"Fill Price: ${status.avgFillPrice:.2f}\n"
                     f"Order Type: {order.orderType}"
                 )
-                asyncio.create_task(self.send_telegram_message(message))
+                asyncio.create_task(self.send_telegram_message(message), name='telegram')
             # elif status.status == 'Cancelled':
             #     message = (
             #         f"❌ <b>Order Cancelled</b>\n\n"
@@ -221,14 +395,14 @@ class IBHandler:
             #         f"Action: {order.action}\n"
             #         f"Quantity: {order.totalQuantity}"
             #     )
-            #     asyncio.create_task(self.send_telegram_message(message))
+            #     asyncio.create_task(self.send_telegram_message(message), name='telegram')
             elif hasattr(trade, 'errorMessage') and trade.errorMessage:
                 message = (
                     f"⚠️ <b>Order Error</b>\n\n"
-                    f"Symbol: {contract.localSymbol}\n"
+                    f"Symbol: {local_symbol}\n"
                     f"Error: {trade.errorMessage}"
                 )
-                asyncio.create_task(self.send_telegram_message(message))
+                asyncio.create_task(self.send_telegram_message(message), name='telegram')
             
             # Only log significant order events
             if status.status in ['Filled', 'Cancelled', 'Inactive'] or hasattr(trade, 'errorMessage'):
@@ -248,7 +422,7 @@ class IBHandler:
             # Requalify contract to ensure correct exchange
             async def qualify_contract(contract):
                 try:
-                    qualified = await self.ib.qualifyContractsAsync(contract)
+                    qualified = await self.pool.qualify_contracts(contract)
                     return qualified[0] if qualified else contract
                 except Exception as e:
                     print(f"Error requalifying contract: {e}")
@@ -256,6 +430,7 @@ class IBHandler:
             
             # Use existing event loop instead of asyncio.run()
             qualified_contract = await qualify_contract(position.contract)
+            self.risk.on_position(qualified_contract, position.position, position.avgCost)
             
             print(f'\nPosition Update - {qualified_contract.localSymbol}:')
             avg_cost = float(position.avgCost) / 100 if position.avgCost else 0.0
@@ -266,6 +441,7 @@ class IBHandler:
                     print(f"Subscribing to market data for {qualified_contract.localSymbol} on {qualified_contract.exchange}")
                     await self._delayed_market_data_request(qualified_contract)
 
+                self.position_contracts[qualified_contract.conId] = qualified_contract
                 self.positions[qualified_contract.conId] = {
                     'contract': {
                         'conId': qualified_contract.conId,
@@ -284,24 +460,43 @@ class IBHandler:
                     'realizedPNL': 0.0     # Added for realized PnL tracking
                 }
 
+                self._reprice_pnl_triggers(qualified_contract.conId)
+
                 # Add subscription with validation
                 if self.pnl_subscriptions_allowed:
                     await self._safe_subscribe_pnl_single(qualified_contract.conId)
                 else:
                     print("Skipping PnL Single subscription - not allowed")
             else:
-                # Remove closed positions and cancel market data subscription
-                if qualified_contract.conId in self.market_data_tickers:
+                # Remove closed positions and cancel market data subscription, unless kept for decision prices
+                if qualified_contract.conId in self.market_data_tickers and \
+                        qualified_contract.conId not in self.quote_subscriptions:
                     print(f"Canceling market data subscription for {qualified_contract.localSymbol}")
                     ticker = self.market_data_tickers[qualified_contract.conId]
                     self.ib.cancelMktData(ticker.contract)
                     del self.market_data_tickers[qualified_contract.conId]
                 self.positions.pop(qualified_contract.conId, None)
+                self.position_contracts.pop(qualified_contract.conId, None)
+                self.marks.pop(qualified_contract.conId, None)
+                self.triggers.remove_position(qualified_contract.conId)
                 
         except Exception as e:
             print(f"Error in position monitor for {qualified_contract.localSymbol}: {e}")
             print(f"Debug - position data: avgCost={position.avgCost}, position={position.position}")
 
+    async def ensure_position_contract(self, conId: int):
+        """Qualify and cache the contract for a position by conId"""
+        if conId in self.position_contracts:
+            return self.position_contracts[conId]
+        try:
+            qualified = await self.pool.qualify_contracts(Contract(conId=conId))
+            if qualified:
+                self.position_contracts[conId] = qualified[0]
+                return qualified[0]
+        except Exception as e:
+            print(f"Error qualifying contract {conId}: {e}")
+        return None
+
     async def _delayed_market_data_request(self, contract):
         """Helper method to request market data with a delay"""
         try:
@@ -318,25 +513,121 @@ class IBHandler:
                 market_price = float(item.marketPrice) / 100 if item.marketPrice else 0.0
                 unrealized_pnl = float(item.unrealizedPNL) if item.unrealizedPNL else 0.0
 
-                print(f'\nPortfolio Update Raw - {item.contract.localSymbol}:')
-                print(f'Raw Market Price: {item.marketPrice}, Raw Unrealized PNL: {item.unrealizedPNL}')
-
                 self.positions[item.contract.conId].update({
                     'marketPrice': market_price,
                     'unrealizedPNL': unrealized_pnl
                 })
+                if item.marketPrice and item.marketPrice > 0:
+                    self.marks[item.contract.conId] = float(item.marketPrice)
                 
-                print(f'\nPortfolio Update - {item.contract.localSymbol}:')
-                print(f'Market Price: {market_price}, Unrealized PNL: {unrealized_pnl}')
+                log.debug("Portfolio update %s: raw market price %s, market price %s, unrealized PnL %s",
+                          item.contract.localSymbol, item.marketPrice, market_price, unrealized_pnl)
             
-        except Exception as e:
-            print(f"Error in portfolio monitor: {e}")
-            print(f"Debug - item data: {vars(item)}")
+        except Exception:
+            log.exception("Error in portfolio monitor")
 
     async def get_orders(self):
         """Return only open orders"""
         return list(self.open_orders.values())
 
+    def on_exec_details(self, trade, fill):
+        """Journal each live execution and match it against local lots"""
+        try:
+            if fill.contract.secType == 'BAG':
+                # A combo's own execution at its net price; the legs that hold positions arrive separately
+                self.timelines.on_fill(trade, fill, self.current_spy_price)
+                return
+            FILLS.inc(sec_type=fill.contract.secType)
+            if self.journal.record_execution(fill):
+                self._apply_fill_to_lots(fill)
+                execution = fill.execution
+                self.risk.on_fill(fill.contract, execution.side, float(execution.shares), float(execution.price))
+                self.combos.on_fill(trade, fill)
+                # Count each execution once, however often IB delivers it
+                self.square_off.on_fill(trade, fill)
+                if trade.contract.secType != 'BAG':
+                    self.timelines.on_fill(trade, fill, self.current_spy_price)
+        except Exception as e:
+            print(f"Error journaling execution: {e}")
+
+    def on_commission_report(self, trade, fill, report):
+        """Journal commission reports as they arrive"""
+        try:
+            self.journal.record_commission(report)
+            self.lots.apply_commission(report.execId, report.commission)
+        except Exception as e:
+            print(f"Error journaling commission report: {e}")
+
+    def _multiplier(self, contract) -> float:
+        try:
+            return float(contract.multiplier) if contract.multiplier else 1.0
+        except (TypeError, ValueError):
+            return 1.0
+
+    def _trading_day_start(self) -> float:
+        """Epoch seconds of midnight US/Eastern for the current trading day"""
+        est = pytz.timezone('US/Eastern')
+        now = datetime.now(est)
+        return est.localize(datetime(now.year, now.month, now.day)).timestamp()
+
+    def _apply_fill_to_lots(self, fill):
+        execution = fill.execution
+        exec_time = execution.time or fill.time
+        self.lots.apply_fill(
+            fill.contract.conId, execution.side, float(execution.shares), float(execution.price),
+            self._multiplier(fill.contract), execution.execId,
+            exec_time.timestamp() if exec_time else None
+        )
+
+    def reconcile_lots(self, positions):
+        """Seed local lots for positions that predate the journal"""
+        for position in positions:
+            multiplier = self._multiplier(position.contract)
+            self.lots.reconcile(
+                position.contract.conId, float(position.position),
+                float(position.avgCost or 0.0) / multiplier, multiplier
+            )
+
+    async def rebuild_lots(self):
+        """Rebuild FIFO lots and today's realized PnL from the journal"""
+        try:
+            day_start = self._trading_day_start()
+            executions = await self.journal.load_executions(day_start=day_start)
+            self.lots.rebuild(executions, day_start)
+            print(f"Rebuilt lots from {len(executions)} journaled executions, "
+                  f"realized today: {self.lots.realized_net():.2f}")
+        except Exception as e:
+            print(f"Error rebuilding lots from journal: {e}")
+
+    async def sync_executions(self):
+        """Incrementally pull executions since the last journaled fill"""
+        try:
+            since = self.journal.catch_up_filter_time()
+            exec_filter = ExecutionFilter(acctCode=self.account, time=since)
+            with IB_REQUEST_LATENCY.time(request='reqExecutions'):
+                fills = await self.ib.reqExecutionsAsync(exec_filter)
+
+            new_fills = 0
+            for fill in fills:
+                if fill.contract.secType == 'BAG':
+                    continue  # Combo totals; their legs are listed as executions of their own
+                if self.journal.record_execution(fill):
+                    self._apply_fill_to_lots(fill)
+                    new_fills += 1
+                # Commission reports arrive alongside the executions and update the fill in place
+                self.journal.record_commission(fill.commissionReport)
+                if fill.commissionReport.execId:
+                    self.lots.apply_commission(fill.commissionReport.execId, fill.commissionReport.commission)
+            print(f"Execution sync since '{since or 'start of day'}': {new_fills} new of {len(fills)} fills")
+        except Exception as e:
+            print(f"Error syncing executions: {e}")
+
+    async def get_executions(self, limit=100, cursor=None, since=None, con_id=None, symbol=None):
+        """Return a page of journaled executions, newest first"""
+        return await self.journal.query_executions(
+            limit=limit, cursor=cursor, since=since, con_id=con_id, symbol=symbol
+        )
+
     async def disconnect(self):
         """Async disconnect to handle cleanup properly"""
         try:
@@ -361,13 +652,11 @@ class IBHandler:
             except Exception as e:
                 print(f"Error canceling PnL subscriptions: {e}")
 
-            # First unregister all callbacks
+            # First unregister all callbacks; a deliberate disconnect must not trigger a reconnect
             try:
-                self.ib.openOrderEvent -= self.order_status_monitor
-                self.ib.positionEvent -= self.position_monitor
-                self.ib.updatePortfolioEvent -= self.portfolio_monitor
-                if self.pnl:
-                    self.ib.pnlEvent -= self.pnl_callback
+                for event, handler in self._callbacks():
+                    event -= handler
+                self.events_registered = False
             except Exception as e:
                 print(f"Error unregistering callbacks: {e}")
 
@@ -389,7 +678,22 @@ class IBHandler:
             except Exception as e:
                 print(f"Error clearing market data tickers: {e}")
 
+            # Flush the execution journal
+            try:
+                await self.journal.close()
+            except Exception as e:
+                print(f"Error closing execution journal: {e}")
+
+            try:
+                self.events.detach(self.ib)
+                self.events.close()
+            except Exception as e:
+                print(f"Error closing event journal: {e}")
+
+            self.history.close()
+
             # Finally disconnect
+            await self.pool.disconnect()
             self.ib.disconnect()
 
         except Exception as e:
@@ -494,13 +798,15 @@ class IBHandler:
 
     def pnl_callback(self, pnl):
         try:
-            print(f"Raw PnL update received: dailyPnL={pnl.dailyPnL}, unrealizedPnL={pnl.unrealizedPnL}, realizedPnL={pnl.realizedPnL}")
+            log.debug("Raw PnL update: dailyPnL=%s unrealizedPnL=%s realizedPnL=%s",
+                      pnl.dailyPnL, pnl.unrealizedPnL, pnl.realizedPnL)
             
             # Convert values to float and handle None values
             daily_pnl = self.safe_float(pnl.dailyPnL)
             unrealized_pnl = self.safe_float(pnl.unrealizedPnL)
             realized_pnl = self.safe_float(pnl.realizedPnL)
             total_pnl = unrealized_pnl + realized_pnl
+            self.pnl_received = True
             
             # Update the current PnL dictionary
             self.current_pnl = {
@@ -510,13 +816,14 @@ class IBHandler:
                 'totalPnL': total_pnl
             }
             
-            print(f"Processed PnL values: {self.current_pnl}")
+            if self._pnl_sample():
+                log.info("PnL daily=%.2f unrealized=%.2f realized=%.2f", daily_pnl, unrealized_pnl, realized_pnl)
             
             # Queue update for broadcasting
-            asyncio.create_task(self.queue_update())
+            asyncio.create_task(self.queue_update(), name='queue_update')
             
-        except Exception as e:
-            print(f"Error in PnL callback: {e}")
+        except Exception:
+            log.exception("Error in PnL callback")
 
     def on_pnl_single_update(self, pnl_single):
         """Handle individual position PnL updates"""
@@ -530,63 +837,111 @@ class IBHandler:
                     'realizedPNL': self.safe_float(pnl_single.realizedPnL),
                     'value': self.safe_float(pnl_single.value)
                 })
-                print(f"Updated position {conId} PnL: unrealized={self.positions[conId]['unrealizedPNL']}, daily={self.positions[conId]['dailyPNL']}")
+                log.debug("Position %s PnL: unrealized=%s daily=%s",
+                          conId, self.positions[conId]['unrealizedPNL'], self.positions[conId]['dailyPNL'])
                 
                 # Queue update immediately for this position
-                asyncio.create_task(self.queue_update())
-        except Exception as e:
-            print(f"Position PnL update error: {e}")
+                asyncio.create_task(self.queue_update(), name='queue_update')
+        except Exception:
+            log.exception("Position PnL update error")
+
+    def snapshot(self):
+        """Build a full state update in the format sent to clients"""
+        return {
+            'type': 'data',
+            'timestamp': time_lib.time(),
+            'data': {
+                'positions': list(self.positions.values()),
+                'orders': list(self.open_orders.values()),
+                'pnl': self.current_pnl,
+                'spyPrice': self.current_spy_price
+            }
+        }
 
     async def queue_update(self):
         """Queue an update for broadcasting"""
         try:
-            update_data = {
-                'type': 'data',
-                'timestamp': time_lib.time(),
-                'data': {
-                    'positions': list(self.positions.values()),
-                    'orders': list(self.open_orders.values()),
-                    'pnl': self.current_pnl,
-                    'spyPrice': self.current_spy_price
-                }
-            }
-            print(f"Queueing update with PnL: {update_data['data']['pnl']}")
-            await self.update_queue.put(update_data)
-        except Exception as e:
-            print(f"Error queueing update: {e}")
+            await self.update_queue.put(self.snapshot())
+        except Exception:
+            log.exception("Error queueing update")
 
     async def broadcast_updates(self):
         """Efficient update broadcaster"""
         while True:
             try:
                 update = await self.update_queue.get()
+                topic = update.get('topic')
                 to_remove = []
-                
-                print(f"Broadcasting update with PnL: {update['data']['pnl']}")
+                started = time_lib.perf_counter()
 
                 for i, ws in enumerate(self.active_websockets):
+                    if topic and not self._wants(ws, topic):
+                        continue
                     try:
                         if ws.client_state == WebSocketState.CONNECTED:
                             await ws.send_json(update)
-                            print(f"Successfully sent update to websocket")
                         else:
                             to_remove.append(i)
-                            print(f"Found dead websocket")
+                            log.info("Dropping dead websocket")
                     except Exception as e:
-                        print(f"Error sending to websocket: {e}")
+                        log.warning("Error sending to websocket: %s", e)
+                        WEBSOCKET_SEND_FAILURES.inc()
                         to_remove.append(i)
 
+                BROADCAST_LATENCY.observe(time_lib.perf_counter() - started)
+                log.debug("Broadcast %s to %d clients", topic or 'update', len(self.active_websockets))
+
                 # Remove dead connections in reverse order to maintain correct indices
                 for i in reversed(to_remove):
                     try:
-                        self.active_websockets.pop(i)
+                        self.subscriptions.pop(self.active_websockets.pop(i), None)
                     except IndexError:
                         pass
                 
-            except Exception as e:
-                print(f"Broadcast error: {e}")
+            except Exception:
+                log.exception("Broadcast error")
                 await asyncio.sleep(0.1)
 
+    def _wants(self, websocket, topic: str) -> bool:
+        # Engine IPC subscribers relay every topic; their workers filter per client
+        return getattr(websocket, 'all_topics', False) or topic in self.subscriptions.get(websocket, ())
+
+    def publish(self, topic: str, data):
+        """Queue a message for the WebSocket clients subscribed to `topic`"""
+        self.update_queue.put_nowait({'type': topic, 'topic': topic, 'timestamp': time_lib.time(), 'data': data})
+
+    def has_subscribers(self, topic: str) -> bool:
+        return any(self._wants(ws, topic) for ws in self.active_websockets)
+
+    async def stream_logs(self, interval: float = 0.5, level: str = 'INFO'):
+        """Publish new log entries on the `logs` topic while anyone is subscribed"""
+        last_seq = LOGS.last_seq
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not self.has_subscribers('logs'):
+                    last_seq = LOGS.last_seq
+                    continue
+                entries = LOGS.query(after_seq=last_seq, level=level)
+                if entries:
+                    last_seq = entries[-1]['seq']
+                    self.publish('logs', entries)
+            except Exception:
+                log.exception("Error streaming logs")
+
+    async def stream_bars(self):
+        """Close bars at every second boundary and publish them on the `bars.*` topics"""
+        while True:
+            await asyncio.sleep(1.0 - time_lib.time() % 1.0 + 0.005)
+            try:
+                self.bars.close_due()
+                for size, bars in self.bars.drain().items():
+                    topic = f'bars.{size}'
+                    if self.has_subscribers(topic):
+                        self.publish(topic, bars)
+            except Exception:
+                log.exception("Error publishing bars")
+
     def safe_float(self, value) -> float:
         """Safe float conversion with validation"""
         try:
@@ -601,6 +956,7 @@ class IBHandler:
         """Handle IB API errors"""
         error_msg = f"IB Error {errorCode}: {errorString}"
         print(error_msg)
+        IB_ERRORS.inc(code=errorCode)
         
         if errorCode == 10275:  # Positions not available
             print("Account not fully approved. Delaying PnL subscriptions.")
@@ -608,12 +964,12 @@ class IBHandler:
         elif errorCode == 321 and "Invalid account code" in errorString:
             print("Account validation failed. Check account configuration.")
             self.pnl_subscriptions_allowed = False
-            asyncio.create_task(self._cleanup_pnl_subscriptions())
+            asyncio.create_task(self._cleanup_pnl_subscriptions(), name='cleanup_pnl_subscriptions')
         elif errorCode == 10091:  # Market data subscription
             print("Market data subscription required. Using delayed data.")
             self.ib.reqMarketDataType(3)  # Switch to delayed frozen data
         elif errorCode in [1100, 1101, 1102]:  # Connection-related errors
-            asyncio.create_task(self.reconnect())
+            asyncio.create_task(self.reconnect(), name='reconnect')
             
         # Log error details
         print(f"Request ID: {reqId}")
@@ -622,6 +978,7 @@ class IBHandler:
 
     async def reconnect(self):
         """Handle reconnection"""
+        RECONNECTS.inc()
         try:
             self.ib.disconnect()
             await asyncio.sleep(5)  # Wait before reconnecting
@@ -632,7 +989,14 @@ class IBHandler:
     def on_disconnect(self):
         """Handle disconnection"""
         print("Disconnected from IB")
-        asyncio.create_task(self.reconnect())
+        self.events.record_session('disconnected', None)
+        asyncio.create_task(self.reconnect(), name='reconnect')
+
+    async def update_settings(self, settings):
+        """Apply new settings to the running session"""
+        self.settings = settings
+        self.risk.configure(settings)
+        self.square_off.rearm()
 
     async def register_websocket(self, websocket: WebSocket):
         """Register new WebSocket connection"""
@@ -643,6 +1007,64 @@ class IBHandler:
         """Unregister WebSocket connection"""
         if websocket in self.active_websockets:
             self.active_websockets.remove(websocket)
+        self.subscriptions.pop(websocket, None)
+
+    async def subscribe(self, websocket: WebSocket, topic: str):
+        self.subscriptions.setdefault(websocket, set()).add(topic)
+
+    async def unsubscribe(self, websocket: WebSocket, topic: str):
+        self.subscriptions.get(websocket, set()).discard(topic)
+
+    async def get_logs(self, since=None, level=None, limit=500):
+        return LOGS.query(since=since, level=level, limit=limit)
+
+    async def get_bars(self, symbol=None, con_id=None, size=5, since=None, until=None, limit=1000, partial=False):
+        """Bars of one instrument by symbol or conId; without either, the instruments that have bars"""
+        if symbol is None and con_id is None:
+            return self.bars.instruments()
+        resolved = self.bars.resolve(symbol, con_id)
+        if resolved is None:
+            return None
+        return {
+            'conId': resolved,
+            'symbol': self.bars.names[resolved],
+            'size': size,
+            'bars': self.bars.query(resolved, size, since, until, limit, partial),
+        }
+
+    async def get_history(self, symbol=None, con_id=None, size=60, since=None, until=None, limit=1000, partial=False):
+        """Stored bars of one contract, fetching only the missing tail; without symbol or con_id, what's stored"""
+        if symbol is None and con_id is None:
+            return {'stored': self.history.contents(), 'stats': self.history.stats()}
+        contract = await self._history_contract(symbol, con_id)
+        if contract is None:
+            return None
+        return {
+            'conId': contract.conId,
+            'symbol': contract.localSymbol or contract.symbol,
+            'size': size,
+            'bars': await self.history.bars(contract, size, since, until, limit, partial),
+        }
+
+    async def _history_contract(self, symbol=None, con_id=None):
+        """Contract of a registered instrument (its underlying or front month), or of an instrument with live bars"""
+        if con_id is None:
+            instrument = lookup(symbol)
+            if instrument is not None:
+                resolver = self.resolver(instrument)
+                contract = await (resolver.underlying_contract() if instrument.is_option else resolver.resolve())
+                self.history.contracts[contract.conId] = contract
+                return contract
+            con_id = self.bars.resolve(symbol)
+            if con_id is None:
+                return None
+        contract = self.history.contracts.get(con_id)
+        if contract is None:
+            qualified = await self.pool.qualify_contracts(Contract(conId=con_id))
+            if not qualified:
+                return None
+            contract = self.history.contracts[con_id] = qualified[0]
+        return contract
 
     async def get_pnl(self):
         """Return current PnL values"""
@@ -650,6 +1072,21 @@ class IBHandler:
             # Calculate total unrealized PnL from positions if available
             total_unrealized = sum(pos.get('unrealizedPNL', 0.0) for pos in self.positions.values())
             total_realized = self.current_pnl.get('realizedPnL', 0.0)
+
+            # Without live PnL subscriptions, fall back to the local lot book
+            if not (self.pnl_subscriptions_allowed and self.pnl and self.pnl_received):
+                day_start = self._trading_day_start()
+                if day_start != self.lots.day_start:
+                    self.lots.start_day(day_start)
+                total_realized = self.lots.realized_net()
+                if total_unrealized == 0.0:
+                    total_unrealized = sum(
+                        self.lots.unrealized(conId, mark) for conId, mark in self.marks.items()
+                    )
+                self.current_pnl['realizedPnL'] = total_realized
+                self.current_pnl['dailyPnL'] = total_realized + total_unrealized
+                self.current_pnl['unrealizedPnL'] = total_unrealized
+                self.current_pnl['totalPnL'] = total_unrealized + total_realized
             
             # If we have position-based unrealized PnL, use it
             if total_unrealized != 0.0:
@@ -674,11 +1111,188 @@ class IBHandler:
                 'totalPnL': 0.0
             }
 
+    async def get_metrics(self, const_labels=None):
+        """Return a mergeable snapshot of this process's metrics"""
+        return REGISTRY.collect(const_labels)
+
+    def _place_order(self, contract, order, source: str, trace=None, decision_price=None, legs=None):
+        """Single entry point for sending orders to the gateway; raises RiskRejected if a limit would be breached
+
+        `legs` are the (contract, action, ratio) combo legs of a BAG order.
+        """
+        return self._place_orders([(contract, order, decision_price, legs)], source, trace)[0]
+
+    def _place_orders(self, orders, source: str, trace=None):
+        """Place (contract, order, decision price, legs) orders back to back; all of them pass the risk check or none"""
+        checked = []
+        for contract, order, decision_price, legs in orders:
+            if legs:
+                legs = [(leg, action, ratio, self._risk_price(leg)) for leg, action, ratio in legs]
+                checked.append((order.totalQuantity, order_legs(contract, order.action, legs=legs)))
+            else:
+                price = decision_price or self._risk_price(contract)
+                checked.append((order.totalQuantity, order_legs(contract, order.action, price)))
+        self.risk.check(checked)
+        trades = []
+        for (contract, order, decision_price, _), (quantity, legs) in zip(orders, checked):
+            ORDERS_PLACED.inc(source=source)
+            trade = self.ib.placeOrder(contract, order)
+            self.risk.on_submit(trade.order.orderId, quantity, legs)
+            self.orders.update(trade)
+            if trace is not None:
+                self.timelines.attach(trace, trade, decision_price)
+            trades.append(trade)
+        return trades
+
+    def _risk_price(self, contract):
+        """Best known price of a contract for notional limits, or None"""
+        mark = self.marks.get(contract.conId)
+        if mark:
+            return mark
+        ticker = self.market_data_tickers.get(contract.conId)
+        price = self._ticker_price(ticker) if ticker is not None else None
+        if price:
+            return price
+        if contract.secType == 'FUT':
+            return self.underlying_prices.get(contract.symbol)
+        return None
+
+    def _quote(self, contract):
+        """Price of a contract at decision time: the mid of its streaming quote, else its last or mark"""
+        ticker = self.market_data_tickers.get(contract.conId)
+        price = self._ticker_price(ticker) if ticker is not None else None
+        return price or self._risk_price(contract)
+
+    @staticmethod
+    def _ticker_price(ticker):
+        """Mid of a ticker's bid and ask, else its last, or None before the first tick"""
+        if ticker.bid > 0 and ticker.ask > 0:
+            return round((ticker.bid + ticker.ask) / 2, 4)
+        if ticker.last > 0:
+            return ticker.last
+        return None
+
+    async def _wait_for_quotes(self, contracts):
+        """Start the quotes of contracts about to be entered; wait up to QUOTE_WAIT_SECONDS for those a
+        notional limit needs a price for, since the risk check rejects an unpriced entry"""
+        for contract in contracts:
+            self._subscribe_quote(contract)
+        waiting = [contract for contract in contracts if self.risk.needs_price(contract)]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + QUOTE_WAIT_SECONDS
+        while any(self._risk_price(contract) is None for contract in waiting) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+    def _subscribe_quote(self, contract):
+        """Keep an entered contract's quote streaming, so the next entry on it has a decision price"""
+        con_id = contract.conId
+        if con_id in self.market_data_tickers:
+            if con_id in self.quote_subscriptions:
+                self.quote_subscriptions.move_to_end(con_id)
+            return
+        self.market_data_tickers[con_id] = self.ib.reqMktData(contract)
+        self.quote_subscriptions[con_id] = contract
+        self.quote_subscriptions.move_to_end(con_id)
+        while len(self.quote_subscriptions) > MAX_QUOTE_SUBSCRIPTIONS:
+            old_id, old = self.quote_subscriptions.popitem(last=False)
+            # A position keeps its subscription; position_monitor cancels it when the position closes
+            if old_id not in self.positions and old_id in self.market_data_tickers:
+                self.ib.cancelMktData(old)
+                del self.market_data_tickers[old_id]
+
+    def _decision_quote(self):
+        """Prices known at the moment a trading decision is made"""
+        return {'spy': self.current_spy_price}
+
+    def on_order_status(self, trade):
+        """Feed order acknowledgements and terminal states into timelines"""
+        try:
+            self.orders.update(trade)
+            self.risk.on_order_status(trade)
+            self.timelines.on_status(trade)
+        except Exception as e:
+            print(f"Error updating order timeline: {e}")
+
+    async def get_order_timeline(self, order_id: int):
+        """Return the lifecycle trace for an order, from memory or the journal"""
+        timeline = self.timelines.get_by_order(order_id)
+        if timeline is None:
+            data = await self.journal.load_timeline(order_id)
+            timeline = json.loads(data) if data else None
+        return timeline
+
+    async def get_loop_health(self):
+        return LOOP_MONITOR.report()
+
+    def collection_sizes(self):
+        """Sizes of everything that can grow during a session"""
+        sizes = {
+            'market_data_tickers': len(self.market_data_tickers),
+            'pnl_singles': len(self.pnl_singles),
+            'open_orders': len(self.open_orders),
+            'positions': len(self.positions),
+            'position_contracts': len(self.position_contracts),
+            'marks': len(self.marks),
+            'quote_subscriptions': len(self.quote_subscriptions),
+            'active_websockets': len(self.active_websockets),
+            'dead_websockets': sum(1 for ws in self.active_websockets if ws.client_state != WebSocketState.CONNECTED),
+            'update_queue': self.update_queue.qsize(),
+            'journal_queue': self.journal.queue.qsize(),
+            'journal_exec_ids': len(self.journal.seen_exec_ids),
+            'lot_exec_ids': len(self.lots.exec_con_ids),
+            'timelines': len(self.timelines.traces),
+            'timeline_orders': len(self.timelines.by_order_id),
+            'square_off_runs': len(self.square_off.runs),
+            'bar_instruments': len(self.bars.series),
+            'bars_pending': len(self.bars.closed),
+            'strategy_tasks': len(self.strategies.tasks),
+            'history_files': len(self.history.files),
+            'triggers': len(self.triggers.triggers),
+            'combos': len(self.combos.combos),
+            **{f'orders_{name}': size for name, size in self.orders.stats().items()},
+        }
+        wrapper = getattr(self.ib, 'wrapper', None)
+        if wrapper is not None:
+            for name in IB_WRAPPER_COLLECTIONS:
+                collection = getattr(wrapper, name, None)
+                if collection is not None:
+                    sizes[f'ib.{name}'] = len(collection)
+        else:
+            sizes['ib.trades'] = len(self.ib.trades())
+        return sizes
+
+    async def get_memory_report(self):
+        return MEMORY_MONITOR.report()
+
+    async def profile_cpu(self, seconds: float = 10.0, fmt: str = 'collapsed', interval: float = 0.005):
+        """Sample this process's stacks for `seconds`"""
+        return await PROFILER.profile(seconds, interval, fmt)
+
+    async def profile_signal(self, signal, fmt: str = 'collapsed'):
+        """Run one process_signal under the sampling profiler"""
+        result, profile = await PROFILER.profile_call(lambda: self.process_signal(signal), fmt=fmt)
+        return {'result': result, 'profile': profile}
+
+    async def get_order_latency(self, source=None):
+        """Return p50/p95/p99 signal-to-stage latencies in milliseconds"""
+        return self.timelines.latency_percentiles(source)
+
+    async def _req_positions(self):
+        with IB_REQUEST_LATENCY.time(request='reqPositions'):
+            return await self.ib.reqPositionsAsync()
+
+    async def get_pool_status(self):
+        """Return health of the reference-data connection pool"""
+        return {
+            'master': {'clientId': self.client_id, 'connected': self.ib.isConnected()},
+            'pool': self.pool.status()
+        }
+
     async def get_spy_price(self):
         """Return current SPY price"""
         try:
             if 'SPY' not in self.market_data_tickers:
-                await self.initialize_spy_market_data()
+                await self.initialize_market_data(INSTRUMENTS['SPY'])
             
             ticker = self.market_data_tickers.get('SPY')
             if ticker:
@@ -692,123 +1306,207 @@ class IBHandler:
             print(f"Error getting SPY price: {e}")
             return self.current_spy_price
 
-    async def get_mes_contract(self):
+    def resolver(self, instrument):
+        """Cached contract resolver of an instrument, created on first use"""
+        resolver = self.resolvers.get(instrument.symbol)
+        if resolver is None:
+            resolver = self.resolvers[instrument.symbol] = resolver_for(instrument, self.pool)
+        return resolver
+
+    async def underlying_price(self, instrument) -> float:
+        """Last price of an option instrument's underlying, subscribing to it on first use"""
+        if instrument.symbol not in self.market_data_tickers:
+            await self.initialize_market_data(instrument)
+        price = self.underlying_prices.get(instrument.symbol)
+        if not price:
+            raise LookupError(f"No price for {instrument.symbol}")
+        return price
+
+    async def resolve_contract(self, instrument, action: str, selection: str = None):
+        """Contract a new position on `instrument` trades for `action`; `selection` overrides the strike setting"""
+        resolver = self.resolver(instrument)
+        if not instrument.is_option:
+            return await resolver.resolve()
+
+        right = instrument.right(action)
+        if selection is None:
+            selection = self.settings.call_strike_selection if right == 'C' else self.settings.put_strike_selection
+        strike = instrument.strike(await self.underlying_price(instrument), right, selection)
+        expiry = await resolver.expiry(self.settings.dte)
+        contract = await resolver.resolve(right, strike, expiry)
+        print(f"Using contract: {contract}")
+        return contract
+
+    async def _dispatch_strategy_signal(self, signal):
         try:
-            # Specify MES future contract with explicit exchange
-            contract = Future(
-                symbol='MES',
-                lastTradeDateOrContractMonth='20250321',  # Add specific expiration
-                exchange='CME',
-                currency='USD'
-            )
-            
-            # Qualify contract with explicit exchange
-            qualified = await self.ib.qualifyContractsAsync(contract)
-            if not qualified:
-                print("No qualified contracts found for MES")
-                return None
-            
-            contract = qualified[0]
-            print(f"Using qualified MES contract: {contract}")
-            return contract
-            
+            result = await self.process_signal(signal, source='strategy')
+            print(f"Strategy signal {signal['symbol']} {signal['action']}: {result}")
         except Exception as e:
-            print(f"Error getting MES contract: {e}")
-            return None
+            print(f"Error processing strategy signal: {e}")
+
+    async def get_strategies(self):
+        return self.strategies.report()
+
+    async def set_strategy_enabled(self, name: str, enabled: bool):
+        if not self.strategies.set_enabled(name, enabled):
+            return {"status": "error", "message": f"Unknown strategy {name}"}
+        print(f"Strategy {name} {'enabled' if enabled else 'disabled'}")
+        return {"status": "success", 'name': name, 'enabled': enabled}
+
+    def _check_triggers(self, con_id: int, price: float):
+        for trigger in self.triggers.on_price(con_id, price):
+            print(f"Trigger {trigger.trigger_id} fired: {trigger.symbol} {trigger.op} {trigger.level} at {price}")
+            self.trigger_queue.put_nowait(trigger)
 
-    async def get_spy_option(self, action=None, expiry=None):
+    async def trigger_orders(self):
+        """Send the closing order of each fired trigger"""
+        while True:
+            trigger = await self.trigger_queue.get()
+            try:
+                trigger.result = await self._close_for_trigger(trigger)
+            except Exception as e:
+                print(f"Error closing position for trigger {trigger.trigger_id}: {e}")
+                trigger.result = {"status": "error", "message": str(e)}
+
+    async def _close_for_trigger(self, trigger):
+        message = (
+            f"🎯 <b>Trigger Fired</b>\n\n"
+            f"Trigger: {trigger.kind} {trigger.symbol} {trigger.op} {round(trigger.level, 4)}\n"
+            f"Price: {trigger.fired_price}"
+        )
+        if trigger.position_id is None:
+            asyncio.create_task(self.send_telegram_message(message), name='telegram')
+            return {"status": "success", "message": "Notified"}
+
+        pos = self.positions.get(trigger.position_id)
+        quantity = pos['position'] if pos else 0
+        contract = self.position_contracts.get(trigger.position_id) or \
+            await self.ensure_position_contract(trigger.position_id)
+        if not quantity or contract is None:
+            return {"status": "error", "message": "Position not found"}
+
+        trace = self.timelines.start('trigger', {
+            'trigger_id': trigger.trigger_id, 'kind': trigger.kind, 'symbol': trigger.symbol,
+            'op': trigger.op, 'level': trigger.level, 'price': trigger.fired_price,
+        }, self._decision_quote())
+        order = MarketOrder(action='SELL' if quantity > 0 else 'BUY', totalQuantity=abs(quantity), account=self.account)
+        order.outsideRth = True
+        order.exchange = contract.exchange
+        await self.pacer.acquire()
+        trade = self._place_order(contract, order, 'trigger', trace=trace, decision_price=self.marks.get(trigger.position_id))
+        result = {"status": "success", "order_id": trade.order.orderId, "signal_id": trace.trace_id}
+        self.timelines.finish_request(trace, result)
+        asyncio.create_task(self.send_telegram_message(
+            f"{message}\nClosing: {order.action} {abs(quantity)} {contract.localSymbol}"
+        ), name='telegram')
+        return result
+
+    def _pnl_trigger_level(self, position_id: int, pnl: float) -> float:
+        """Price of a position at which its unrealized PnL reaches `pnl`"""
+        pos = self.positions[position_id]
+        contract = self.position_contracts[position_id]
+        multiplier = float(contract.multiplier or 1)
+        average_price = pos['avgCost'] * 100 / multiplier  # avgCost is IB's per-contract cost / 100
+        return average_price + pnl / (pos['position'] * multiplier)
+
+    def _reprice_pnl_triggers(self, position_id: int):
+        """Recompute PnL trigger levels after the position's size or cost changed"""
+        for trigger in self.triggers.for_position(position_id):
+            if trigger.kind == 'pnl':
+                self.triggers.move(trigger.trigger_id, self._pnl_trigger_level(position_id, trigger.pnl))
+
+    async def add_trigger(self, spec: dict):
+        """Set a trigger on a position's price, or on an underlying's price (e.g. SPY)
+
+        spec: kind (price, trailing, pnl), position_id (closed when it fires),
+        symbol (watch an underlying instead of the position), op (above, below),
+        level (price), distance and percent (trailing), pnl (PnL threshold).
+        """
         try:
-            # Calculate strike price based on selection
-            base_strike = round(self.current_spy_price)
-            
-            if 'Buy' in action:
-                right = 'C'
-                selection = self.settings.call_strike_selection
-                if selection == "ATM":
-                    strike = base_strike
-                elif selection == "OTM-1":
-                    strike = base_strike + 1
-                elif selection == "OTM-2":
-                    strike = base_strike + 2
-                elif selection == "OTM-3":
-                    strike = base_strike + 3
-                else:
-                    strike = base_strike
+            kind = spec.get('kind', 'price')
+            if kind not in TRIGGER_KINDS:
+                return {"status": "error", "message": f"Unknown trigger kind {kind}"}
+            position_id = spec.get('position_id')
+            pos = self.positions.get(position_id) if position_id is not None else None
+            if position_id is not None and (pos is None or not pos['position']):
+                return {"status": "error", "message": "Position not found"}
+            if kind in ('trailing', 'pnl') and pos is None:
+                return {"status": "error", "message": f"A {kind} trigger needs a position_id"}
+
+            symbol = spec.get('symbol')
+            if symbol and kind != 'pnl':
+                instrument = lookup(symbol)
+                if instrument is None:
+                    return {"status": "error", "message": f"Unsupported symbol: {symbol}"}
+                price = await self.underlying_price(instrument)
+                con_id = next((c for c, s in self.underlying_symbols.items() if s == instrument.symbol), None)
+                if con_id is None:
+                    # underlying_price falls back to a default (SPY) when the subscription failed
+                    return {"status": "error", "message": f"{instrument.symbol} market data is not subscribed"}
+                symbol = instrument.symbol
+            elif pos is not None:
+                contract = self.position_contracts.get(position_id) or await self.ensure_position_contract(position_id)
+                if contract is None:
+                    return {"status": "error", "message": "Could not qualify contract"}
+                price, con_id, symbol = self.marks.get(position_id), position_id, pos['contract']['localSymbol']
             else:
-                right = 'P'
-                selection = self.settings.put_strike_selection
-                if selection == "ATM":
-                    strike = base_strike
-                elif selection == "OTM-1":
-                    strike = base_strike - 1
-                elif selection == "OTM-2":
-                    strike = base_strike - 2
-                elif selection == "OTM-3":
-                    strike = base_strike - 3
-                else:
-                    strike = base_strike
-
-            if not expiry:
-                # Get option chain details
-                contract = Stock('SPY', 'SMART', 'USD')
-                qualified_contracts = await self.ib.qualifyContractsAsync(contract)
-                if qualified_contracts:
-                    conId = qualified_contracts[0].conId
-                    symbol = qualified_contracts[0].symbol
-                    print(f"Qualified contracts: {qualified_contracts}, conId: {conId}, symbol: {symbol}")
-                else:
-                    print("No qualified contracts found")
-                chains = await self.ib.reqSecDefOptParamsAsync(
-                    underlyingSymbol=symbol,
-                    futFopExchange='',
-                    underlyingSecType='STK',
-                    underlyingConId=conId
-                )
-                
-                if not chains:
-                    print("No option chains found for SPY")
-                    return None
-                
-                # Sort expirations and get the appropriate one
-                chain = chains[0]  # SMART exchange chain
-                expirations = sorted(chain.expirations)
-                
-                if not expirations:
-                    print("No expirations found in the option chain")
-                    return None
-                
-                # Select expiration based on dte setting
-                expiry_index = min(self.settings.dte, len(expirations) - 1)
-                expiry = expirations[expiry_index]
-
-            print(f"Creating SPY option: Strike={strike}, Right={right}, Expiry={expiry}")
-            
-            # Properly specify the option contract
-            contract = Option(
-                symbol='SPY',
-                lastTradeDateOrContractMonth=expiry,
-                strike=strike,
-                right=right,
-                exchange='SMART',
-                currency='USD',
-                multiplier='100'
-            )
-            
-            # First get contract details to ensure we have the correct contract
-            details = await self.ib.reqContractDetailsAsync(contract)
-            if not details:
-                print("No contract details found")
-                return None
-                
-            # Use the first contract from details
-            contract = details[0].contract
-            print(f"Using contract: {contract}")
-            return contract
-            
+                return {"status": "error", "message": "A trigger needs a position_id or a symbol"}
+            if not price or price <= 0:
+                return {"status": "error", "message": f"No price for {symbol} yet"}
+
+            op, level = spec.get('op'), spec.get('level')
+            if kind == 'trailing':
+                distance = spec.get('distance')
+                if not distance or distance <= 0:
+                    return {"status": "error", "message": "A trailing trigger needs a positive distance"}
+                op = op or ('below' if pos['position'] > 0 else 'above')
+            elif kind == 'pnl':
+                if not spec.get('pnl'):
+                    return {"status": "error", "message": "A pnl trigger needs a non-zero pnl"}
+                op = 'above' if spec['pnl'] * pos['position'] > 0 else 'below'
+                level = self._pnl_trigger_level(position_id, spec['pnl'])
+            elif level is None:
+                return {"status": "error", "message": "A price trigger needs a level"}
+            if op not in TRIGGER_OPS:
+                return {"status": "error", "message": f"op must be one of {TRIGGER_OPS}"}
+
+            trigger = self.triggers.create(
+                kind, con_id, symbol, op, float(price), level=level, position_id=position_id,
+                distance=spec.get('distance'), percent=bool(spec.get('percent')), pnl=spec.get('pnl'))
+            print(f"Trigger {trigger.trigger_id} set: {kind} {symbol} {op} {round(trigger.level, 4)}")
+            return {"status": "success", "trigger": trigger.describe()}
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
         except Exception as e:
-            print(f"Error getting SPY option: {e}")
-            return None
+            print(f"Error adding trigger: {e}")
+            return {"status": "error", "message": str(e)}
 
+    async def remove_trigger(self, trigger_id: int):
+        trigger = self.triggers.remove(trigger_id)
+        if trigger is None:
+            return {"status": "error", "message": "Trigger not found"}
+        return {"status": "success", "trigger": trigger.describe()}
+
+    async def get_risk(self):
+        return self.risk.report()
+
+    async def get_triggers(self):
+        return self.triggers.report()
+
+    async def get_instruments(self):
+        """Registered instruments and what their resolvers have cached"""
+        instruments = []
+        for symbol, instrument in INSTRUMENTS.items():
+            entry = instrument.describe()
+            resolver = self.resolvers.get(symbol)
+            if isinstance(resolver, OptionResolver):
+                entry['price'] = self.underlying_prices.get(symbol)
+                entry['expirations'] = len(resolver.expirations)
+                entry['cachedContracts'] = len(resolver.contracts)
+            elif resolver is not None:
+                entry.update(resolver.describe())
+            instruments.append(entry)
+        return instruments
     async def get_positions(self):
         """Return list of current positions with properly formatted prices"""
         positions = list(self.positions.values())
@@ -826,32 +1524,47 @@ class IBHandler:
         market_close = time(16, 0)
         return market_open <= current_time <= market_close
 
-    async def process_signal(self, signal):
+    async def process_signal(self, signal, source: str = 'signal'):
+        if not self.settings.trading_enabled:
+            return {"status": "error", "message": "Trading is disabled"}
+        self.events.record_signal(source, signal)
+        trace = self.timelines.start(source, signal, self._decision_quote())
+        result = await self._process_signal(signal, trace)
+        self.timelines.finish_request(trace, result)
+        if isinstance(result, dict):
+            result['signal_id'] = trace.trace_id
+        return result
+
+    async def _process_signal(self, signal, trace):
+        stages = StageTimer('signal')
         try:
             symbol = signal['symbol']
             action = signal['action']
             print(f"Processing signal: {symbol} {action}")
+            instrument = lookup(symbol)
+            if instrument is None:
+                return {"status": "error", "message": f"Unsupported symbol: {symbol}"}
+            trace.mark('resolve_start')
             
             # Handle exit orders
             if 'Exit' in action:
-                positions = await self.ib.reqPositionsAsync()  # Specify account explicitly
+                positions = await self._req_positions()  # Specify account explicitly
                 print("Current positions:", positions)
                 position_found = None
                 
                 # Find matching position
                 for pos in positions:
-                    if 'MES' in symbol and pos.contract.symbol == 'MES':
+                    if pos.contract.symbol != instrument.symbol:
+                        continue
+                    if not instrument.is_option:
+                        if pos.contract.secType == 'FUT':
+                            position_found = pos
+                            break
+                    # For options, only the long call (Buy) or long put (Sell) the signal opened
+                    elif pos.contract.secType == 'OPT' and pos.position > 0 and \
+                            pos.contract.right == instrument.right(action):
                         position_found = pos
                         break
-                    elif 'SPY' in symbol and pos.contract.symbol == 'SPY':
-                        # For SPY, only look for option positions
-                        if pos.contract.secType == 'OPT':
-                            is_long = pos.position > 0
-                            is_call = pos.contract.right == 'C'
-                            if ('Buy' in action and is_long and is_call) or \
-                               ('Sell' in action and is_long and not is_call):
-                                position_found = pos
-                                break
                 
                 if not position_found:
                     return {
@@ -862,11 +1575,13 @@ class IBHandler:
                 print(f"Closing position: {position_found.contract}")
                 
                 # Qualify the contract first
-                qualified_contracts = await self.ib.qualifyContractsAsync(position_found.contract)
+                qualified_contracts = await self.pool.qualify_contracts(position_found.contract)
                 if not qualified_contracts:
                     return {"status": "error", "message": "Could not qualify contract"}
                 
                 qualified_contract = qualified_contracts[0]
+                stages.mark('resolve')
+                trace.mark('resolve_end', {'localSymbol': qualified_contract.localSymbol})
                 
                 # Place exit order with exchange specified from qualified contract
                 exit_action = 'SELL' if position_found.position > 0 else 'BUY'
@@ -876,15 +1591,19 @@ class IBHandler:
                     account=self.account
                 )
                 
-                # Only set outsideRTH if outside regular trading hours
+                # Only set outsideRth if outside regular trading hours
                 if not self.is_regular_trading_hours():
-                    order.outsideRTH = True
+                    order.outsideRth = True
                 
                 order.exchange = qualified_contract.exchange # Set account explicitly
                 
                 print(f"Order: {order}")
-                trade = self.ib.placeOrder(qualified_contract, order)
+                trade = self._place_order(
+                    qualified_contract, order, 'signal_exit', trace=trace,
+                    decision_price=self.marks.get(qualified_contract.conId)
+                )
                 print(f"Trade: {trade}")
+                stages.mark('submit')
                 
                 # Wait briefly for order status and send notification
                 await asyncio.sleep(1)
@@ -900,109 +1619,188 @@ class IBHandler:
                     f"Fill Price: {avg_price}"
                 )
                 await self.send_telegram_message(message)
+                stages.mark('notify')
                 
                 await asyncio.sleep(0.5)
                 await self.resync_data()
+                stages.mark('resync')
+                stages.finish()
                 return {"status": "success", "order_id": trade.order.orderId}
             
             # Handle new position orders
-            if 'MES' in symbol:
-                # Get qualified contract
-                contract = await self.get_mes_contract()
-                if not contract:
-                    return {"status": "error", "message": "Could not qualify MES contract"}
-                
-                # Set order parameters
-                order_action = 'BUY' if 'Buy' in action else 'SELL'
-                quantity = signal.get('quantity', self.settings.mes_quantity)
-                
-                # Create market order with proper exchange
-                order = MarketOrder(
-                    action=order_action,
-                    totalQuantity=quantity,
-                    account=self.account
-                )
-                
-                # Only set outsideRTH if outside regular trading hours
-                if not self.is_regular_trading_hours():
-                    order.outsideRTH = True
-                
-                order.exchange = 'CME'
-                
-                # Place the order
-                trade = self.ib.placeOrder(contract, order)
-                print(f"Trade: {trade}")
-                
-                # Wait briefly for order status and send notification
-                await asyncio.sleep(1)
-                avg_price = trade.orderStatus.avgFillPrice if hasattr(trade.orderStatus, 'avgFillPrice') else 0.0
-                
-                # Send notification for new position
-                message = (
-                    f"🔔 <b>New Position Initiated</b>\n\n"
-                    f"Symbol: {contract.localSymbol}\n"
-                    f"Action: {order_action}\n"
-                    f"Quantity: {quantity}\n"
-                    f"Order Type: MARKET\n"
-                    f"Fill Price: ${avg_price:.2f}"
-                )
-                await self.send_telegram_message(message)
-                
-                await asyncio.sleep(0.5)
-                await self.resync_data()
-                return {"status": "success", "order_id": trade.order.orderId}
+            return await self._open_position(instrument, signal, 'signal', trace, stages, 'New Position Initiated')
             
-            elif 'SPY' in symbol:
-                is_buy_signal = 'Buy' in action
-                contract = await self.get_spy_option(
-                    action='Buy' if is_buy_signal else 'Sell'  # This determines call/put selection
-                )
-                if not contract:
-                    return {"status": "error", "message": "Could not qualify SPY option contract"}
-                
-                # Verify it's an option contract
-                if contract.secType != 'OPT':
-                    return {"status": "error", "message": "SPY signals must be for options only"}
-                
-                order_action = 'BUY'  # Always buy options, we use calls/puts for direction
-                quantity = signal.get('quantity', self.settings.spy_quantity)
-            else:
-                return {"status": "error", "message": f"Unsupported symbol: {symbol}"}
-            
-            # Place the order
-            order = MarketOrder(
-                action=order_action,
-                totalQuantity=quantity
-            )
-            order.outsideRTH = True
-            
-            print(f"Order: {order}")
-            trade = self.ib.placeOrder(contract, order)
-            print(f"Trade: {trade}")
-            
-            # Wait briefly for order status and send notification
+        except Exception as e:
+            print(f"Error processing signal: {e}")
+            return {"status": "error", "message": str(e)}
+
+    async def _open_position(self, instrument, signal, source: str, trace, stages, title: str):
+        """Resolve, place and announce the entry order of a signal on `instrument`"""
+        action = signal['action']
+        try:
+            contract = await self.resolve_contract(instrument, action)
+        except LookupError as e:
+            return {"status": "error", "message": str(e)}
+        stages.mark('resolve')
+        await self._wait_for_quotes([contract])
+        decision_price = self._quote(contract)
+        trace.mark('resolve_end', {'localSymbol': contract.localSymbol, 'quote': decision_price})
+
+        order_action = instrument.order_action(action)
+        quantity = instrument.quantity(self.settings, signal)
+        order = MarketOrder(
+            action=order_action,
+            totalQuantity=quantity,
+            account=self.account
+        )
+
+        # Only set outsideRth if outside regular trading hours
+        if not self.is_regular_trading_hours():
+            order.outsideRth = True
+
+        order.exchange = instrument.exchange
+        print(f"Order: {order}")
+        trade = self._place_order(contract, order, source, trace=trace, decision_price=decision_price)
+        print(f"Trade: {trade}")
+        stages.mark('submit')
+
+        # Wait briefly for order status and send notification
+        await asyncio.sleep(1)
+        avg_price = trade.orderStatus.avgFillPrice if hasattr(trade.orderStatus, 'avgFillPrice') else 0.0
+
+        option_details = (
+            f"Strike: {contract.strike}\n"
+            f"Expiry: {contract.lastTradeDateOrContractMonth}\n"
+        ) if instrument.is_option else ""
+        message = (
+            f"🔔 <b>{title}</b>\n\n"
+            f"Symbol: {contract.localSymbol}\n"
+            f"Action: {action if instrument.is_option else order_action}\n"
+            f"Quantity: {quantity}\n"
+            f"{option_details}"
+            f"Order Type: MARKET\n"
+            f"Fill Price: ${avg_price:.2f}"
+        )
+        await self.send_telegram_message(message)
+        stages.mark('notify')
+
+        await asyncio.sleep(0.5)
+        await self.resync_data()
+        stages.mark('resync')
+        stages.finish()
+        return {"status": "success", "order_id": trade.order.orderId}
+
+    async def place_combo(self, signal):
+        self.events.record_signal('combo', signal)
+        trace = self.timelines.start('combo', signal, self._decision_quote())
+        result = await self._place_combo(signal, trace)
+        self.timelines.finish_request(trace, result)
+        if isinstance(result, dict):
+            result['signal_id'] = trace.trace_id
+        return result
+
+    async def _place_combo(self, signal, trace):
+        """Resolve every leg at once and send them as native combos, one order per group that IB can combine"""
+        stages = StageTimer('combo')
+        try:
+            legs = signal.get('legs') or []
+            if len(legs) < 2:
+                return {"status": "error", "message": "A combo needs at least two legs"}
+            instruments = []
+            for leg in legs:
+                instrument = lookup(leg.get('symbol', ''))
+                if instrument is None:
+                    return {"status": "error", "message": f"Unsupported symbol: {leg.get('symbol')}"}
+                instruments.append(instrument)
+            print(f"Processing combo: {[(leg['symbol'], leg['action']) for leg in legs]}")
+            trace.mark('resolve_start')
+
+            try:
+                contracts = await asyncio.gather(*(
+                    self.resolve_contract(instrument, leg['action'], leg.get('strike_selection'))
+                    for instrument, leg in zip(instruments, legs)
+                ))
+            except LookupError as e:
+                return {"status": "error", "message": str(e)}
+            stages.mark('resolve')
+            trace.mark('resolve_end', {'localSymbol': ', '.join(c.localSymbol for c in contracts)})
+
+            resolved = []
+            for instrument, leg, contract in zip(instruments, legs, contracts):
+                side = (leg.get('side') or instrument.order_action(leg['action'])).upper()
+                if side not in SIDES:
+                    return {"status": "error", "message": f"Invalid side {leg.get('side')}"}
+                resolved.append((contract, side, int(instrument.quantity(self.settings, leg))))
+            if len({contract.conId for contract, _, _ in resolved}) < len(resolved):
+                return {"status": "error", "message": "Two legs resolved to the same contract"}
+            await self._wait_for_quotes(contracts)
+
+            orders = []
+            groups = group_legs(resolved)
+            for group in groups:
+                if len(group) > 1:
+                    contract, quantity = bag(group)
+                    order = MarketOrder(action='BUY', totalQuantity=quantity, account=self.account)
+                    combo_legs = [(leg, side, q // quantity) for leg, side, q in group]
+                    prices = [self._risk_price(leg) for leg, _, _ in combo_legs]
+                    # Net price of one combo, what IB reports as the BAG's fill price
+                    decision_price = round(sum(
+                        price * ratio * (1 if side == 'BUY' else -1)
+                        for (_, side, ratio), price in zip(combo_legs, prices)
+                    ), 4) if all(prices) else None
+                else:
+                    contract, side, quantity = group[0]
+                    order = MarketOrder(action=side, totalQuantity=quantity, account=self.account)
+                    decision_price, combo_legs = None, None
+
+                # Only set outsideRth if outside regular trading hours
+                if not self.is_regular_trading_hours():
+                    order.outsideRth = True
+                order.exchange = contract.exchange
+                orders.append((contract, order, decision_price, combo_legs))
+
+            trades = self._place_orders(orders, 'combo', trace=trace)
+            combo = self.combos.start(signal)
+            for group, trade in zip(groups, trades):
+                self.combos.add_order(combo, trade.order.orderId, group, native=len(group) > 1)
+            print(f"Combo {combo['id']}: orders {[trade.order.orderId for trade in trades]}")
+            stages.mark('submit')
+
+            # One wait, notification and resync for every leg
             await asyncio.sleep(1)
-            avg_price = trade.orderStatus.avgFillPrice if hasattr(trade.orderStatus, 'avgFillPrice') else 0.0
-            
-            # Send notification for new position
+            lines = "\n".join(
+                f"{leg['side']} {leg['quantity']:g} {leg['localSymbol']}"
+                f" @ {'$' + format(leg['avgPrice'], '.2f') if leg['avgPrice'] else 'pending'}"
+                for leg in combo['legs']
+            )
+            native = sum(1 for order in combo['orders'] if order['native'])
             message = (
-                f"🔔 <b>New Position Initiated</b>\n\n"
-                f"Symbol: {contract.localSymbol}\n"
-                f"Action: {order_action}\n"
-                f"Quantity: {quantity}\n"
-                f"Order Type: MARKET\n"
-                f"Fill Price: ${avg_price:.2f}"
+                f"🔗 <b>Combo Order Placed</b>\n\n"
+                f"{lines}\n"
+                f"Orders: {len(trades)} ({native} native combo)\n"
+                f"Order Type: MARKET"
             )
             await self.send_telegram_message(message)
-            
+            stages.mark('notify')
+
             await asyncio.sleep(0.5)
             await self.resync_data()
-            return {"status": "success", "order_id": trade.order.orderId}
-            
+            stages.mark('resync')
+            stages.finish()
+            return {
+                "status": "success",
+                "combo_id": combo['id'],
+                "order_ids": [trade.order.orderId for trade in trades],
+            }
+
         except Exception as e:
-            print(f"Error processing signal: {e}")
+            print(f"Error processing combo: {e}")
             return {"status": "error", "message": str(e)}
 
+    async def get_combos(self):
+        """Recent combos with the fills of each leg"""
+        return self.combos.report()
+
     def _clean_message(self, message):
         """Clean numeric values in message"""
         def clean_value(v):
@@ -1020,56 +1818,32 @@ class IBHandler:
 
     async def auto_square_off_task(self):
         """Monitor and auto square off positions at configured time"""
-        while True:
-            try:
-                if self.settings.auto_square_off_enabled:
-                    est = pytz.timezone('US/Eastern')
-                    current_time = datetime.now(est).time()
-                    
-                    # Parse the configured square off time
-                    try:
-                        hour, minute = map(int, self.settings.auto_square_off_time.split(':'))
-                        cutoff_time = time(hour, minute)
-                    except (ValueError, AttributeError):
-                        # Fallback to default if time format is invalid
-                        cutoff_time = time(15, 55)
-                        print(f"Invalid square off time format, using default: {cutoff_time}")
-
-                    if current_time >= cutoff_time:
-                        print(f"Auto square-off triggered at {current_time}")
-                        positions = await self.get_positions()
-                        for pos in positions:
-                            await self.close_position(pos['contract']['conId'])
-                            print(f"Closed position: {pos['contract']['localSymbol']}")
-                        
-                        # Sleep until next day's session
-                        next_session = datetime.now(est) + timedelta(days=1)
-                        next_session = next_session.replace(hour=9, minute=30, second=0, microsecond=0)
-                        sleep_seconds = (next_session - datetime.now(est)).total_seconds()
-                        await asyncio.sleep(sleep_seconds)
-                    else:
-                        # Check every minute
-                        await asyncio.sleep(60)
-                else:
-                    # If auto square-off is disabled, check less frequently
-                    await asyncio.sleep(300)
-                
-            except Exception as e:
-                print(f"Error in auto square off task: {e}")
-                await asyncio.sleep(60)  # Wait a minute before retrying on error
+        await self.square_off.run()
+
+    async def get_square_off_runs(self):
+        """Return timelines of recent auto square-off runs"""
+        return list(self.square_off.runs)
 
     async def close_position(self, position_id: int):
+        self.events.record_signal('close', {'position_id': position_id})
+        trace = self.timelines.start('close', {'position_id': position_id}, self._decision_quote())
+        result = await self._close_position(position_id, trace)
+        self.timelines.finish_request(trace, result)
+        return result
+
+    async def _close_position(self, position_id: int, trace):
         try:
-            positions = await self.ib.reqPositionsAsync()
+            positions = await self._req_positions()
             for pos in positions:
                 if pos.contract.conId == position_id:
                     # Ensure contract is properly qualified
                     contract = pos.contract
-                    qualified_contracts = await self.ib.qualifyContractsAsync(contract)
+                    qualified_contracts = await self.pool.qualify_contracts(contract)
                     if not qualified_contracts:
                         return {"status": "error", "message": "Could not qualify contract"}
                     
                     qualified_contract = qualified_contracts[0]
+                    trace.mark('resolve_end', {'localSymbol': qualified_contract.localSymbol})
                     
                     # Create market order with proper exchange
                     action = 'SELL' if pos.position > 0 else 'BUY'
@@ -1082,7 +1856,10 @@ class IBHandler:
                     order.exchange = qualified_contract.exchange  # Set the exchange from qualified contract
                     
                     # Place the order
-                    trade = self.ib.placeOrder(qualified_contract, order)
+                    trade = self._place_order(
+                        qualified_contract, order, 'close', trace=trace,
+                        decision_price=self.marks.get(position_id)
+                    )
                     await asyncio.sleep(1)
                     avg_price=trade.orderStatus.avgFillPrice
                     # Send notification for position close
@@ -1109,7 +1886,7 @@ class IBHandler:
         """Place a buy order for an existing position"""
         try:
             # Find the position in current positions
-            positions = await self.ib.reqPositionsAsync()
+            positions = await self._req_positions()
             target_position = None
             
             for pos in positions:
@@ -1121,7 +1898,7 @@ class IBHandler:
                 return {"status": "error", "message": "Position not found"}
             
             # Qualify the contract
-            qualified_contracts = await self.ib.qualifyContractsAsync(target_position.contract)
+            qualified_contracts = await self.pool.qualify_contracts(target_position.contract)
             if not qualified_contracts:
                 return {"status": "error", "message": "Could not qualify contract"}
             
@@ -1130,14 +1907,14 @@ class IBHandler:
             # Place market order
             order = MarketOrder('BUY', quantity, account=self.account)
             
-            # Only set outsideRTH if outside regular trading hours
+            # Only set outsideRth if outside regular trading hours
             if not self.is_regular_trading_hours():
-                order.outsideRTH = True
+                order.outsideRth = True
                 
             order.exchange = qualified_contract.exchange
             
             # Place the order
-            trade = self.ib.placeOrder(qualified_contract, order)
+            trade = self._place_order(qualified_contract, order, 'position_buy')
             
             # Wait briefly for order status
             await asyncio.sleep(1)
@@ -1168,7 +1945,7 @@ class IBHandler:
         """Place a sell order for an existing position"""
         try:
             # Find the position in current positions
-            positions = await self.ib.reqPositionsAsync()
+            positions = await self._req_positions()
             target_position = None
             
             for pos in positions:
@@ -1184,7 +1961,7 @@ class IBHandler:
                 return {"status": "error", "message": "Sell quantity cannot exceed current position size"}
             
             # Qualify the contract
-            qualified_contracts = await self.ib.qualifyContractsAsync(target_position.contract)
+            qualified_contracts = await self.pool.qualify_contracts(target_position.contract)
             if not qualified_contracts:
                 return {"status": "error", "message": "Could not qualify contract"}
             
@@ -1193,14 +1970,14 @@ class IBHandler:
             # Place market order
             order = MarketOrder('SELL', quantity, account=self.account)
             
-            # Only set outsideRTH if outside regular trading hours
+            # Only set outsideRth if outside regular trading hours
             if not self.is_regular_trading_hours():
-                order.outsideRTH = True
+                order.outsideRth = True
                 
             order.exchange = qualified_contract.exchange
             
             # Place the order
-            trade = self.ib.placeOrder(qualified_contract, order)
+            trade = self._place_order(qualified_contract, order, 'position_sell')
             
             # Wait briefly for order status
             await asyncio.sleep(1)
@@ -1229,14 +2006,13 @@ class IBHandler:
 
     async def cancel_order(self, order_id):
         try:
-            trades = self.ib.trades()
-            for trade in trades:
-                if trade.order.orderId == int(order_id):
-                    self.ib.cancelOrder(trade.order)
-                    await asyncio.sleep(0.5)  # Give some time for the cancel to process
-                    await self.resync_data()  # Resync all data
-                    return {"status": "success", "message": "Order cancelled"}
-            return {"status": "error", "message": "Order not found"}
+            trade = self.orders.get(int(order_id))
+            if trade is None:
+                return {"status": "error", "message": "Order not found"}
+            self.ib.cancelOrder(trade.order)
+            await asyncio.sleep(0.5)  # Give some time for the cancel to process
+            await self.resync_data()  # Resync all data
+            return {"status": "success", "message": "Order cancelled"}
         except Exception as e:
             print(f"Error canceling order: {e}")
             return {"status": "error", "message": str(e)}
@@ -1249,13 +2025,12 @@ class IBHandler:
             # Resync positions
             positions = self.ib.positions(account=self.account)
             self.positions.clear()  # Clear existing positions
-            for position in positions:
-                await self.position_monitor(position)
+            await asyncio.gather(*(self.position_monitor(position) for position in positions))
                 
-            # Resync orders
-            trades = self.ib.trades()
+            # Resync orders; finished orders are already settled, so only working ones are replayed
+            self.orders.sweep()
             self.open_orders.clear()  # Clear existing orders
-            for trade in trades:
+            for trade in self.orders.open_trades():
                 self.order_status_monitor(trade)
                 
             # Resync portfolio data
@@ -1303,7 +2078,17 @@ class IBHandler:
             print(f"Error sending Telegram message: {e}")
 
     async def quick_trade_spy(self, signal):
-        """Handle quick trade panel signals for both SPY options and MES futures"""
+        """Handle quick trade panel signals for any registered instrument (SPY options, MES futures, ...)"""
+        self.events.record_signal('quick_trade', signal)
+        trace = self.timelines.start('quick_trade', signal, self._decision_quote())
+        result = await self._quick_trade_spy(signal, trace)
+        self.timelines.finish_request(trace, result)
+        if isinstance(result, dict):
+            result['signal_id'] = trace.trace_id
+        return result
+
+    async def _quick_trade_spy(self, signal, trace):
+        stages = StageTimer('quick_trade')
         try:
             if not self.settings.trading_enabled:
                 return {"status": "error", "message": "Trading is disabled"}
@@ -1321,178 +2106,12 @@ class IBHandler:
             if current_time >= cutoff_time:
                 return {"status": "error", "message": "Trading hours ended"}
             
-            action = signal['action']
-            instrument = signal.get('instrument', 'SPY')
-            
-            # Handle MES futures
-            if instrument == 'MES':
-                contract = await self.get_mes_contract()
-                if not contract:
-                    return {"status": "error", "message": "Could not qualify MES contract"}
-                
-                # For MES futures, "Buy MES" should be BUY, "Short MES" should be SELL
-                order_action = 'BUY' if 'Buy' in action else 'SELL'
-                quantity = signal.get('quantity', self.settings.mes_quantity)
-                
-                print(f"MES Order - Action: {order_action}, Quantity: {quantity}")
-                
-                # Place the order
-                order = MarketOrder(
-                    action=order_action,
-                    totalQuantity=quantity,
-                    account=self.account
-                )
-                
-                # Only set outsideRTH if outside regular trading hours
-                if not self.is_regular_trading_hours():
-                    order.outsideRTH = True
-                    
-                order.exchange = 'CME'                
-                print(f"Order: {order}")
-                trade = self.ib.placeOrder(contract, order)
-                print(f"Trade: {trade}")
-                
-                # Wait briefly for order status
-                await asyncio.sleep(1)
-                avg_price = trade.orderStatus.avgFillPrice if hasattr(trade.orderStatus, 'avgFillPrice') else 0.0
-                
-                # Send notification
-                message = (
-                    f"🔔 <b>Quick Trade Executed</b>\n\n"
-                    f"Symbol: MES\n"
-                    f"Action: {order_action}\n"
-                    f"Quantity: {quantity}\n"
-                    f"Fill Price: ${avg_price:.2f}"
-                )
-                await self.send_telegram_message(message)
-                
-                await asyncio.sleep(0.5)
-                await self.resync_data()
-                return {"status": "success", "order_id": trade.order.orderId}
-            
-            # Handle SPY options
-            else:
-                # Get base strike price
-                base_strike = round(self.current_spy_price)
-                
-                # Determine right and strike selection based on action
-                if 'Buy Call' in action:
-                    right = 'C'
-                    selection = self.settings.call_strike_selection
-                    if selection == "ATM":
-                        strike = base_strike
-                    elif selection == "OTM-1":
-                        strike = base_strike + 1
-                    elif selection == "OTM-2":
-                        strike = base_strike + 2
-                    elif selection == "OTM-3":
-                        strike = base_strike + 3
-                    else:
-                        strike = base_strike
-                elif 'Buy Put' in action:
-                    right = 'P'
-                    selection = self.settings.put_strike_selection
-                    if selection == "ATM":
-                        strike = base_strike
-                    elif selection == "OTM-1":
-                        strike = base_strike - 1
-                    elif selection == "OTM-2":
-                        strike = base_strike - 2
-                    elif selection == "OTM-3":
-                        strike = base_strike - 3
-                    else:
-                        strike = base_strike
-
-                # Get option chain details
-                contract = Stock('SPY', 'SMART', 'USD')
-                qualified_contracts = await self.ib.qualifyContractsAsync(contract)
-                if not qualified_contracts:
-                    return {"status": "error", "message": "Could not qualify SPY contract"}
-                
-                conId = qualified_contracts[0].conId
-                symbol = qualified_contracts[0].symbol
-                
-                # Get option chain
-                chains = await self.ib.reqSecDefOptParamsAsync(
-                    underlyingSymbol=symbol,
-                    futFopExchange='',
-                    underlyingSecType='STK',
-                    underlyingConId=conId
-                )
-                
-                if not chains:
-                    return {"status": "error", "message": "No option chains found for SPY"}
-                
-                # Sort expirations and get the appropriate one
-                chain = chains[0]
-                expirations = sorted(chain.expirations)
-                
-                if not expirations:
-                    return {"status": "error", "message": "No expirations found"}
-                
-                # Select expiration based on dte setting
-                expiry_index = min(self.settings.dte, len(expirations) - 1)
-                expiry = expirations[expiry_index]
-                
-                print(f"Creating SPY option: Strike={strike}, Right={right}, Expiry={expiry}")
-                
-                # Create the option contract
-                contract = Option(
-                    symbol='SPY',
-                    lastTradeDateOrContractMonth=expiry,
-                    strike=strike,
-                    right=right,
-                    exchange='SMART',
-                    currency='USD',
-                    multiplier='100'
-                )
-                
-                # Get contract details
-                details = await self.ib.reqContractDetailsAsync(contract)
-                if not details:
-                    return {"status": "error", "message": "Could not find matching option contract"}
-                
-                contract = details[0].contract
-                print(f"Using contract: {contract}")
-                
-                # Place the order
-                quantity = signal.get('quantity', self.settings.spy_quantity)
-                order = MarketOrder(
-                    action='BUY',
-                    totalQuantity=quantity,
-                    account=self.account
-                )
-                
-                # Only set outsideRTH if outside regular trading hours
-                if not self.is_regular_trading_hours():
-                    order.outsideRTH = True
-                    
-                order.exchange = 'SMART'                
-                print(f"Order: {order}")
-                trade = self.ib.placeOrder(contract, order)
-                print(f"Trade: {trade}")
-                
-                # Wait briefly for order status
-                await asyncio.sleep(1)
-                avg_price = trade.orderStatus.avgFillPrice if hasattr(trade.orderStatus, 'avgFillPrice') else 0.0
-                
-                # Send notification
-                message = (
-                    f"🔔 <b>Quick Trade Executed</b>\n\n"
-                    f"Symbol: {contract.localSymbol}\n"
-                    f"Action: {action}\n"
-                    f"Quantity: {quantity}\n"
-                    f"Strike: {strike}\n"
-                    f"Expiry: {expiry}\n"
-                    f"Fill Price: ${avg_price:.2f}"
-                )
-                await self.send_telegram_message(message)
-                
-                await asyncio.sleep(0.5)
-                await self.resync_data()
-                return {"status": "success", "order_id": trade.order.orderId}
+            instrument = lookup(signal.get('instrument', 'SPY'))
+            if instrument is None:
+                return {"status": "error", "message": f"Unsupported instrument: {signal.get('instrument')}"}
+            trace.mark('resolve_start')
+            return await self._open_position(instrument, signal, 'quick_trade', trace, stages, 'Quick Trade Executed')
             
         except Exception as e:
             print(f"Error in quick trade: {e}")
             return {"status": "error", "message": str(e)}
-
@@ -0,0 +1,168 @@
+"""Incremental indicators for strategies
+
+Each indicator keeps only the state it needs and does O(1) work per
+update, so a strategy can update several of them on every bar or tick.
+`value` is None until the indicator has seen enough data (`ready`).
+
+Bars are (time, open, high, low, close, volume) tuples, as delivered by the
+bar aggregator.
+"""
+from datetime import datetime, time, timedelta
+import pytz
+
+EASTERN = pytz.timezone('US/Eastern')
+
+def session_bounds(ts: float, open_time: time = time(9, 30)):
+    """(start, end) epoch seconds of the US/Eastern day containing `ts`, and that day's open"""
+    day = datetime.fromtimestamp(ts, EASTERN).date()
+    start = EASTERN.localize(datetime.combine(day, time(0, 0)))
+    end = EASTERN.localize(datetime.combine(day + timedelta(days=1), time(0, 0)))
+    opened = EASTERN.localize(datetime.combine(day, open_time))
+    return start.timestamp(), end.timestamp(), opened.timestamp()
+
+class EMA:
+    def __init__(self, period: int):
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.value = None
+        self.count = 0
+        self._seed = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.count >= self.period
+
+    def update(self, price: float):
+        self.count += 1
+        if self.count < self.period:
+            # Seed with the simple average of the first `period` prices
+            self._seed += price
+            return None
+        if self.count == self.period:
+            self.value = (self._seed + price) / self.period
+        else:
+            self.value += self.alpha * (price - self.value)
+        return self.value
+
+class VWAP:
+    """Volume-weighted average price since the start of the trading day"""
+
+    def __init__(self):
+        self.value = None
+        self.price_volume = 0.0
+        self.volume = 0.0
+        self._day_end = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, bar):
+        ts, _, high, low, close, volume = bar
+        if ts >= self._day_end:
+            _, self._day_end, _ = session_bounds(ts)
+            self.price_volume = self.volume = 0.0
+        if volume > 0:
+            self.price_volume += (high + low + close) / 3.0 * volume
+            self.volume += volume
+            self.value = self.price_volume / self.volume
+        return self.value
+
+class ATR:
+    """Average true range with Wilder's smoothing"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.value = None
+        self.count = 0
+        self._previous_close = None
+        self._seed = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, bar):
+        _, _, high, low, close, _ = bar
+        if self._previous_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high, self._previous_close) - min(low, self._previous_close)
+        self._previous_close = close
+        self.count += 1
+        if self.count < self.period:
+            self._seed += true_range
+        elif self.count == self.period:
+            self.value = (self._seed + true_range) / self.period
+        else:
+            self.value += (true_range - self.value) / self.period
+        return self.value
+
+class RSI:
+    """Relative strength index with Wilder's smoothing"""
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.value = None
+        self.count = 0
+        self._previous = None
+        self._gain = 0.0
+        self._loss = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, price: float):
+        if self._previous is None:
+            self._previous = price
+            return None
+        change = price - self._previous
+        self._previous = price
+        gain, loss = (change, 0.0) if change > 0 else (0.0, -change)
+        self.count += 1
+        if self.count <= self.period:
+            # Simple averages over the first `period` changes
+            self._gain += gain / self.period
+            self._loss += loss / self.period
+            if self.count < self.period:
+                return None
+        else:
+            self._gain += (gain - self._gain) / self.period
+            self._loss += (loss - self._loss) / self.period
+        self.value = 100.0 if self._loss == 0 else 100.0 - 100.0 / (1.0 + self._gain / self._loss)
+        return self.value
+
+class OpeningRange:
+    """High and low of the first `minutes` after the 9:30 ET open, reset daily"""
+
+    def __init__(self, minutes: int = 15, open_time: time = time(9, 30)):
+        self.minutes = minutes
+        self.open_time = open_time
+        self.high = None
+        self.low = None
+        self._range_start = 0.0
+        self._range_end = 0.0
+        self._day_end = 0.0
+        self._complete = False
+
+    @property
+    def ready(self) -> bool:
+        """True once the range window has closed for the day"""
+        return self.high is not None and self._complete
+
+    @property
+    def value(self):
+        return (self.high, self.low) if self.ready else None
+
+    def update(self, bar):
+        ts, _, high, low, _, _ = bar
+        if ts >= self._day_end:
+            _, self._day_end, self._range_start = session_bounds(ts, self.open_time)
+            self._range_end = self._range_start + self.minutes * 60
+            self.high = self.low = None
+        self._complete = ts >= self._range_end
+        if self._range_start <= ts < self._range_end:
+            self.high = high if self.high is None else max(self.high, high)
+            self.low = low if self.low is None else min(self.low, low)
+        return self.value
@@ -0,0 +1,316 @@
+"""Tradable instruments and how signals resolve to contracts
+
+Every underlying the app trades is declared once in INSTRUMENTS: whether a
+signal on it becomes an equity option, an index option or a future, where
+orders route, the contract multiplier, which setting sizes it and how far
+out of the money the strike ladder steps. IBHandler keeps one resolver per
+instrument, created on first use, which caches that instrument's qualified
+underlying, option chain and contracts, or a future's listed months and roll
+calendar, so repeat signals resolve without a round trip to the gateway.
+
+Adding a symbol is a new entry here; the handler never names one.
+"""
+import bisect
+import functools
+import re
+from datetime import date, datetime, timedelta
+import pytz
+from ib_insync import Stock, Index, Future, Option
+
+EQUITY_OPTION = 'equity_option'
+INDEX_OPTION = 'index_option'
+FUTURE = 'future'
+
+# How a future picks its front month: N days before expiry, or when the next month trades more
+ROLL_POLICIES = ('expiry', 'volume')
+
+EASTERN = pytz.timezone('US/Eastern')
+
+def trading_day() -> date:
+    return datetime.now(EASTERN).date()
+
+class Instrument:
+    def __init__(self, symbol: str, kind: str, exchange: str = 'SMART', multiplier: str = '100',
+                 quantity_setting: str = None, strike_increment: float = 1.0, underlying_exchange: str = 'SMART',
+                 trading_class: str = '', roll: str = 'expiry', roll_days: int = 8, currency: str = 'USD'):
+        if roll not in ROLL_POLICIES:
+            raise ValueError(f"Unknown roll policy {roll!r}; expected one of {ROLL_POLICIES}")
+        self.symbol = symbol
+        self.kind = kind
+        self.exchange = exchange  # Where orders route
+        self.multiplier = multiplier
+        self.quantity_setting = quantity_setting  # Settings field with the default order size, if it has its own
+        self.strike_increment = strike_increment
+        self.underlying_exchange = underlying_exchange
+        self.trading_class = trading_class  # Picks e.g. SPXW out of the SPX chains
+        self.roll = roll
+        self.roll_days = roll_days  # Days before expiry a future rolls; with 'volume', when it starts comparing
+        self.currency = currency
+
+    @property
+    def is_option(self) -> bool:
+        return self.kind != FUTURE
+
+    def quantity(self, settings, signal) -> int:
+        """Order size: the signal's own, else the instrument's setting"""
+        if signal.get('quantity'):
+            return signal['quantity']
+        if self.quantity_setting:
+            return getattr(settings, self.quantity_setting)
+        return settings.instrument_quantities.get(self.symbol, 1)
+
+    def order_action(self, action: str) -> str:
+        """Options are always bought, calls or puts giving the direction; futures buy or sell"""
+        if self.is_option:
+            return 'BUY'
+        return 'BUY' if 'Buy' in action else 'SELL'
+
+    def right(self, action: str) -> str:
+        """'Buy', 'Buy Call' and 'Buy Call Exit' are calls; 'Sell', 'Buy Put' and their exits are puts"""
+        return 'P' if 'Put' in action or 'Buy' not in action else 'C'
+
+    def strike(self, price: float, right: str, selection: str) -> float:
+        """Strike `selection` steps from the money: OTM is up for calls and down for puts"""
+        increment = self.strike_increment
+        base = round(price / increment) * increment
+        steps = strike_offset(selection)
+        return base + steps * increment if right == 'C' else base - steps * increment
+
+    def underlying(self):
+        if self.kind == INDEX_OPTION:
+            return Index(self.symbol, self.underlying_exchange, self.currency)
+        return Stock(self.symbol, self.underlying_exchange, self.currency)
+
+    def describe(self):
+        return {
+            'symbol': self.symbol,
+            'kind': self.kind,
+            'exchange': self.exchange,
+            'multiplier': self.multiplier,
+            'strikeIncrement': self.strike_increment if self.is_option else None,
+            'tradingClass': self.trading_class or None,
+            'roll': None if self.is_option else self.roll,
+            'rollDays': None if self.is_option else self.roll_days,
+        }
+
+INSTRUMENTS = {i.symbol: i for i in (
+    Instrument('SPY', EQUITY_OPTION, quantity_setting='spy_quantity'),
+    Instrument('QQQ', EQUITY_OPTION),
+    Instrument('IWM', EQUITY_OPTION),
+    Instrument('SPX', INDEX_OPTION, underlying_exchange='CBOE', trading_class='SPXW', strike_increment=5.0),
+    Instrument('XSP', INDEX_OPTION, underlying_exchange='CBOE', trading_class='XSP'),
+    Instrument('MES', FUTURE, exchange='CME', multiplier='5', quantity_setting='mes_quantity'),
+    Instrument('ES', FUTURE, exchange='CME', multiplier='50'),
+    Instrument('MNQ', FUTURE, exchange='CME', multiplier='2'),
+    Instrument('NQ', FUTURE, exchange='CME', multiplier='20'),
+)}
+
+# 'SPY', 'AMEX:SPY', 'MES1!', 'CME_MINI:MES1!' -> root symbol
+_SYMBOL = re.compile(r'^(?:[A-Z0-9_]+:)?([A-Z]+?)(?:\d+!)?$')
+
+@functools.lru_cache(maxsize=256)
+def lookup(symbol: str):
+    """Instrument for a signal or quick-trade symbol, or None"""
+    if not symbol:
+        return None
+    match = _SYMBOL.match(symbol.strip().upper())
+    return INSTRUMENTS.get(match.group(1)) if match else None
+
+@functools.lru_cache(maxsize=32)
+def strike_offset(selection: str) -> int:
+    """'ATM' -> 0, 'OTM-2' -> 2, 'ITM-1' -> -1; anything unrecognised is ATM"""
+    match = re.fullmatch(r'(OTM|ITM)-(\d+)', (selection or '').upper())
+    if not match:
+        return 0
+    steps = int(match.group(2))
+    return steps if match.group(1) == 'OTM' else -steps
+
+class OptionResolver:
+    """Qualified underlying, expirations and option contracts of one instrument
+
+    The underlying is qualified once. Expirations come from one
+    reqSecDefOptParams per day, and each (expiry, strike, right) is looked up
+    with reqContractDetails only the first time it's traded that day.
+    """
+
+    def __init__(self, instrument: Instrument, pool):
+        self.instrument = instrument
+        self.pool = pool
+        self.underlying = None
+        self.day = None
+        self.expirations = []
+        self.contracts = {}  # (expiry, strike, right) -> Option
+
+    async def underlying_contract(self):
+        if self.underlying is None:
+            qualified = await self.pool.qualify_contracts(self.instrument.underlying())
+            if not qualified:
+                raise LookupError(f"Could not qualify {self.instrument.symbol} contract")
+            self.underlying = qualified[0]
+        return self.underlying
+
+    async def expiry(self, dte: int) -> str:
+        today = trading_day().strftime('%Y%m%d')
+        if self.day != today or not self.expirations:
+            underlying = await self.underlying_contract()
+            chains = await self.pool.req_sec_def_opt_params(
+                underlyingSymbol=underlying.symbol,
+                futFopExchange='',
+                underlyingSecType=underlying.secType,
+                underlyingConId=underlying.conId
+            )
+            if not chains:
+                raise LookupError(f"No option chains found for {self.instrument.symbol}")
+            chain = self._chain(chains)
+            self.expirations = sorted(chain.expirations)
+            if self.day != today:
+                self.contracts.clear()
+            self.day = today
+        if not self.expirations:
+            raise LookupError(f"No expirations found for {self.instrument.symbol}")
+        # dte 0 is the closest expiry, 1 the next one
+        return self.expirations[min(dte, len(self.expirations) - 1)]
+
+    def _chain(self, chains):
+        trading_class = self.instrument.trading_class or self.instrument.symbol
+        for chain in chains:
+            if chain.exchange == 'SMART' and chain.tradingClass == trading_class:
+                return chain
+        return chains[0]
+
+    async def resolve(self, right: str, strike: float, expiry: str):
+        key = (expiry, strike, right)
+        contract = self.contracts.get(key)
+        if contract is not None:
+            return contract
+        instrument = self.instrument
+        print(f"Creating {instrument.symbol} option: Strike={strike}, Right={right}, Expiry={expiry}")
+        details = await self.pool.req_contract_details(Option(
+            symbol=instrument.symbol,
+            lastTradeDateOrContractMonth=expiry,
+            strike=strike,
+            right=right,
+            exchange=instrument.exchange,
+            currency=instrument.currency,
+            multiplier=instrument.multiplier,
+            tradingClass=instrument.trading_class
+        ))
+        if not details:
+            raise LookupError(f"Could not find matching {instrument.symbol} option contract")
+        contract = self.contracts[key] = details[0].contract
+        return contract
+
+def expiry_date(contract) -> date:
+    return datetime.strptime(contract.lastTradeDateOrContractMonth[:8], '%Y%m%d').date()
+
+class RollCalendar:
+    """Listed months of one future, nearest first, with the day each stops being the front month"""
+
+    def __init__(self, contracts, roll_days: int):
+        self.contracts = sorted(contracts, key=expiry_date)
+        self.expiries = [expiry_date(c) for c in self.contracts]
+        self.roll_dates = [expiry - timedelta(days=roll_days) for expiry in self.expiries]
+
+    def __len__(self):
+        return len(self.contracts)
+
+    def front(self, day: date) -> int:
+        """Index of the front month on `day`; len(self) once every listed month has rolled"""
+        return bisect.bisect_right(self.roll_dates, day)
+
+class FutureResolver:
+    """Front-month contract of one future, resolved from memory
+
+    The listed months are fetched with one reqContractDetails and kept as a
+    RollCalendar. The front contract is cached together with the day it
+    has to be looked at again, so a signal costs one date comparison until
+    the roll. With the 'volume' policy, from `roll_days` before expiry the
+    front and next months' volumes are compared once a day and the resolver
+    rolls as soon as the next month trades more, or the day before expiry.
+    """
+
+    def __init__(self, instrument: Instrument, pool):
+        self.instrument = instrument
+        self.pool = pool
+        self.calendar = None
+        self.contract = None
+        self.recheck = None  # Day the cached contract has to be looked at again
+        self.rolled_on_volume = set()  # conIds of months rolled out of early on volume
+
+    async def resolve(self, day: date = None):
+        day = day or trading_day()
+        if self.contract is not None and day < self.recheck:
+            return self.contract
+        return await self._roll(day)
+
+    async def _listed(self):
+        instrument = self.instrument
+        details = await self.pool.req_contract_details(Future(
+            symbol=instrument.symbol,
+            exchange=instrument.exchange,
+            currency=instrument.currency
+        ))
+        contracts = [d.contract for d in details if d.contract.lastTradeDateOrContractMonth]
+        if not contracts:
+            raise LookupError(f"Could not qualify {instrument.symbol} contract")
+        return RollCalendar(contracts, instrument.roll_days if instrument.roll == 'expiry' else 1)
+
+    async def _roll(self, day: date):
+        if self.calendar is None or self.calendar.front(day) >= len(self.calendar):
+            self.calendar = await self._listed()
+        calendar = self.calendar
+        index = calendar.front(day)
+        if index >= len(calendar):
+            raise LookupError(f"No listed {self.instrument.symbol} contract after {day}")
+        while index + 1 < len(calendar) and calendar.contracts[index].conId in self.rolled_on_volume:
+            index += 1
+        recheck = calendar.roll_dates[index]
+
+        if self.instrument.roll == 'volume' and index + 1 < len(calendar):
+            window = calendar.expiries[index] - timedelta(days=self.instrument.roll_days)
+            if day < window:
+                recheck = min(recheck, window)
+            elif await self._next_trades_more(calendar.contracts[index], calendar.contracts[index + 1]):
+                self.rolled_on_volume.add(calendar.contracts[index].conId)
+                index += 1
+                recheck = min(calendar.roll_dates[index],
+                              calendar.expiries[index] - timedelta(days=self.instrument.roll_days))
+            else:
+                recheck = min(recheck, day + timedelta(days=1))
+        self.recheck = recheck
+
+        contract = calendar.contracts[index]
+        if self.contract is None or contract.conId != self.contract.conId:
+            previous = self.contract.localSymbol if self.contract else None
+            print(f"Using {self.instrument.symbol} front month {contract.localSymbol} (was {previous}), "
+                  f"next check {self.recheck}")
+        self.contract = contract
+        return contract
+
+    async def _next_trades_more(self, front, following) -> bool:
+        try:
+            tickers = await self.pool.req_tickers(front, following)
+        except Exception as e:
+            print(f"Error comparing {self.instrument.symbol} volumes: {e}")
+            return False
+        volumes = {t.contract.conId: t.volume for t in tickers}
+        front_volume, next_volume = volumes.get(front.conId), volumes.get(following.conId)
+        # nan compares False, so missing volume never rolls early
+        return bool(front_volume is not None and next_volume is not None and next_volume > front_volume)
+
+    def describe(self):
+        if self.calendar is None:
+            return {'contract': None}
+        return {
+            'contract': self.contract.localSymbol if self.contract else None,
+            'recheck': self.recheck.isoformat() if self.recheck else None,
+            'calendar': [
+                {'contract': c.localSymbol, 'expiry': e.isoformat(), 'roll': r.isoformat()}
+                for c, e, r in zip(self.calendar.contracts, self.calendar.expiries, self.calendar.roll_dates)
+            ],
+        }
+
+def resolver_for(instrument: Instrument, pool):
+    if instrument.is_option:
+        return OptionResolver(instrument, pool)
+    return FutureResolver(instrument, pool)
@@ -0,0 +1,450 @@
+import asyncio
+import json
+import os
+import itertools
+import time as time_lib
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+from app.models.settings import Settings
+from app.metrics import CONNECTED_CLIENTS
+from app.profiler import ProfilerBusy
+
+# Commands API workers may forward to the engine process
+TRADING_COMMANDS = {
+    'process_signal',
+    'quick_trade_spy',
+    'place_combo',
+    'close_position',
+    'cancel_order',
+    'place_buy_order',
+    'place_sell_order',
+    'profile_signal',
+    'set_strategy_enabled',
+    'add_trigger',
+    'remove_trigger',
+}
+
+# Read-only queries answered by the engine without publishing new state
+QUERY_COMMANDS = {
+    'get_pool_status',
+    'get_instruments',
+    'get_executions',
+    'get_square_off_runs',
+    'get_metrics',
+    'get_order_timeline',
+    'get_order_latency',
+    'get_loop_health',
+    'get_memory_report',
+    'get_logs',
+    'get_bars',
+    'get_history',
+    'get_strategies',
+    'get_triggers',
+    'get_risk',
+    'get_combos',
+    'profile_cpu',
+}
+
+ENGINE_COMMANDS = TRADING_COMMANDS | QUERY_COMMANDS | {'update_settings', 'snapshot'}
+
+# Engine exceptions raised again by type in the API worker, so endpoints can map them to status codes
+REMOTE_ERRORS = {
+    'ProfilerBusy': ProfilerBusy,
+}
+
+# Seconds a write to an API worker may wait for its socket buffer to drain before the worker is dropped
+SEND_TIMEOUT = float(os.environ.get('ENGINE_SEND_TIMEOUT', 5.0))
+
+def _encode(message) -> bytes:
+    return (json.dumps(message, default=str) + '\n').encode()
+
+class _IPCSubscriber:
+    """Looks like a WebSocket to IBHandler's broadcaster but writes to an IPC stream"""
+
+    all_topics = True  # Workers filter topic messages for their own clients
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.lock = asyncio.Lock()
+        self.closed = False
+
+    @property
+    def client_state(self):
+        if self.closed or self.writer.is_closing():
+            return WebSocketState.DISCONNECTED
+        return WebSocketState.CONNECTED
+
+    async def send_json(self, message):
+        async with self.lock:
+            self.writer.write(_encode(message))
+            try:
+                # The broadcaster sends to every subscriber in turn, so one stalled worker must not hold it up
+                await asyncio.wait_for(self.writer.drain(), timeout=SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.closed = True
+                self.writer.close()
+                raise ConnectionError(f"API worker stalled for {SEND_TIMEOUT:g}s, dropping it")
+
+class EngineServer:
+    """Serve a single IBHandler session to API worker processes over a Unix socket"""
+
+    def __init__(self, ib_handler, path: str):
+        self.ib_handler = ib_handler
+        self.path = path
+        self.server = None
+        self.subscribers = []
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+        print(f"Engine listening on {self.path}")
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for subscriber in self.subscribers[:]:
+            subscriber.closed = True
+            subscriber.writer.close()
+        self.subscribers.clear()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscriber = _IPCSubscriber(writer)
+        self.subscribers.append(subscriber)
+        print(f"API worker connected ({len(self.subscribers)} total)")
+        try:
+            # Send the current state and settings so the worker can serve reads immediately
+            await subscriber.send_json({'type': 'settings', 'data': self.ib_handler.settings.dict()})
+            await subscriber.send_json(self.ib_handler.snapshot())
+            await self.ib_handler.register_websocket(subscriber)
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    print(f"Invalid engine request: {e}")
+                    continue
+                asyncio.create_task(self._dispatch(subscriber, request), name=f"engine:{request.get('cmd')}")
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        except Exception as e:
+            print(f"Engine client error: {e}")
+        finally:
+            subscriber.closed = True
+            await self.ib_handler.unregister_websocket(subscriber)
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            writer.close()
+            print(f"API worker disconnected ({len(self.subscribers)} remaining)")
+
+    async def _dispatch(self, subscriber: _IPCSubscriber, request: dict):
+        request_id = request.get('id')
+        cmd = request.get('cmd')
+        args = request.get('args', [])
+        try:
+            if cmd not in ENGINE_COMMANDS:
+                raise ValueError(f"Unknown engine command: {cmd}")
+
+            if cmd == 'snapshot':
+                result = self.ib_handler.snapshot()
+            elif cmd == 'update_settings':
+                settings = Settings(**args[0])
+                await self.ib_handler.update_settings(settings)
+                await self._publish({'type': 'settings', 'data': settings.dict()})
+                result = settings.dict()
+            elif cmd in QUERY_COMMANDS:
+                result = await getattr(self.ib_handler, cmd)(*args)
+            else:
+                result = await getattr(self.ib_handler, cmd)(*args)
+                # Commands change positions/orders, so push fresh state to every worker
+                await self.ib_handler.queue_update()
+
+            reply = {'type': 'reply', 'id': request_id, 'result': result}
+        except Exception as e:
+            print(f"Error executing engine command {cmd}: {e}")
+            reply = {'type': 'reply', 'id': request_id, 'error': str(e), 'errorType': type(e).__name__}
+
+        try:
+            await subscriber.send_json(reply)
+        except Exception as e:
+            print(f"Error replying to API worker: {e}")
+
+    async def _publish(self, message):
+        for subscriber in self.subscribers[:]:
+            try:
+                await subscriber.send_json(message)
+            except Exception as e:
+                print(f"Error publishing to API worker: {e}")
+
+class EngineClient:
+    """IBHandler stand-in used by stateless API workers
+
+    Reads are served from the latest state published by the engine process,
+    and commands are forwarded to it over the Unix socket.
+    """
+
+    def __init__(self, path: str, settings: Settings):
+        self.path = path
+        self.settings = settings
+        self.state = {
+            'positions': [],
+            'orders': [],
+            'pnl': {
+                'dailyPnL': 0.0,
+                'unrealizedPnL': 0.0,
+                'realizedPnL': 0.0,
+                'totalPnL': 0.0
+            },
+            'spyPrice': 0.0
+        }
+        self.active_websockets = []
+        self.subscriptions = {}  # websocket -> topics, as in IBHandler
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.write_lock = asyncio.Lock()
+        self.connected = asyncio.Event()
+        self.read_task = None
+        self.stopping = False
+        CONNECTED_CLIENTS.set_function(lambda: len(self.active_websockets))
+
+    async def connect(self):
+        self.stopping = False
+        await self._open()
+        self.read_task = asyncio.create_task(self._read_loop())
+
+    async def _open(self):
+        delay = 0.5
+        while not self.stopping:
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                self.connected.set()
+                print(f"Connected to engine at {self.path}")
+                return
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                print(f"Engine not available ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    async def disconnect(self):
+        self.stopping = True
+        self.connected.clear()
+        if self.read_task:
+            self.read_task.cancel()
+        if self.writer:
+            self.writer.close()
+        self._fail_pending("Engine connection closed")
+
+    def _fail_pending(self, message):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(message))
+        self.pending.clear()
+
+    async def _read_loop(self):
+        while not self.stopping:
+            try:
+                line = await self.reader.readline()
+                if not line:
+                    raise ConnectionError("Engine closed the connection")
+                await self._handle_message(json.loads(line))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.stopping:
+                    break
+                print(f"Lost engine connection: {e}")
+                self.connected.clear()
+                self._fail_pending(str(e))
+                await self._open()
+
+    async def _handle_message(self, message):
+        kind = message.get('type')
+        if kind == 'reply':
+            future = self.pending.pop(message.get('id'), None)
+            if future and not future.done():
+                if 'error' in message:
+                    error = REMOTE_ERRORS.get(message.get('errorType'), RuntimeError)
+                    future.set_exception(error(message['error']))
+                else:
+                    future.set_result(message.get('result'))
+        elif kind == 'settings':
+            self.settings = Settings(**message['data'])
+        elif kind == 'data':
+            self.state = message['data']
+            await self._fan_out(message)
+        else:
+            await self._fan_out(message)
+
+    async def _fan_out(self, message):
+        """Forward a published update to this worker's WebSocket clients"""
+        topic = message.get('topic')
+        to_remove = []
+        for ws in self.active_websockets:
+            if topic and topic not in self.subscriptions.get(ws, ()):
+                continue
+            try:
+                if ws.client_state == WebSocketState.CONNECTED:
+                    await ws.send_json(message)
+                else:
+                    to_remove.append(ws)
+            except Exception as e:
+                print(f"Error sending to websocket: {e}")
+                to_remove.append(ws)
+        for ws in to_remove:
+            if ws in self.active_websockets:
+                self.active_websockets.remove(ws)
+            self.subscriptions.pop(ws, None)
+
+    async def _call(self, cmd, *args, timeout=60):
+        await asyncio.wait_for(self.connected.wait(), timeout=timeout)
+        request_id = next(self.request_ids)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            async with self.write_lock:
+                self.writer.write(_encode({'id': request_id, 'cmd': cmd, 'args': list(args)}))
+                await self.writer.drain()
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _command(self, cmd, *args):
+        """Forward a trading command, reporting failures the way IBHandler does"""
+        try:
+            return await self._call(cmd, *args)
+        except Exception as e:
+            print(f"Error forwarding {cmd} to engine: {e}")
+            return {"status": "error", "message": str(e)}
+
+    async def register_websocket(self, websocket: WebSocket):
+        if websocket not in self.active_websockets:
+            self.active_websockets.append(websocket)
+
+    async def unregister_websocket(self, websocket: WebSocket):
+        if websocket in self.active_websockets:
+            self.active_websockets.remove(websocket)
+        self.subscriptions.pop(websocket, None)
+
+    async def subscribe(self, websocket: WebSocket, topic: str):
+        self.subscriptions.setdefault(websocket, set()).add(topic)
+
+    async def unsubscribe(self, websocket: WebSocket, topic: str):
+        self.subscriptions.get(websocket, set()).discard(topic)
+
+    def snapshot(self):
+        return {'type': 'data', 'timestamp': time_lib.time(), 'data': self.state}
+
+    async def get_positions(self):
+        return self.state['positions']
+
+    async def get_orders(self):
+        return self.state['orders']
+
+    async def get_pnl(self):
+        return self.state['pnl']
+
+    async def get_spy_price(self):
+        return self.state['spyPrice']
+
+    async def update_settings(self, settings: Settings):
+        self.settings = settings
+        await self._call('update_settings', settings.dict())
+
+    async def process_signal(self, signal):
+        return await self._command('process_signal', signal)
+
+    async def quick_trade_spy(self, signal):
+        return await self._command('quick_trade_spy', signal)
+
+    async def place_combo(self, signal):
+        return await self._command('place_combo', signal)
+
+    async def close_position(self, position_id: int):
+        return await self._command('close_position', position_id)
+
+    async def cancel_order(self, order_id):
+        return await self._command('cancel_order', order_id)
+
+    async def place_buy_order(self, position_id: int, quantity: int):
+        return await self._command('place_buy_order', position_id, quantity)
+
+    async def place_sell_order(self, position_id: int, quantity: int):
+        return await self._command('place_sell_order', position_id, quantity)
+
+    async def get_pool_status(self):
+        return await self._call('get_pool_status')
+
+    async def get_instruments(self):
+        return await self._call('get_instruments')
+
+    async def get_executions(self, limit=100, cursor=None, since=None, con_id=None, symbol=None):
+        return await self._call('get_executions', limit, cursor, since, con_id, symbol)
+
+    async def get_square_off_runs(self):
+        return await self._call('get_square_off_runs')
+
+    async def get_metrics(self, const_labels=None):
+        return await self._call('get_metrics', const_labels)
+
+    async def get_order_timeline(self, order_id: int):
+        return await self._call('get_order_timeline', order_id)
+
+    async def get_order_latency(self, source=None):
+        return await self._call('get_order_latency', source)
+
+    async def get_loop_health(self):
+        return await self._call('get_loop_health')
+
+    async def get_memory_report(self):
+        return await self._call('get_memory_report')
+
+    async def get_logs(self, since=None, level=None, limit=500):
+        return await self._call('get_logs', since, level, limit)
+
+    async def get_bars(self, symbol=None, con_id=None, size=5, since=None, until=None, limit=1000, partial=False):
+        return await self._call('get_bars', symbol, con_id, size, since, until, limit, partial)
+
+    async def get_history(self, symbol=None, con_id=None, size=60, since=None, until=None, limit=1000, partial=False):
+        # A long missing tail is fetched in paced chunks
+        return await self._call('get_history', symbol, con_id, size, since, until, limit, partial, timeout=300)
+
+    async def add_trigger(self, spec: dict):
+        return await self._command('add_trigger', spec)
+
+    async def remove_trigger(self, trigger_id: int):
+        return await self._command('remove_trigger', trigger_id)
+
+    async def get_risk(self):
+        return await self._call('get_risk')
+
+    async def get_combos(self):
+        return await self._call('get_combos')
+
+    async def get_triggers(self):
+        return await self._call('get_triggers')
+
+    async def get_strategies(self):
+        return await self._call('get_strategies')
+
+    async def set_strategy_enabled(self, name: str, enabled: bool):
+        return await self._command('set_strategy_enabled', name, enabled)
+
+    async def profile_cpu(self, seconds=10.0, fmt='collapsed', interval=0.005):
+        return await self._call('profile_cpu', seconds, fmt, interval, timeout=seconds + 30)
+
+    async def profile_signal(self, signal, fmt='collapsed'):
+        return await self._call('profile_signal', signal, fmt)
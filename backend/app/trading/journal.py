@@ -0,0 +1,341 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+EXECUTION_COLUMNS = [
+    'exec_id', 'perm_id', 'order_id', 'client_id', 'account', 'con_id',
+    'symbol', 'local_symbol', 'sec_type', 'multiplier', 'exchange', 'side',
+    'shares', 'price', 'cum_qty', 'avg_price', 'order_ref', 'time'
+]
+
+COMMISSION_COLUMNS = ['exec_id', 'commission', 'currency', 'realized_pnl']
+
+ORDER_COLUMNS = [
+    'order_id', 'perm_id', 'client_id', 'con_id', 'local_symbol', 'sec_type', 'action', 'quantity',
+    'order_type', 'lmt_price', 'status', 'filled', 'avg_fill_price', 'created', 'closed'
+]
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS executions (
+        exec_id TEXT PRIMARY KEY,
+        perm_id INTEGER,
+        order_id INTEGER,
+        client_id INTEGER,
+        account TEXT,
+        con_id INTEGER,
+        symbol TEXT,
+        local_symbol TEXT,
+        sec_type TEXT,
+        multiplier REAL,
+        exchange TEXT,
+        side TEXT,
+        shares REAL,
+        price REAL,
+        cum_qty REAL,
+        avg_price REAL,
+        order_ref TEXT,
+        time REAL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS commissions (
+        exec_id TEXT PRIMARY KEY,
+        commission REAL,
+        currency TEXT,
+        realized_pnl REAL
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_executions_time ON executions (time, exec_id)',
+    'CREATE INDEX IF NOT EXISTS idx_executions_con_id ON executions (con_id, time)',
+    'CREATE INDEX IF NOT EXISTS idx_executions_symbol ON executions (symbol, time)',
+    'CREATE INDEX IF NOT EXISTS idx_executions_order_id ON executions (order_id)',
+    '''CREATE TABLE IF NOT EXISTS order_timelines (
+        trace_id TEXT PRIMARY KEY,
+        created REAL,
+        data TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS order_timeline_orders (
+        order_id INTEGER PRIMARY KEY,
+        trace_id TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_order_timelines_created ON order_timelines (created)',
+    '''CREATE TABLE IF NOT EXISTS orders (
+        order_id INTEGER,
+        perm_id INTEGER,
+        client_id INTEGER,
+        con_id INTEGER,
+        local_symbol TEXT,
+        sec_type TEXT,
+        action TEXT,
+        quantity REAL,
+        order_type TEXT,
+        lmt_price REAL,
+        status TEXT,
+        filled REAL,
+        avg_fill_price REAL,
+        created REAL,
+        closed REAL,
+        PRIMARY KEY (perm_id, order_id)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders (order_id)',
+]
+
+# Statement used to write each kind of queued row
+INSERT_STATEMENTS = {
+    'executions': f"INSERT OR IGNORE INTO executions ({', '.join(EXECUTION_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(EXECUTION_COLUMNS))})",
+    'commissions': f"INSERT OR REPLACE INTO commissions ({', '.join(COMMISSION_COLUMNS)}) "
+                   f"VALUES ({', '.join('?' * len(COMMISSION_COLUMNS))})",
+    'order_timelines': 'INSERT OR REPLACE INTO order_timelines (trace_id, created, data) VALUES (?, ?, ?)',
+    'order_timeline_orders': 'INSERT OR REPLACE INTO order_timeline_orders (order_id, trace_id) VALUES (?, ?)',
+    'orders': f"INSERT OR REPLACE INTO orders ({', '.join(ORDER_COLUMNS)}) VALUES ({', '.join('?' * len(ORDER_COLUMNS))})",
+}
+
+def _timestamp(value) -> float:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value or 0.0)
+
+def _multiplier(contract) -> float:
+    try:
+        return float(contract.multiplier) if contract.multiplier else 1.0
+    except (TypeError, ValueError):
+        return 1.0
+
+class ExecutionJournal:
+    """Append-only SQLite (WAL) journal of executions, commissions and order timelines
+
+    Callbacks only enqueue rows; a background writer commits them in batches
+    on a dedicated thread so the event loop never waits on disk.
+    """
+
+    def __init__(self, path: str, batch_size: int = 200, flush_interval: float = 0.25):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+        self.queue = asyncio.Queue()
+        self.seen_exec_ids = set()
+        self.last_exec_time = None  # Epoch seconds of the newest journaled execution
+        self.writer_task = None
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+        row = self.conn.execute('SELECT MAX(time) FROM executions').fetchone()
+        self.last_exec_time = row[0] if row else None
+
+        # Remember recent fills so replays from the gateway are recognised as already seen
+        recent = self.conn.execute(
+            'SELECT exec_id FROM executions WHERE time >= ?',
+            ((self.last_exec_time or 0.0) - 86400,)
+        )
+        self.seen_exec_ids.update(exec_id for (exec_id,) in recent)
+        print(f"Opened execution journal at {self.path}")
+
+    def start(self):
+        if self.conn is None:
+            self.open()
+        if self.writer_task is None or self.writer_task.done():
+            self.writer_task = asyncio.create_task(self._writer(), name='execution_journal')
+
+    async def close(self):
+        if self.writer_task:
+            await self.flush()
+            self.writer_task.cancel()
+            self.writer_task = None
+        if self.conn:
+            await self._in_thread(self.conn.close)
+            self.conn = None
+
+    async def flush(self):
+        """Wait until everything queued so far has been written"""
+        await self.queue.join()
+
+    async def _in_thread(self, fn, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, fn, *args)
+
+    def record_execution(self, fill):
+        """Queue a fill for the journal; duplicates are dropped"""
+        execution = fill.execution
+        if execution.execId in self.seen_exec_ids:
+            return False
+        self.seen_exec_ids.add(execution.execId)
+        contract = fill.contract
+        exec_time = _timestamp(execution.time or fill.time)
+        row = (
+            execution.execId, execution.permId, execution.orderId, execution.clientId,
+            execution.acctNumber, contract.conId, contract.symbol, contract.localSymbol,
+            contract.secType, _multiplier(contract), execution.exchange, execution.side,
+            float(execution.shares), float(execution.price), float(execution.cumQty),
+            float(execution.avgPrice), execution.orderRef, exec_time
+        )
+        if self.last_exec_time is None or exec_time > self.last_exec_time:
+            self.last_exec_time = exec_time
+        self.queue.put_nowait(('executions', row))
+        return True
+
+    def record_commission(self, report):
+        """Queue a commission report for the journal"""
+        if not report.execId:
+            return
+        row = (report.execId, float(report.commission or 0.0), report.currency, float(report.realizedPNL or 0.0))
+        self.queue.put_nowait(('commissions', row))
+
+    async def _writer(self):
+        while True:
+            item = await self.queue.get()
+            batch = [item]
+            deadline = asyncio.get_event_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_event_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._in_thread(self._write_batch, batch)
+            except Exception as e:
+                print(f"Error writing execution journal batch: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_batch(self, batch):
+        rows = {}
+        for table, row in batch:
+            rows.setdefault(table, []).append(row)
+        with self.conn:
+            for table, table_rows in rows.items():
+                self.conn.executemany(INSERT_STATEMENTS[table], table_rows)
+
+    def record_timeline(self, trace_id: str, order_ids, created: float, data: str):
+        """Queue a completed order timeline (JSON) for the journal"""
+        self.queue.put_nowait(('order_timelines', (trace_id, created, data)))
+        for order_id in order_ids:
+            self.queue.put_nowait(('order_timeline_orders', (order_id, trace_id)))
+
+    async def load_timeline(self, order_id: int):
+        """Journaled timeline JSON for an order, or None"""
+        return await self._in_thread(self._load_timeline, order_id)
+
+    def _load_timeline(self, order_id: int):
+        row = self.conn.execute(
+            '''SELECT t.data FROM order_timeline_orders o
+               JOIN order_timelines t ON t.trace_id = o.trace_id
+               WHERE o.order_id = ?''',
+            (order_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def record_order(self, row: dict):
+        """Queue a finished order (an OrderStore archive record) for the journal"""
+        self.queue.put_nowait(('orders', tuple(row[c] for c in ORDER_COLUMNS)))
+
+    async def load_order(self, order_id: int = None, perm_id: int = None):
+        """Most recent journaled order with this orderId or permId, or None"""
+        return await self._in_thread(self._load_order, order_id, perm_id)
+
+    def _load_order(self, order_id, perm_id):
+        column, value = ('perm_id', perm_id) if perm_id is not None else ('order_id', order_id)
+        row = self.conn.execute(
+            f'SELECT {", ".join(ORDER_COLUMNS)} FROM orders WHERE {column} = ? ORDER BY created DESC LIMIT 1',
+            (value,)
+        ).fetchone()
+        return dict(zip(ORDER_COLUMNS, row)) if row else None
+
+    def catch_up_filter_time(self):
+        """IB ExecutionFilter time string for executions after the last journaled one"""
+        if self.last_exec_time is None:
+            return ''
+        since = datetime.fromtimestamp(self.last_exec_time, tz=timezone.utc)
+        return since.strftime('%Y%m%d-%H:%M:%S')
+
+    async def query_executions(self, limit: int = 100, cursor: str = None, since: float = None,
+                               con_id: int = None, symbol: str = None):
+        """Newest-first page of executions with their commissions
+
+        `cursor` is the `next` value of the previous page; it encodes the
+        (time, exec_id) of the last row so paging is a pure index seek.
+        """
+        rows = await self._in_thread(self._query_executions, limit, cursor, since, con_id, symbol)
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = f"{rows[-1]['time']!r}|{rows[-1]['exec_id']}"
+        return {'executions': rows, 'next': next_cursor}
+
+    def _query_executions(self, limit, cursor, since, con_id, symbol):
+        clauses = []
+        params = []
+        if cursor:
+            before_time, before_id = cursor.split('|', 1)
+            clauses.append('(e.time < ? OR (e.time = ? AND e.exec_id < ?))')
+            params.extend([float(before_time), float(before_time), before_id])
+        if since is not None:
+            clauses.append('e.time >= ?')
+            params.append(since)
+        if con_id is not None:
+            clauses.append('e.con_id = ?')
+            params.append(con_id)
+        if symbol:
+            clauses.append('e.symbol = ?')
+            params.append(symbol)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        params.append(limit)
+
+        cursor = self.conn.execute(
+            f'''SELECT {', '.join('e.' + c for c in EXECUTION_COLUMNS)},
+                       c.commission, c.currency, c.realized_pnl
+                FROM executions e LEFT JOIN commissions c ON c.exec_id = e.exec_id
+                {where}
+                ORDER BY e.time DESC, e.exec_id DESC
+                LIMIT ?''',
+            params
+        )
+        columns = EXECUTION_COLUMNS + ['commission', 'currency', 'realized_pnl']
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    async def load_executions(self, since: float = None, day_start: float = None):
+        """Executions (oldest first) joined with commissions, for rebuilding state at startup
+
+        With `day_start`, a contract's executions up to the last time it was flat before the day
+        started are left out: they affect neither its open lots nor today's realized PnL.
+        """
+        return await self._in_thread(self._load_executions, since, day_start)
+
+    def _load_executions(self, since: float = None, day_start: float = None):
+        query = f'''SELECT {', '.join('e.' + c for c in EXECUTION_COLUMNS)},
+                           c.commission, c.currency, c.realized_pnl
+                    FROM executions e LEFT JOIN commissions c ON c.exec_id = e.exec_id'''
+        params, where = [], []
+        if day_start is not None:
+            query = f'''WITH running AS (
+                            SELECT con_id, time, exec_id, SUM(CASE WHEN side IN ('BOT', 'BUY') THEN shares ELSE -shares END)
+                                   OVER (PARTITION BY con_id ORDER BY time, exec_id) AS position
+                            FROM executions WHERE time < ?
+                        ), flat AS (
+                            SELECT con_id, time, exec_id FROM (
+                                SELECT con_id, time, exec_id,
+                                       ROW_NUMBER() OVER (PARTITION BY con_id ORDER BY time DESC, exec_id DESC) AS n
+                                FROM running WHERE ABS(position) < 1e-9
+                            ) WHERE n = 1
+                        )
+                        {query} LEFT JOIN flat f ON f.con_id = e.con_id'''
+            params.append(day_start)
+            where.append('(f.con_id IS NULL OR (e.time, e.exec_id) > (f.time, f.exec_id))')
+        if since is not None:
+            where.append('e.time >= ?')
+            params.append(since)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY e.time, e.exec_id'
+        columns = EXECUTION_COLUMNS + ['commission', 'currency', 'realized_pnl']
+        return [dict(zip(columns, row)) for row in self.conn.execute(query, params)]
@@ -0,0 +1,129 @@
+from collections import deque
+
+class LotBook:
+    """FIFO lot matching per conId, independent of IB's PnL subscriptions
+
+    Each fill either extends the open lots on its side or consumes the oldest
+    lots on the opposite side, so every lot is pushed and popped once and a
+    fill costs amortized O(1). Realized PnL is tracked gross and net of
+    commissions, both in total and since the start of the trading day.
+    """
+
+    def __init__(self):
+        self.lots = {}  # conId -> deque of [signed quantity, price]
+        self.multipliers = {}
+        self.realized = {}  # conId -> gross realized PnL since day start
+        self.commissions = {}  # conId -> commissions since day start
+        self.exec_con_ids = {}  # execId -> conId, to attribute commission reports
+        self.commissioned = set()  # execIds whose commission has been counted
+        self.day_start = 0.0
+        self.daily_realized = 0.0
+        self.daily_commissions = 0.0
+
+    def start_day(self, day_start: float):
+        """Reset daily counters; lots carry over"""
+        self.day_start = day_start
+        self.realized.clear()
+        self.commissions.clear()
+        self.exec_con_ids.clear()
+        self.commissioned.clear()
+        self.daily_realized = 0.0
+        self.daily_commissions = 0.0
+
+    def apply_fill(self, con_id: int, side: str, shares: float, price: float,
+                   multiplier: float = 1.0, exec_id: str = None, time: float = None) -> float:
+        """Match a fill against open lots and return the gross PnL it realized"""
+        self.multipliers[con_id] = multiplier or 1.0
+        if exec_id:
+            self.exec_con_ids[exec_id] = con_id
+
+        quantity = shares if side in ('BOT', 'BUY') else -shares
+        lots = self.lots.setdefault(con_id, deque())
+        realized = 0.0
+
+        # Close against opposite-side lots, oldest first
+        while quantity and lots and (lots[0][0] > 0) != (quantity > 0):
+            lot = lots[0]
+            matched = min(abs(quantity), abs(lot[0]))
+            direction = 1 if lot[0] > 0 else -1
+            realized += (price - lot[1]) * matched * direction * self.multipliers[con_id]
+            lot[0] -= matched * direction
+            quantity += matched * direction
+            if lot[0] == 0:
+                lots.popleft()
+
+        # Whatever is left opens a new lot
+        if quantity:
+            lots.append([quantity, price])
+        elif not lots:
+            del self.lots[con_id]
+
+        if time is None or time >= self.day_start:
+            self.realized[con_id] = self.realized.get(con_id, 0.0) + realized
+            self.daily_realized += realized
+        return realized
+
+    def apply_commission(self, exec_id: str, commission: float, con_id: int = None, time: float = None):
+        if con_id is None:
+            con_id = self.exec_con_ids.get(exec_id)
+        if (time is not None and time < self.day_start) or exec_id in self.commissioned:
+            return
+        self.commissioned.add(exec_id)
+        commission = commission or 0.0
+        if con_id is not None:
+            self.commissions[con_id] = self.commissions.get(con_id, 0.0) + commission
+        self.daily_commissions += commission
+
+    def reconcile(self, con_id: int, position: float, avg_price: float, multiplier: float = 1.0):
+        """Seed lots for any part of a broker position the journal doesn't explain"""
+        missing = position - self.position(con_id)
+        if not missing:
+            return
+        self.multipliers.setdefault(con_id, multiplier or 1.0)
+        lots = self.lots.setdefault(con_id, deque())
+        if lots and (lots[0][0] > 0) != (missing > 0):
+            if position and (position > 0) == (lots[0][0] > 0):
+                # The broker holds fewer on the same side: closes the journal missed took the oldest lots
+                remaining = abs(missing)
+                while remaining:
+                    lot = lots[0]
+                    matched = min(remaining, abs(lot[0]))
+                    lot[0] -= matched if lot[0] > 0 else -matched
+                    remaining -= matched
+                    if lot[0] == 0:
+                        lots.popleft()
+                missing = 0
+            else:
+                # The broker is flat or on the other side; trust it
+                lots.clear()
+                missing = position
+        if missing:
+            # Positions that predate the journal are treated as the oldest lots
+            lots.appendleft([missing, avg_price])
+        if not lots:
+            del self.lots[con_id]
+
+    def rebuild(self, executions, day_start: float):
+        """Replay journaled executions (oldest first) in a single pass"""
+        self.lots.clear()
+        self.multipliers.clear()
+        self.start_day(day_start)
+        apply_fill = self.apply_fill
+        apply_commission = self.apply_commission
+        for row in executions:
+            apply_fill(row['con_id'], row['side'], row['shares'], row['price'],
+                       row['multiplier'], row['exec_id'], row['time'])
+            if row.get('commission') is not None:
+                apply_commission(row['exec_id'], row['commission'], row['con_id'], row['time'])
+
+    def position(self, con_id: int) -> float:
+        return sum(lot[0] for lot in self.lots.get(con_id, ()))
+
+    def unrealized(self, con_id: int, mark: float) -> float:
+        multiplier = self.multipliers.get(con_id, 1.0)
+        return sum((mark - price) * quantity * multiplier for quantity, price in self.lots.get(con_id, ()))
+
+    def realized_net(self, con_id: int = None) -> float:
+        if con_id is None:
+            return self.daily_realized - self.daily_commissions
+        return self.realized.get(con_id, 0.0) - self.commissions.get(con_id, 0.0)
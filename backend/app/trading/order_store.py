@@ -0,0 +1,138 @@
+import time as time_lib
+from collections import OrderedDict
+from app.trading.timeline import TERMINAL_STATUSES
+
+class OrderStore:
+    """Orders of this session, indexed by orderId and permId
+
+    Live orders stay in `active` as Trade objects. Once an order reaches a
+    terminal status it is kept for `grace` seconds (late fills and
+    commission reports still find it), then reduced to a summary record in a
+    bounded archive and written to the execution journal. The matching
+    Trade is also dropped from ib_insync's own trade list, so nothing that
+    walks live orders grows with the length of the session.
+    """
+
+    def __init__(self, journal=None, ib=None, grace: float = 30.0, archive_size: int = 1000):
+        self.journal = journal
+        self.ib = ib
+        self.grace = grace
+        self.archive_size = archive_size
+        self.active = {}  # orderId -> Trade
+        self.perm_ids = {}  # permId -> orderId, for active and archived orders
+        self.archive = OrderedDict()  # orderId -> summary record, oldest first
+        self._finished = OrderedDict()  # orderId -> time it reached a terminal status, oldest first
+        self._created = {}  # orderId -> time first seen
+
+    def __len__(self):
+        return len(self.active)
+
+    def update(self, trade):
+        """Track a trade from placeOrder or an order event; O(1)"""
+        order = trade.order
+        order_id = order.orderId
+        if not order_id and order.permId:
+            # Orders placed by other clients may only have a permId
+            order_id = self.perm_ids.get(order.permId, -order.permId)
+        if order_id in self.archive:
+            return
+        if order_id not in self.active:
+            self._created[order_id] = time_lib.time()
+        self.active[order_id] = trade
+        if order.permId:
+            self.perm_ids[order.permId] = order_id
+
+        if trade.orderStatus.status in TERMINAL_STATUSES:
+            self._finished.setdefault(order_id, time_lib.monotonic())
+        else:
+            self._finished.pop(order_id, None)
+        self.sweep()
+
+    def get(self, order_id: int):
+        """Trade for a live (or recently finished) order"""
+        return self.active.get(order_id)
+
+    def by_perm_id(self, perm_id: int):
+        order_id = self.perm_ids.get(perm_id)
+        return self.active.get(order_id) if order_id is not None else None
+
+    def archived(self, order_id: int):
+        """Summary record of an archived order still held in memory"""
+        return self.archive.get(order_id)
+
+    def open_trades(self):
+        """Trades that are still working at the gateway"""
+        return [t for t in self.active.values() if t.orderStatus.status not in TERMINAL_STATUSES]
+
+    def sweep(self, now: float = None):
+        """Archive orders whose grace period has passed; O(orders archived)"""
+        now = time_lib.monotonic() if now is None else now
+        while self._finished:
+            order_id, finished_at = next(iter(self._finished.items()))
+            if now - finished_at < self.grace:
+                break
+            del self._finished[order_id]
+            self._archive(order_id)
+
+    def _archive(self, order_id):
+        trade = self.active.pop(order_id, None)
+        if trade is None:
+            return
+        order, status, contract = trade.order, trade.orderStatus, trade.contract
+        record = {
+            'order_id': order_id,
+            'perm_id': order.permId,
+            'client_id': order.clientId,
+            'con_id': contract.conId,
+            'local_symbol': contract.localSymbol,
+            'sec_type': contract.secType,
+            'action': order.action,
+            'quantity': float(order.totalQuantity),
+            'order_type': order.orderType,
+            'lmt_price': _finite(order.lmtPrice),
+            'status': status.status,
+            'filled': float(status.filled),
+            'avg_fill_price': float(status.avgFillPrice or 0.0),
+            'created': self._created.pop(order_id, None),
+            'closed': time_lib.time(),
+        }
+        self.archive[order_id] = record
+        while len(self.archive) > self.archive_size:
+            _, evicted = self.archive.popitem(last=False)
+            if self.perm_ids.get(evicted['perm_id']) == evicted['order_id']:
+                del self.perm_ids[evicted['perm_id']]
+
+        if self.journal is not None:
+            try:
+                self.journal.record_order(record)
+            except Exception as e:
+                print(f"Error journaling order {order_id}: {e}")
+        self._release(trade)
+
+    def _release(self, trade):
+        """Drop an archived trade from ib_insync's session state"""
+        wrapper = getattr(self.ib, 'wrapper', None)
+        if wrapper is None:
+            return
+        order = trade.order
+        key = wrapper.orderKey(order.clientId, order.orderId, order.permId)
+        if wrapper.trades.get(key) is trade:
+            del wrapper.trades[key]
+        if wrapper.permId2Trade.get(order.permId) is trade:
+            del wrapper.permId2Trade[order.permId]
+
+    def stats(self):
+        return {
+            'active': len(self.active),
+            'open': sum(1 for t in self.active.values() if t.orderStatus.status not in TERMINAL_STATUSES),
+            'finishing': len(self._finished),
+            'archived': len(self.archive),
+        }
+
+def _finite(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    # ib_insync uses UNSET_DOUBLE (sys.float_info.max) for prices that aren't set
+    return value if value < 1e300 else None
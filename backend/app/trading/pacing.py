@@ -0,0 +1,30 @@
+import asyncio
+
+class Pacer:
+    """Token bucket that keeps outgoing gateway messages under IB's rate limit
+
+    IB disconnects clients that send more than ~50 messages per second, so
+    bursts (square-off, combo legs) acquire a token per message. Tokens refill
+    continuously, so a burst within the budget goes out without waiting.
+    """
+
+    def __init__(self, rate: float = 45, burst: int = 45):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = None
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            loop = asyncio.get_event_loop()
+            self._refill(loop.time())
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill(loop.time())
+            self.tokens -= 1
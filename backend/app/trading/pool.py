@@ -0,0 +1,218 @@
+from ib_insync import IB
+from ib_insync.wrapper import RequestError
+import asyncio
+import itertools
+import time as time_lib
+from app.metrics import IB_REQUEST_LATENCY
+
+# ib_insync logs these as warnings and doesn't end the request on them
+WARNING_CODES = {165, 202, 399, 404, 434, 492, 10167}
+# Error 162 also reports a history request that simply has no bars
+NO_DATA = 'query returned no data'
+
+class PooledClient:
+    """One read-only IB connection in the pool with its health state"""
+
+    def __init__(self, ib, client_id: int):
+        self.ib = ib
+        self.client_id = client_id
+        self.healthy = False
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0  # Consecutive failures, reset on success
+        self.last_error = None
+        self.down_since = None
+        self.reconnect_task = None
+
+    def status(self):
+        return {
+            'clientId': self.client_id,
+            'connected': self.ib.isConnected(),
+            'healthy': self.healthy,
+            'inflight': self.inflight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'lastError': self.last_error,
+            'downSince': self.down_since,
+        }
+
+class IBConnectionPool:
+    """Pool of extra IB clients for reference-data requests
+
+    Contract qualification, option chain, contract detail and historical
+    data requests are spread across the pool so they don't share the master connection's
+    socket and pacing budget. Orders, PnL and market data subscriptions stay
+    on the master client so order ids and callbacks remain in one session.
+    If no pooled client is healthy, requests fall back to the master.
+    """
+
+    def __init__(self, master: IB, host: str, port: int, size: int, client_id_base: int,
+                 ib_factory=IB, request_timeout: float = 10, max_failures: int = 3):
+        self.master = master
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.max_failures = max_failures
+        self.clients = [PooledClient(ib_factory(), client_id_base + i) for i in range(size)]
+        self._rotation = itertools.count()
+        self._closing = False
+
+    async def connect(self):
+        """Connect all pooled clients that aren't connected yet, in parallel"""
+        self._closing = False
+        pending = [c for c in self.clients if not c.ib.isConnected()]
+        if pending:
+            await asyncio.gather(*(self._connect_client(c) for c in pending))
+        healthy = sum(1 for c in self.clients if c.healthy)
+        print(f"Connection pool ready: {healthy}/{len(self.clients)} clients healthy")
+
+    async def _connect_client(self, client: PooledClient):
+        try:
+            await client.ib.connectAsync(self.host, self.port, clientId=client.client_id, timeout=self.request_timeout)
+            if not getattr(client, 'events_registered', False):
+                client.ib.disconnectedEvent += lambda c=client: self._on_client_disconnect(c)
+                client.ib.errorEvent += lambda reqId, code, msg, contract, c=client: self._on_client_error(c, code, msg)
+                client.events_registered = True
+            client.healthy = True
+            client.failures = 0
+            client.down_since = None
+        except Exception as e:
+            print(f"Pool client {client.client_id} failed to connect: {e}")
+            self._mark_down(client, str(e))
+
+    async def disconnect(self):
+        self._closing = True
+        for client in self.clients:
+            if client.reconnect_task:
+                client.reconnect_task.cancel()
+                client.reconnect_task = None
+            try:
+                if client.ib.isConnected():
+                    client.ib.disconnect()
+            except Exception as e:
+                print(f"Error disconnecting pool client {client.client_id}: {e}")
+            client.healthy = False
+
+    def _on_client_disconnect(self, client: PooledClient):
+        if not self._closing:
+            print(f"Pool client {client.client_id} disconnected")
+            self._mark_down(client, "disconnected")
+
+    def _on_client_error(self, client: PooledClient, errorCode, errorString):
+        # Only connectivity errors affect health; request errors are returned to the caller
+        if errorCode in [1100, 2110]:
+            self._mark_down(client, f"IB Error {errorCode}: {errorString}")
+        elif errorCode in [1101, 1102]:
+            client.healthy = client.ib.isConnected()
+
+    def _mark_down(self, client: PooledClient, reason: str):
+        client.healthy = False
+        client.last_error = reason
+        if client.down_since is None:
+            client.down_since = time_lib.time()
+        if not self._closing and (client.reconnect_task is None or client.reconnect_task.done()):
+            client.reconnect_task = asyncio.create_task(self._reconnect_client(client), name='pool_reconnect')
+
+    async def _reconnect_client(self, client: PooledClient):
+        delay = 1
+        while not self._closing and not client.healthy:
+            await asyncio.sleep(delay)
+            try:
+                if client.ib.isConnected():
+                    client.ib.disconnect()
+            except Exception:
+                pass
+            await self._connect_client(client)
+            delay = min(delay * 2, 60)
+        if client.healthy:
+            print(f"Pool client {client.client_id} reconnected")
+
+    def _pick(self, exclude):
+        """Least-loaded healthy client, rotating between equally loaded ones"""
+        candidates = [c for c in self.clients if c.healthy and c not in exclude and c.ib.isConnected()]
+        if not candidates:
+            return None
+        start = next(self._rotation) % len(candidates)
+        rotated = candidates[start:] + candidates[:start]
+        return min(rotated, key=lambda c: c.inflight)
+
+    async def _run(self, name, call):
+        """Run a request on a pooled client, failing over to others and then the master"""
+        tried = set()
+        while True:
+            client = self._pick(tried)
+            if client is None:
+                with IB_REQUEST_LATENCY.time(request=name):
+                    return await call(self.master)
+
+            client.inflight += 1
+            client.requests += 1
+            try:
+                with IB_REQUEST_LATENCY.time(request=name):
+                    result = await asyncio.wait_for(call(client.ib), timeout=self.request_timeout)
+                client.failures = 0
+                return result
+            except (asyncio.TimeoutError, ConnectionError, OSError) as e:
+                print(f"Pool client {client.client_id} failed {name}: {e!r}")
+                client.failures += 1
+                client.last_error = repr(e)
+                if client.failures >= self.max_failures or not client.ib.isConnected():
+                    self._mark_down(client, repr(e))
+                tried.add(client)
+            finally:
+                client.inflight -= 1
+
+    async def qualify_contracts(self, *contracts):
+        return await self._run('qualifyContracts', lambda ib: ib.qualifyContractsAsync(*contracts))
+
+    async def req_sec_def_opt_params(self, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        return await self._run('reqSecDefOptParams', lambda ib: ib.reqSecDefOptParamsAsync(
+            underlyingSymbol=underlyingSymbol,
+            futFopExchange=futFopExchange,
+            underlyingSecType=underlyingSecType,
+            underlyingConId=underlyingConId
+        ))
+
+    async def req_contract_details(self, contract):
+        return await self._run('reqContractDetails', lambda ib: ib.reqContractDetailsAsync(contract))
+
+    async def req_tickers(self, *contracts):
+        """Snapshot tickers, e.g. to compare the volumes of two futures months"""
+        return await self._run('reqTickers', lambda ib: ib.reqTickersAsync(*contracts))
+
+    async def req_historical_data(self, contract, end, duration: str, bar_size: str, what_to_show: str = 'TRADES',
+                                  use_rth: bool = False):
+        """Historical bars ending at `end` ('' = now), with UTC timestamps
+
+        ib_insync returns the same empty list for a failed request (pacing violation, farm down, no
+        permissions) as for one without bars; a failure raises RequestError here and a timeout
+        asyncio.TimeoutError, so an empty result really means there are no bars.
+        """
+        async def request(ib):
+            errors = []
+
+            def on_error(req_id, code, message, error_contract):
+                if code not in WARNING_CODES and not 2100 <= code < 2200 and NO_DATA not in message:
+                    errors.append((req_id, code, message))
+
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            ib.errorEvent += on_error
+            try:
+                bars = await ib.reqHistoricalDataAsync(
+                    contract, endDateTime=end, durationStr=duration, barSizeSetting=bar_size,
+                    whatToShow=what_to_show, useRTH=use_rth, formatDate=2, timeout=self.request_timeout
+                )
+            finally:
+                ib.errorEvent -= on_error
+            for req_id, code, message in errors:
+                if req_id == bars.reqId:
+                    raise RequestError(req_id, code, message)
+            if not bars and loop.time() - started >= self.request_timeout:
+                raise asyncio.TimeoutError(f"reqHistoricalData timed out for {contract}")
+            return bars
+
+        return await self._run('reqHistoricalData', request)
+
+    def status(self):
+        return [c.status() for c in self.clients]
@@ -0,0 +1,539 @@
+"""Deterministic replay of a recorded session through IBHandler
+
+Reads an event journal (see event_journal.py) and plays it back through a
+real IBHandler, including the broadcaster and the square-off scheduler, on
+an event loop with a virtual clock: sleeps and timeouts complete as soon as
+nothing else is runnable, so a trading day replays in seconds and the same
+journal always produces the same sequence of callbacks.
+
+Recorded signals are fed to the handler at their original times. Orders the
+handler places take the order ids of the recorded session, so the recorded
+order status, fill and commission events land on them. At the end the
+handler's positions, open orders and PnL are compared with the recorded
+session, along with every order the handler placed.
+
+    python -m app.trading.replay event_journal --session 0
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time as time_lib
+from datetime import datetime, timezone
+from eventkit import Event
+from ib_insync import Contract, Ticker, Trade, Order, OrderStatus, Execution, Fill, CommissionReport, Position, \
+    PortfolioItem, PnL, PnLSingle, OptionChain, ContractDetails, TradeLogEntry, util
+
+from app.trading import event_journal as ej
+
+TERMINAL_STATUSES = {'Filled', 'Cancelled', 'ApiCancelled', 'Inactive'}
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose clock jumps to the next timer whenever nothing is runnable
+
+    Work handed to executor threads is waited for in real time before the
+    clock moves, so thread round trips don't let timers fire early.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._virtual = 0.0
+        self._pending_io = 0
+
+    def time(self):
+        return self._virtual
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self._pending_io += 1
+        future.add_done_callback(self._io_done)
+        return future
+
+    def _io_done(self, future):
+        self._pending_io -= 1
+
+    def _run_once(self):
+        if not self._ready and self._scheduled and not self._pending_io:
+            when = self._scheduled[0]._when
+            if when > self._virtual:
+                self._virtual = when
+        super()._run_once()
+
+class RecordedSession:
+    """One recorded session: contracts, signals and inbound events with their times"""
+
+    def __init__(self, events, contracts):
+        self.events = events  # [(wall time, kind, payload)]
+        self.contracts = contracts  # conId -> Contract
+        self.start = events[0][0] if events else 0.0
+        self.end = events[-1][0] if events else 0.0
+
+        # Order ids in the order they first appear, so replayed orders get the same ids
+        self.order_ids = []
+        self.recorded_orders = {}  # orderId -> first ORDER payload
+        self.final_positions = {}
+        self.final_status = {}
+        self.final_pnl = None
+        seen = set()
+        for _, kind, payload in events:
+            if kind == ej.ORDER:
+                order_id = payload[0]
+                if order_id not in seen:
+                    seen.add(order_id)
+                    self.order_ids.append(order_id)
+                    self.recorded_orders[order_id] = payload
+                self.final_status[order_id] = payload[8]
+            elif kind == ej.POSITION:
+                self.final_positions[payload[1]] = payload[2]
+            elif kind == ej.PNL:
+                self.final_pnl = payload
+
+    @classmethod
+    def load(cls, directory, session: int = -1):
+        """Load the n-th session (split at 'connect' markers); -1 is the most recent"""
+        sessions, contracts = [], {}
+        current = None
+        for ts, kind, payload in ej.iter_events(directory):
+            if kind == ej.CONTRACT:
+                fields = dict(zip(ej.FIELDS[ej.CONTRACT], payload))
+                if math.isnan(fields['strike']):
+                    fields['strike'] = 0.0
+                contracts[fields['conId']] = fields
+                continue
+            if kind == ej.SESSION and payload[0] == 'open':
+                current = []
+                sessions.append(current)
+            if current is None:
+                current = []
+                sessions.append(current)
+            current.append((ts, kind, payload))
+        if not sessions:
+            raise ValueError(f"No recorded sessions in {directory}")
+        return cls(sessions[session], {conId: Contract.create(**f) for conId, f in contracts.items()})
+
+    def contract(self, conId):
+        found = self.contracts.get(conId)
+        return Contract.create(**util.dataclassNonDefaults(found)) if found else Contract(conId=conId)
+
+    def match(self, contract):
+        """Recorded contract matching a (possibly unqualified) request"""
+        if contract.conId:
+            return self.contracts.get(contract.conId)
+        for known in self.contracts.values():
+            if known.secType != contract.secType or known.symbol != contract.symbol:
+                continue
+            expiry = contract.lastTradeDateOrContractMonth
+            if expiry and not known.lastTradeDateOrContractMonth.startswith(expiry):
+                continue
+            if contract.secType == 'OPT' and (float(known.strike) != float(contract.strike) or known.right != contract.right):
+                continue
+            return known
+        return None
+
+class ReplayIB:
+    """IB client stand-in fed from a RecordedSession"""
+
+    def __init__(self, replay: 'Replay'):
+        self.replay = replay
+        self.session = replay.session
+        self.connected = False
+        self.client_id = None
+        self.tickers = {}  # conId -> Ticker
+        self._trades = {}  # orderId -> Trade
+        self._fills = {}  # execId -> (trade, fill)
+        self._positions = {}  # conId -> Position
+        self._portfolio = {}  # conId -> PortfolioItem
+        self.pnl = None
+        self.pnl_singles = {}
+
+        self.connectedEvent = Event('connectedEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+        self.openOrderEvent = Event('openOrderEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.commissionReportEvent = Event('commissionReportEvent')
+        self.positionEvent = Event('positionEvent')
+        self.updatePortfolioEvent = Event('updatePortfolioEvent')
+        self.pendingTickersEvent = Event('pendingTickersEvent')
+        self.pnlEvent = Event('pnlEvent')
+        self.pnlSingleEvent = Event('pnlSingleEvent')
+        self.errorEvent = Event('errorEvent')
+
+    async def connectAsync(self, host='127.0.0.1', port=4001, clientId=1, timeout=4, readonly=False, account=''):
+        self.client_id = clientId
+        self.connected = True
+        self.connectedEvent.emit()
+        return self
+
+    def isConnected(self):
+        return self.connected
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self.disconnectedEvent.emit()
+
+    def reqMarketDataType(self, marketDataType):
+        pass
+
+    async def qualifyContractsAsync(self, *contracts):
+        qualified = []
+        for contract in contracts:
+            known = self.session.match(contract)
+            if known is None:
+                self.errorEvent.emit(0, 200, 'No security definition has been found for the request', contract)
+                continue
+            util.dataclassUpdate(contract, known)
+            qualified.append(contract)
+        return qualified
+
+    async def reqSecDefOptParamsAsync(self, underlyingSymbol, futFopExchange, underlyingSecType, underlyingConId):
+        session_day = datetime.fromtimestamp(self.session.start).strftime('%Y%m%d')
+        options = [c for c in self.session.contracts.values() if c.secType == 'OPT' and c.symbol == underlyingSymbol]
+        expirations = sorted({c.lastTradeDateOrContractMonth for c in options if c.lastTradeDateOrContractMonth >= session_day})
+        strikes = sorted({float(c.strike) for c in options})
+        if not expirations:
+            return []
+        return [OptionChain('SMART', underlyingConId, underlyingSymbol, '100', expirations, strikes)]
+
+    async def reqContractDetailsAsync(self, contract):
+        known = self.session.match(contract)
+        return [ContractDetails(contract=self.session.contract(known.conId))] if known else []
+
+    def reqMktData(self, contract, *args, **kwargs):
+        ticker = self.tickers.get(contract.conId)
+        if ticker is None:
+            ticker = self.tickers[contract.conId] = Ticker(contract=contract)
+        return ticker
+
+    def cancelMktData(self, contract):
+        self.tickers.pop(contract.conId, None)
+
+    def placeOrder(self, contract, order):
+        order_id = self.replay.next_order_id(contract, order)
+        order.orderId = order_id
+        order.clientId = self.client_id
+        trade = self._trades.get(order_id)
+        if trade is None:
+            status = OrderStatus(orderId=order_id, status='PendingSubmit', remaining=order.totalQuantity)
+            trade = Trade(contract, order, status, [], [TradeLogEntry(datetime.now(timezone.utc), 'PendingSubmit', '')])
+            self._trades[order_id] = trade
+        else:
+            # Recorded status arrived before the handler got here; keep it, adopt the handler's order
+            trade.order = order
+            trade.contract = contract
+        return trade
+
+    def cancelOrder(self, order):
+        self.replay.cancels.append(order.orderId)
+        return self._trades.get(order.orderId)
+
+    def trades(self):
+        return list(self._trades.values())
+
+    def openTrades(self):
+        return [t for t in self._trades.values() if t.orderStatus.status not in TERMINAL_STATUSES]
+
+    def positions(self, account=''):
+        return [p for p in self._positions.values() if p.position]
+
+    async def reqPositionsAsync(self):
+        return self.positions()
+
+    def portfolio(self, account=''):
+        return list(self._portfolio.values())
+
+    async def reqExecutionsAsync(self, execFilter=None):
+        return []
+
+    def reqPnL(self, account, modelCode=''):
+        self.pnl = PnL(account=account, modelCode=modelCode)
+        return self.pnl
+
+    def cancelPnL(self, account, modelCode=''):
+        self.pnl = None
+
+    def reqPnLSingle(self, account, modelCode, conId):
+        self.pnl_singles[conId] = PnLSingle(account=account, modelCode=modelCode, conId=conId)
+        return self.pnl_singles[conId]
+
+    def cancelPnLSingle(self, account, modelCode, conId):
+        self.pnl_singles.pop(conId, None)
+
+    # Playback of recorded inbound events
+
+    def _trade(self, order_id, payload):
+        trade = self._trades.get(order_id)
+        if trade is None:
+            _, perm_id, conId, action, quantity, order_type, lmt, aux, status, filled, remaining, avg = payload
+            order = Order(orderId=order_id, permId=perm_id, action=action, totalQuantity=quantity, orderType=order_type)
+            trade = Trade(self.session.contract(conId), order, OrderStatus(orderId=order_id), [], [])
+            self._trades[order_id] = trade
+        return trade
+
+    def play(self, kind, payload):
+        if kind == ej.TICKER:
+            ticker = self.tickers.get(payload[0])
+            if ticker is not None:
+                _, ticker.bid, ticker.ask, ticker.last, ticker.close, ticker.bidSize, ticker.askSize, ticker.lastSize = payload
+                ticker.time = datetime.now(timezone.utc)
+                self.pendingTickersEvent.emit({ticker})
+        elif kind == ej.ORDER:
+            trade = self._trade(payload[0], payload)
+            status = trade.orderStatus
+            status.status, status.filled, status.remaining, status.avgFillPrice = payload[8], payload[9], payload[10], payload[11]
+            trade.order.permId = payload[1]
+            self.openOrderEvent.emit(trade)
+            self.orderStatusEvent.emit(trade)
+        elif kind == ej.FILL:
+            exec_id, order_id, perm_id, conId, side, shares, price, exec_time, cum_qty, avg_price, acct = payload
+            trade = self._trade(order_id, (order_id, perm_id, conId, 'BUY' if side == 'BOT' else 'SELL', shares, 'MKT',
+                                           0.0, 0.0, 'Submitted', 0.0, 0.0, 0.0))
+            when = datetime.fromtimestamp(exec_time, timezone.utc)
+            execution = Execution(execId=exec_id, time=when, acctNumber=acct, side=side, shares=shares, price=price,
+                                  permId=perm_id, orderId=order_id, cumQty=cum_qty, avgPrice=avg_price)
+            fill = Fill(self.session.contract(conId), execution, CommissionReport(), when)
+            trade.fills.append(fill)
+            self._fills[exec_id] = (trade, fill)
+            self.execDetailsEvent.emit(trade, fill)
+        elif kind == ej.COMMISSION:
+            exec_id, commission, currency, realized = payload
+            trade, fill = self._fills.get(exec_id, (None, None))
+            if fill is not None:
+                report = fill.commissionReport
+                report.execId, report.commission, report.currency, report.realizedPNL = exec_id, commission, currency, realized
+                self.commissionReportEvent.emit(trade, fill, report)
+        elif kind == ej.POSITION:
+            account, conId, position, avg_cost = payload
+            update = Position(account, self.session.contract(conId), position, avg_cost)
+            self._positions[conId] = update
+            self.positionEvent.emit(update)
+        elif kind == ej.PORTFOLIO:
+            conId = payload[0]
+            item = PortfolioItem(self.session.contract(conId), *payload[1:], '')
+            self._portfolio[conId] = item
+            self.updatePortfolioEvent.emit(item)
+        elif kind == ej.PNL:
+            if self.pnl is not None:
+                self.pnl.dailyPnL, self.pnl.unrealizedPnL, self.pnl.realizedPnL = payload
+                self.pnlEvent.emit(self.pnl)
+        elif kind == ej.PNL_SINGLE:
+            pnl = self.pnl_singles.get(payload[0])
+            if pnl is not None:
+                _, pnl.dailyPnL, pnl.unrealizedPnL, pnl.realizedPnL, pnl.position, pnl.value = payload
+                self.pnlSingleEvent.emit(pnl)
+        elif kind == ej.ERROR:
+            reqId, code, message, conId = payload
+            self.errorEvent.emit(reqId, code, message, self.session.contract(conId) if conId else None)
+
+class ReplayWebSocket:
+    """Counts broadcast updates and how long after the triggering event they went out"""
+
+    client_state = None  # Set to WebSocketState.CONNECTED by Replay
+
+    def __init__(self):
+        self.updates = 0
+
+    async def send_json(self, data):
+        self.updates += 1
+
+class Replay:
+    """Drive an IBHandler from a RecordedSession on a virtual clock"""
+
+    def __init__(self, session: RecordedSession, settings, workdir: str):
+        self.session = session
+        self.settings = settings
+        self.workdir = workdir
+        self.placed = []  # (orderId, conId, action, quantity)
+        self.mismatches = []
+        self.cancels = []
+        self.signal_real = []
+        self._order_ids = iter(session.order_ids)
+        self._primary = None
+        self.handler = None
+
+    def client(self):
+        client = ReplayIB(self)
+        if self._primary is None:
+            # The handler's own connection is created first; pool clients only serve reference data
+            self._primary = client
+        return client
+
+    def next_order_id(self, contract, order):
+        order_id = next(self._order_ids, None)
+        if order_id is None:
+            order_id = max(self.session.order_ids + [o[0] for o in self.placed], default=0) + 1
+            self.mismatches.append({'orderId': order_id, 'reason': 'extra order', 'conId': contract.conId,
+                                    'action': order.action, 'quantity': float(order.totalQuantity)})
+        else:
+            recorded = self.session.recorded_orders[order_id]
+            expected = (recorded[2], recorded[3], float(recorded[4]))
+            actual = (contract.conId, order.action, float(order.totalQuantity))
+            if expected != actual:
+                self.mismatches.append({'orderId': order_id, 'reason': 'differs', 'expected': expected, 'actual': actual})
+        self.placed.append((order_id, contract.conId, order.action, float(order.totalQuantity)))
+        return order_id
+
+    def wall_clock(self):
+        return self.session.start + asyncio.get_event_loop().time()
+
+    async def _run_signal(self, source, signal):
+        handler = self.handler
+        started = time_lib.perf_counter()
+        if source == 'quick_trade':
+            await handler.quick_trade_spy(signal)
+        elif source == 'close':
+            await handler.close_position(signal['position_id'])
+        elif source == 'combo':
+            await handler.place_combo(signal)
+        else:
+            await handler.process_signal(signal, source=source)
+        self.signal_real.append(time_lib.perf_counter() - started)
+
+    async def _feed(self, signals):
+        """Play recorded events and start recorded signals at their recorded times"""
+        loop = asyncio.get_event_loop()
+        replayed = 0
+        for ts, kind, payload in self.session.events:
+            delay = (ts - self.session.start) - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if kind == ej.SIGNAL:
+                signals.append(asyncio.create_task(self._run_signal(payload[0], json.loads(payload[1]))))
+            elif kind not in (ej.SESSION, ej.CONTRACT):
+                self._primary.play(kind, payload)
+            replayed += 1
+        return replayed
+
+    async def run(self):
+        from starlette.websockets import WebSocketState
+        from app.trading.ib_handler import IBHandler
+
+        os.environ['EXECUTION_JOURNAL_PATH'] = os.path.join(self.workdir, 'executions.db')
+        os.environ['EVENT_JOURNAL_DIR'] = os.path.join(self.workdir, 'event_journal')
+        os.environ['BAR_STORE_DIR'] = os.path.join(self.workdir, 'bar_store')
+        handler = self.handler = IBHandler(self.settings, ib_factory=self.client)
+
+        async def no_telegram(message):
+            pass
+
+        handler.send_telegram_message = no_telegram
+        handler.square_off.clock = self.wall_clock
+        # Recorded strategy signals are replayed as events; the live strategies only compute
+        handler.strategies.dry_run = True
+        ReplayWebSocket.client_state = WebSocketState.CONNECTED
+        socket = ReplayWebSocket()
+        await handler.register_websocket(socket)
+
+        real_start = time_lib.perf_counter()
+        loop = asyncio.get_event_loop()
+        signals = []
+        # Events recorded while connect() was running are played alongside it, not after it
+        feed = asyncio.create_task(self._feed(signals))
+        await handler.connect()
+        square_off = asyncio.create_task(handler.square_off.run())
+        replayed = await feed
+        if signals:
+            await asyncio.gather(*signals)
+        await asyncio.sleep(5)  # Let trailing resyncs and broadcasts finish
+        real_elapsed = time_lib.perf_counter() - real_start
+        square_off.cancel()
+
+        report = {
+            'events': replayed,
+            'signals': len(signals),
+            'virtualSeconds': round(loop.time(), 3),
+            'realSeconds': round(real_elapsed, 3),
+            'speedup': round(loop.time() / real_elapsed, 1) if real_elapsed else None,
+            'eventsPerSecond': round(replayed / real_elapsed, 1) if real_elapsed else None,
+            'signalRealMs': _percentiles(self.signal_real),
+            'broadcasts': socket.updates,
+            'ordersPlaced': len(self.placed),
+            'squareOffRuns': len(handler.square_off.runs),
+        }
+        report['divergences'] = self.verify()
+        await handler.disconnect()
+        return report
+
+    def verify(self):
+        """Differences between the handler's final state and the recorded session"""
+        handler = self.handler
+        divergences = list(self.mismatches)
+
+        expected_positions = {conId: pos for conId, pos in self.session.final_positions.items() if pos}
+        actual_positions = {conId: p['position'] for conId, p in handler.positions.items() if p['position']}
+        if expected_positions != actual_positions:
+            divergences.append({'reason': 'positions', 'expected': expected_positions, 'actual': actual_positions})
+
+        expected_open = {oid for oid, status in self.session.final_status.items() if status not in TERMINAL_STATUSES}
+        actual_open = set(handler.open_orders)
+        if expected_open != actual_open:
+            divergences.append({'reason': 'open orders', 'expected': sorted(expected_open), 'actual': sorted(actual_open)})
+
+        placed_ids = {o[0] for o in self.placed}
+        missing = [oid for oid in self.session.order_ids if oid not in placed_ids and oid > 0]
+        if missing:
+            divergences.append({'reason': 'orders not placed in replay', 'orderIds': missing})
+
+        if self.session.final_pnl is not None:
+            expected = dict(zip(('dailyPnL', 'unrealizedPnL', 'realizedPnL'), self.session.final_pnl))
+            for key, value in expected.items():
+                actual = handler.current_pnl.get(key, 0.0)
+                if not math.isnan(value) and abs(actual - value) > 0.01:
+                    divergences.append({'reason': f'pnl {key}', 'expected': value, 'actual': actual})
+        return divergences
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000, 3)
+    return {'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'mean': round(statistics.fmean(values) * 1000, 3)}
+
+def replay(directory, session: int = -1, settings_path=None, verbose: bool = False):
+    """Replay one recorded session on a fresh virtual-clock loop and return the report"""
+    from pathlib import Path
+    from app.models.settings import load_settings
+
+    recorded = RecordedSession.load(directory, session)
+    loop = VirtualClockLoop()
+    asyncio.set_event_loop(loop)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        settings = load_settings(Path(settings_path) if settings_path else Path(workdir) / 'settings.json')
+        # IBHandler writes its execution and event journals to the working directory
+        os.chdir(workdir)
+        try:
+            output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                return loop.run_until_complete(Replay(recorded, settings, workdir).run())
+        finally:
+            os.chdir(cwd)
+            # Handlers leave their broadcaster tasks running after disconnect
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded IB session through IBHandler")
+    parser.add_argument('directory', help="Event journal directory")
+    parser.add_argument('--session', type=int, default=-1, help="Session index, -1 for the most recent")
+    parser.add_argument('--settings', help="settings.json to replay with (default: built-in defaults)")
+    parser.add_argument('--verbose', action='store_true', help="Show handler output")
+    args = parser.parse_args()
+
+    report = replay(args.directory, args.session, args.settings, args.verbose)
+    print(json.dumps(report, indent=2, default=str))
+    if report['divergences']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Pre-trade risk checks
+
+Every order goes through RiskEngine.check before placeOrder, and orders
+placed together (the groups of a combo) are checked as one. The engine keeps
+its exposure aggregates up to date from fills, position updates and order
+status events, so a check is a handful of dict lookups and compares instead
+of a scan of positions and open orders:
+
+- net contracts per underlying, positions plus working orders
+- notional per underlying (premium for options), positions plus working orders
+- today's realized PnL net of commissions, from the lot book
+- orders submitted in the last `order_window_seconds`
+
+Orders that only reduce an existing position always pass, so exits (square
+off, triggers, closes) are never blocked. An order adding to a leg whose price
+is unknown is rejected while a notional limit applies to its underlying,
+rather than counted as zero notional. Limits come from the settings; a
+limit of 0 is off, and `underlying_risk_limits` overrides them per
+underlying, e.g. {"MES": {"max_net_contracts": 4}}.
+"""
+import time as time_lib
+from collections import deque
+from app.metrics import RISK_REJECTIONS
+from app.trading.timeline import TERMINAL_STATUSES
+
+def order_legs(contract, action: str, price: float = None, legs=None):
+    """(contract, signed quantity, price) of what one unit of an order trades: its own contract, or the
+    combo legs of a BAG, given as (contract, action, ratio, price)"""
+    sign = 1 if action == 'BUY' else -1
+    if legs is None:
+        return [(contract, sign, price)]
+    return [(leg, sign * ratio if leg_action == 'BUY' else -sign * ratio, leg_price)
+            for leg, leg_action, ratio, leg_price in legs]
+
+class RiskRejected(Exception):
+    def __init__(self, reason: str, message: str):
+        super().__init__(f"Risk check failed: {message}")
+        self.reason = reason
+
+class RiskEngine:
+    def __init__(self, settings, lots, clock=time_lib.time):
+        self.lots = lots  # LotBook; its daily realized PnL is kept incrementally
+        self.clock = clock
+        self.configure(settings)
+
+        self.positions = {}  # conId -> signed quantity
+        self.contracts = {}  # conId -> (underlying, multiplier)
+        self.position_notional = {}  # conId -> notional of the position
+        self.net = {}  # underlying -> net contracts held
+        self.notional = {}  # underlying -> notional held
+        self.open_quantity = {}  # underlying -> signed remaining quantity of working orders
+        self.open_notional = {}  # underlying -> notional of working orders
+        self.working = {}  # orderId -> [remaining quantity, [(underlying, signed legs per unit, notional per leg)]]
+        self.recent = deque()  # Submission times of exposure-increasing orders
+
+        self.checks = 0
+        self.check_seconds = 0.0
+        self.rejections = deque(maxlen=50)
+
+    def configure(self, settings):
+        self.enabled = settings.risk_enabled
+        self.max_net_contracts = settings.max_net_contracts
+        self.max_notional = settings.max_notional
+        self.max_daily_loss = settings.max_daily_loss
+        self.max_orders = settings.max_orders_per_window
+        self.order_window = settings.order_window_seconds
+        self.overrides = settings.underlying_risk_limits
+
+    def _contract(self, contract):
+        info = self.contracts.get(contract.conId)
+        if info is None:
+            try:
+                multiplier = float(contract.multiplier) if contract.multiplier else 1.0
+            except (TypeError, ValueError):
+                multiplier = 1.0
+            info = self.contracts[contract.conId] = (contract.symbol, multiplier)
+        return info
+
+    def _limit(self, underlying: str, name: str):
+        override = self.overrides.get(underlying)
+        if override and name in override:
+            return override[name]
+        return getattr(self, name)
+
+    # Pre-trade check
+
+    def needs_price(self, contract) -> bool:
+        """Whether a notional limit applies to the contract's underlying, so an entry on it needs its price"""
+        return bool(self.enabled and self._limit(contract.symbol, 'max_notional'))
+
+    def check(self, orders):
+        """Raise RiskRejected if the (quantity, order_legs(...)) orders would together breach a limit"""
+        started = time_lib.perf_counter()
+        try:
+            self._check(orders)
+        except RiskRejected as e:
+            RISK_REJECTIONS.inc(reason=e.reason)
+            self.rejections.append({
+                'time': self.clock(), 'reason': e.reason, 'message': str(e),
+                'legs': [f"{signed * quantity:+g} {contract.localSymbol or contract.symbol}"
+                         for quantity, legs in orders for contract, signed, _ in legs],
+            })
+            raise
+        finally:
+            self.checks += 1
+            self.check_seconds += time_lib.perf_counter() - started
+
+    def _check(self, orders):
+        if not self.enabled:
+            return
+        increasing = False
+        for quantity, legs in orders:
+            for contract, signed, _ in legs:
+                held = self.positions.get(contract.conId, 0.0)
+                if not held or (held > 0) == (signed > 0) or abs(signed * quantity) > abs(held):
+                    increasing = True
+        if not increasing:
+            return  # Only reduces positions
+
+        if self.max_daily_loss and self.lots.realized_net() <= -self.max_daily_loss:
+            raise RiskRejected('daily_loss', f"daily realized loss limit {self.max_daily_loss} reached")
+
+        now = self.clock()
+        recent = self.recent
+        while recent and recent[0] <= now - self.order_window:
+            recent.popleft()
+        if self.max_orders and len(recent) + len(orders) > self.max_orders:
+            raise RiskRejected('order_rate', f"{len(recent)} orders in the last {self.order_window:g}s")
+
+        # Legs on one underlying add up, so a spread is limited by its net
+        net, notional, unpriced = {}, {}, {}
+        for quantity, legs in orders:
+            for contract, signed, price in legs:
+                underlying, multiplier = self._contract(contract)
+                net[underlying] = net.get(underlying, 0.0) + signed * quantity
+                if price:
+                    notional[underlying] = notional.get(underlying, 0.0) + abs(signed) * quantity * price * multiplier
+                else:
+                    held = self.positions.get(contract.conId, 0.0)
+                    if not held or (held > 0) == (signed > 0) or abs(signed * quantity) > abs(held):
+                        unpriced.setdefault(underlying, contract)
+        for underlying, change in net.items():
+            max_contracts = self._limit(underlying, 'max_net_contracts')
+            if max_contracts and change:
+                projected = self.net.get(underlying, 0.0) + self.open_quantity.get(underlying, 0.0) + change
+                if abs(projected) > max_contracts:
+                    raise RiskRejected('net_contracts',
+                                       f"{underlying} net contracts would be {projected:g} (limit {max_contracts:g})")
+        for underlying, contract in unpriced.items():
+            max_notional = self._limit(underlying, 'max_notional')
+            if max_notional:
+                raise RiskRejected('no_price', f"no price for {contract.localSymbol or contract.symbol} to check "
+                                               f"the {underlying} notional limit")
+        for underlying, added in notional.items():
+            max_notional = self._limit(underlying, 'max_notional')
+            if max_notional:
+                projected = self.notional.get(underlying, 0.0) + self.open_notional.get(underlying, 0.0) + added
+                if projected > max_notional:
+                    raise RiskRejected('notional',
+                                       f"{underlying} notional would be {projected:,.0f} (limit {max_notional:,.0f})")
+        recent.extend([now] * len(orders))
+
+    # Aggregate maintenance
+
+    def on_submit(self, order_id: int, quantity: float, legs):
+        """Count a placed order as working until its status says otherwise"""
+        entries = []
+        for contract, signed, price in legs:
+            underlying, multiplier = self._contract(contract)
+            unit = (price or 0.0) * multiplier
+            entries.append((underlying, signed, unit))
+            self.open_quantity[underlying] = self.open_quantity.get(underlying, 0.0) + signed * quantity
+            self.open_notional[underlying] = self.open_notional.get(underlying, 0.0) + abs(signed) * quantity * unit
+        self.working[order_id] = [float(quantity), entries]
+
+    def on_order_status(self, trade):
+        entry = self.working.get(trade.order.orderId)
+        if entry is None:
+            return
+        status = trade.orderStatus
+        if status.status in TERMINAL_STATUSES:
+            remaining = 0.0
+        else:
+            remaining = float(status.remaining or 0.0)
+            if not remaining:
+                return  # Not acknowledged yet
+        change = remaining - entry[0]
+        if not change:
+            return
+        for underlying, signed, unit in entry[1]:
+            self.open_quantity[underlying] += signed * change
+            self.open_notional[underlying] += abs(signed) * change * unit
+        if remaining:
+            entry[0] = remaining
+        else:
+            del self.working[trade.order.orderId]
+
+    def on_fill(self, contract, side: str, shares: float, price: float):
+        signed = shares if side in ('BOT', 'BUY') else -shares
+        self._set_position(contract, self.positions.get(contract.conId, 0.0) + signed, price)
+
+    def on_position(self, contract, position: float, avg_cost: float):
+        """Broker position update; IB's avgCost is per contract, multiplier included"""
+        _, multiplier = self._contract(contract)
+        self._set_position(contract, float(position), float(avg_cost or 0.0) / multiplier)
+
+    def _set_position(self, contract, position: float, price: float):
+        con_id = contract.conId
+        underlying, multiplier = self._contract(contract)
+        previous = self.positions.get(con_id, 0.0)
+        notional = abs(position) * price * multiplier
+        previous_notional = self.position_notional.get(con_id, 0.0)
+        self.net[underlying] = self.net.get(underlying, 0.0) + position - previous
+        self.notional[underlying] = self.notional.get(underlying, 0.0) + notional - previous_notional
+        if position:
+            self.positions[con_id] = position
+            self.position_notional[con_id] = notional
+        else:
+            self.positions.pop(con_id, None)
+            self.position_notional.pop(con_id, None)
+
+    def report(self):
+        underlyings = set(self.net) | set(self.open_quantity)
+        return {
+            'enabled': self.enabled,
+            'limits': {
+                'maxNetContracts': self.max_net_contracts,
+                'maxNotional': self.max_notional,
+                'maxDailyLoss': self.max_daily_loss,
+                'maxOrdersPerWindow': self.max_orders,
+                'orderWindowSeconds': self.order_window,
+                'underlyings': self.overrides,
+            },
+            'exposure': {u: {
+                'netContracts': self.net.get(u, 0.0),
+                'notional': round(self.notional.get(u, 0.0), 2),
+                'openContracts': self.open_quantity.get(u, 0.0),
+                'openNotional': round(self.open_notional.get(u, 0.0), 2),
+            } for u in sorted(underlyings)},
+            'realizedToday': round(self.lots.realized_net(), 2),
+            'recentOrders': len(self.recent),
+            'workingOrders': len(self.working),
+            'checks': self.checks,
+            'meanCheckMicros': round(self.check_seconds / self.checks * 1e6, 2) if self.checks else None,
+            'rejections': list(self.rejections),
+        }
@@ -0,0 +1,219 @@
+from ib_insync import MarketOrder
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta, time
+import pytz
+import time as time_lib
+
+class SquareOffScheduler:
+    """Timer-driven auto square-off
+
+    Sleeps until shortly before the configured square-off time, makes sure
+    every open position has a qualified contract ready, then at the exact
+    time sends all closing orders at once through the pacer. Flatness is
+    confirmed from execution events, and each run's timeline is kept for
+    /api/square-off/runs.
+    """
+
+    def __init__(self, handler, stage_lead: float = 30, confirm_timeout: float = 60, history: int = 20):
+        self.handler = handler
+        self.stage_lead = stage_lead
+        self.confirm_timeout = confirm_timeout
+        self.runs = deque(maxlen=history)
+        self.est = pytz.timezone('US/Eastern')
+        self.clock = time_lib.time  # Wall clock; replays substitute a virtual one
+        self.last_fired_date = None
+        self._rearm = asyncio.Event()
+        self._active_run = None
+        self._order_legs = {}  # orderId -> leg record of the active run
+        self._flat = asyncio.Event()
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self.clock(), self.est)
+
+    def rearm(self):
+        """Recompute the timer, e.g. after settings change"""
+        self._rearm.set()
+
+    def cutoff_time(self) -> time:
+        try:
+            hour, minute = map(int, self.handler.settings.auto_square_off_time.split(':'))
+            return time(hour, minute)
+        except (ValueError, AttributeError):
+            print("Invalid square off time format, using default: 15:55")
+            return time(15, 55)
+
+    def next_cutoff(self) -> datetime:
+        now = self.now()
+        cutoff = self.est.localize(datetime.combine(now.date(), self.cutoff_time()))
+        if self.last_fired_date == now.date():
+            cutoff = self.est.localize(datetime.combine(now.date() + timedelta(days=1), self.cutoff_time()))
+        # A cutoff already passed today and not yet run fires immediately
+        return cutoff
+
+    async def _sleep_until(self, when: datetime) -> bool:
+        """Sleep until a wall-clock time; returns True if re-armed before it"""
+        while True:
+            remaining = (when - self.now()).total_seconds()
+            if remaining <= 0:
+                return False
+            # Re-check the wall clock at least once a minute so long sleeps don't drift
+            try:
+                await asyncio.wait_for(self._rearm.wait(), timeout=min(remaining, 60))
+                self._rearm.clear()
+                return True
+            except asyncio.TimeoutError:
+                continue
+
+    async def run(self):
+        while True:
+            try:
+                if not self.handler.settings.auto_square_off_enabled:
+                    try:
+                        await asyncio.wait_for(self._rearm.wait(), timeout=300)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._rearm.clear()
+                    continue
+
+                cutoff = self.next_cutoff()
+                print(f"Auto square-off armed for {cutoff.isoformat()}")
+                run = {'cutoff': cutoff.isoformat(), 'armedAt': self.clock()}
+
+                if await self._sleep_until(cutoff - timedelta(seconds=self.stage_lead)):
+                    continue
+                await self.stage(run)
+
+                if await self._sleep_until(cutoff):
+                    continue
+                self.last_fired_date = cutoff.date()
+                await self.fire(run)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in auto square off task: {e}")
+                await asyncio.sleep(60)  # Wait a minute before retrying on error
+
+    async def stage(self, run):
+        """Qualify contracts for every open position ahead of the cutoff"""
+        handler = self.handler
+        missing = [conId for conId in handler.positions if conId not in handler.position_contracts]
+        if missing:
+            await asyncio.gather(*(handler.ensure_position_contract(conId) for conId in missing))
+        run['stagedAt'] = self.clock()
+        run['stagedPositions'] = len(handler.positions)
+
+    async def _build_orders(self):
+        """Closing market orders for the local position book; a position whose contract can't be
+        qualified, even now, gets a None contract so it shows up as a failed leg"""
+        handler = self.handler
+        positions = [(conId, pos) for conId, pos in list(handler.positions.items()) if pos['position']]
+        # Positions opened since stage(), or whose staging failed
+        missing = [conId for conId, _ in positions if conId not in handler.position_contracts]
+        if missing:
+            await asyncio.gather(*(handler.ensure_position_contract(conId) for conId in missing))
+        orders = []
+        for conId, pos in positions:
+            contract = handler.position_contracts.get(conId)
+            quantity = pos['position']
+            action = 'SELL' if quantity > 0 else 'BUY'
+            order = MarketOrder(action=action, totalQuantity=abs(quantity), account=handler.account)
+            if not contract:
+                orders.append((conId, pos['contract'].get('localSymbol'), None, order))
+                continue
+            order.outsideRth = True
+            order.exchange = contract.exchange
+            orders.append((conId, contract.localSymbol, contract, order))
+        return orders
+
+    async def fire(self, run):
+        handler = self.handler
+        run['firedAt'] = self.clock()
+        run['legs'] = []
+        self._active_run = run
+        self._order_legs = {}
+        self._flat.clear()
+        print(f"Auto square-off triggered at {self.now().time()}")
+
+        trace = handler.timelines.start('square_off', {'cutoff': run.get('cutoff')}, handler._decision_quote())
+        try:
+            orders = await self._build_orders()
+            for conId, local_symbol, contract, order in orders:
+                leg = {
+                    'conId': conId,
+                    'localSymbol': local_symbol,
+                    'action': order.action,
+                    'quantity': order.totalQuantity,
+                    'orderId': None,
+                    'placedAt': None,
+                    'filled': 0.0,
+                    'filledAt': None,
+                }
+                run['legs'].append(leg)
+                if contract is None:
+                    leg['error'] = "contract could not be qualified"
+                    print(f"Auto square-off: can't close {local_symbol or conId}: contract could not be qualified")
+                    continue
+                # One failed close must not keep the others from going out
+                try:
+                    await handler.pacer.acquire()
+                    trade = handler._place_order(
+                        contract, order, 'square_off', trace=trace,
+                        decision_price=handler.marks.get(conId)
+                    )
+                except Exception as e:
+                    leg['error'] = str(e)
+                    print(f"Auto square-off: error closing {local_symbol}: {e}")
+                    continue
+                leg['orderId'] = trade.order.orderId
+                leg['placedAt'] = self.clock()
+                self._order_legs[trade.order.orderId] = leg
+            run['submittedAt'] = self.clock()
+            failed = [leg for leg in run['legs'] if 'error' in leg]
+
+            if orders:
+                summary = "\n".join(
+                    f"{leg['action']} {leg['quantity']} {leg['localSymbol']}" +
+                    (f" FAILED: {leg['error']}" if 'error' in leg else "")
+                    for leg in run['legs']
+                )
+                asyncio.create_task(handler.send_telegram_message(
+                    f"🔄 <b>Auto Square-Off</b>\n\n{summary}"
+                ), name='telegram')
+            if not orders:
+                run['status'] = 'no_positions'
+                run['flatAt'] = run['firedAt']
+            elif not self._order_legs:
+                run['status'] = 'error'
+            else:
+                try:
+                    await asyncio.wait_for(self._flat.wait(), timeout=self.confirm_timeout)
+                    run['status'] = 'partial' if failed else 'flat'
+                except asyncio.TimeoutError:
+                    run['status'] = 'timeout'
+                    print("Auto square-off: not all closing orders filled in time")
+        finally:
+            self._active_run = None
+            self._order_legs = {}
+            run.setdefault('status', 'error')
+            self.runs.append(run)
+            run['signalId'] = trace.trace_id
+            status = run['status']
+            handler.timelines.finish_request(trace, {'status': 'success' if status in ('flat', 'timeout') else status})
+
+        print(f"Auto square-off finished: {run['status']}")
+        await handler.resync_data()
+
+    def on_fill(self, trade, fill):
+        """Track fills of the closing orders; called from execDetailsEvent"""
+        leg = self._order_legs.get(trade.order.orderId)
+        if not leg:
+            return
+        leg['filled'] += float(fill.execution.shares)
+        if leg['filled'] >= leg['quantity'] and leg['filledAt'] is None:
+            leg['filledAt'] = self.clock()
+            leg['avgPrice'] = float(fill.execution.avgPrice)
+            if all(l['filledAt'] is not None for l in self._order_legs.values()):
+                self._active_run['flatAt'] = leg['filledAt']
+                self._flat.set()
@@ -0,0 +1,262 @@
+"""In-process strategy runtime
+
+Strategies run inside the handler on the live bar and trade stream instead
+of waiting for an external alert. A strategy names the instrument and bar
+size it watches, updates its incremental indicators in on_bar (and, if it
+needs to, on_trade) and returns a signal dict of the same shape as
+/api/signal, e.g. {'symbol': 'SPY', 'action': 'Buy'}. The runtime hands
+that signal straight to process_signal, so decision to order is the
+strategy's compute time plus contract resolution. While trading is disabled
+signals are counted as suppressed instead of dispatched.
+
+Strategies are loaded from the modules listed in STRATEGY_MODULES (comma
+separated). Each module defines STRATEGIES, a list of Strategy instances:
+
+    # my_strategies.py
+    from app.trading.strategies import EmaCross
+    STRATEGIES = [EmaCross('SPY', fast=9, slow=21, bar_size=60)]
+
+Every call is timed per strategy (strategy_compute_seconds) and reported by
+/api/strategies.
+"""
+import asyncio
+import importlib
+import logging
+import os
+import time as time_lib
+from app.metrics import STRATEGY_COMPUTE, STRATEGY_SIGNALS
+from app.trading.indicators import EMA, ATR, OpeningRange
+
+log = logging.getLogger(__name__)
+
+class Strategy:
+    """Base class for strategies
+
+    Subclasses set `symbol` and `bar_size` and override on_bar and/or
+    on_trade. Both return a signal dict to act on, or None.
+    """
+
+    symbol = 'SPY'
+    bar_size = 60
+    cooldown = 60.0  # Minimum seconds between two signals of this strategy
+    wants_trades = False  # Whether on_trade is called on every trade
+
+    def __init__(self, name: str = None):
+        self.name = name or type(self).__name__
+
+    def on_bar(self, bar):
+        return None
+
+    def on_trade(self, price: float, size: float, now: float):
+        return None
+
+    def state(self):
+        """Indicator values shown by /api/strategies"""
+        return {}
+
+class StrategyStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.signals = 0
+        self.suppressed = 0
+        self.errors = 0
+        self.last_signal = None
+        self.last_signal_time = 0.0
+        self.last_error = None
+
+    def report(self):
+        return {
+            'calls': self.calls,
+            'meanMicros': round(self.seconds / self.calls * 1e6, 1) if self.calls else None,
+            'maxMicros': round(self.max_seconds * 1e6, 1),
+            'signals': self.signals,
+            'suppressed': self.suppressed,
+            'errors': self.errors,
+            'lastSignal': self.last_signal,
+            'lastSignalTime': self.last_signal_time or None,
+            'lastError': self.last_error,
+        }
+
+class StrategyRuntime:
+    """Routes closed bars and trades to the strategies watching them and dispatches their signals"""
+
+    def __init__(self, dispatch, max_errors: int = 10, allowed=None):
+        self.dispatch = dispatch  # async callable taking a signal dict
+        self.allowed = allowed or (lambda: True)  # Whether signals may be dispatched now (trading enabled)
+        self.max_errors = max_errors  # A strategy that raises this many times is disabled
+        self.strategies = {}  # name -> Strategy
+        self.enabled = {}  # name -> bool
+        self.stats = {}  # name -> StrategyStats
+        self.by_bar = {}  # (symbol, bar size) -> [Strategy]
+        self.by_trade = {}  # symbol -> [Strategy]
+        self.dry_run = False  # Compute and count signals without dispatching them (replay)
+        self.tasks = set()
+
+    def add(self, strategy: Strategy, enabled: bool = True):
+        if strategy.name in self.strategies:
+            raise ValueError(f"Duplicate strategy name {strategy.name}")
+        self.strategies[strategy.name] = strategy
+        self.enabled[strategy.name] = enabled
+        self.stats[strategy.name] = StrategyStats()
+        self.by_bar.setdefault((strategy.symbol, strategy.bar_size), []).append(strategy)
+        if strategy.wants_trades:
+            self.by_trade.setdefault(strategy.symbol, []).append(strategy)
+
+    def load(self, modules: str = None):
+        """Add the STRATEGIES of every module in `modules` (default: STRATEGY_MODULES)"""
+        modules = os.environ.get('STRATEGY_MODULES', '') if modules is None else modules
+        for name in filter(None, (m.strip() for m in modules.split(','))):
+            try:
+                module = importlib.import_module(name)
+                for strategy in getattr(module, 'STRATEGIES', []):
+                    self.add(strategy)
+                    print(f"Loaded strategy {strategy.name} on {strategy.symbol} {strategy.bar_size}s bars")
+            except Exception as e:
+                print(f"Error loading strategies from {name}: {e}")
+
+    def symbols(self):
+        return {s.symbol for s in self.strategies.values()}
+
+    def set_enabled(self, name: str, enabled: bool) -> bool:
+        if name not in self.strategies:
+            return False
+        self.enabled[name] = enabled
+        if enabled:
+            self.stats[name].errors = 0
+        return True
+
+    # Bar aggregator listeners
+
+    def on_bar(self, con_id, symbol, size, bar):
+        strategies = self.by_bar.get((symbol, size))
+        if strategies:
+            for strategy in strategies:
+                self._run(strategy, strategy.on_bar, bar)
+
+    def on_trade(self, con_id, symbol, price, size, now):
+        strategies = self.by_trade.get(symbol)
+        if strategies:
+            for strategy in strategies:
+                self._run(strategy, strategy.on_trade, price, size, now)
+
+    def _run(self, strategy, method, *args):
+        name = strategy.name
+        if not self.enabled[name]:
+            return
+        stats = self.stats[name]
+        error = None
+        started = time_lib.perf_counter()
+        try:
+            signal = method(*args)
+        except Exception as e:
+            signal, error = None, e
+        elapsed = time_lib.perf_counter() - started
+        stats.calls += 1
+        stats.seconds += elapsed
+        if elapsed > stats.max_seconds:
+            stats.max_seconds = elapsed
+        STRATEGY_COMPUTE.observe(elapsed, strategy=name)
+        if error is not None:
+            stats.errors += 1
+            stats.last_error = repr(error)
+            log.error("Strategy %s failed: %r", name, error, exc_info=error)
+            if stats.errors >= self.max_errors:
+                self.enabled[name] = False
+                log.error("Disabled strategy %s after %d errors", name, stats.errors)
+            return
+        if signal:
+            self._emit(strategy, stats, signal)
+
+    def _emit(self, strategy, stats, signal):
+        now = time_lib.time()
+        if now - stats.last_signal_time < strategy.cooldown:
+            stats.suppressed += 1
+            return
+        if not self.dry_run and not self.allowed():
+            stats.suppressed += 1
+            log.info("Strategy %s signal %s suppressed: trading is disabled", strategy.name, signal)
+            return
+        stats.signals += 1
+        stats.last_signal = signal
+        stats.last_signal_time = now
+        STRATEGY_SIGNALS.inc(strategy=strategy.name)
+        log.info("Strategy %s signal %s", strategy.name, signal)
+        if self.dry_run:
+            return
+        task = asyncio.get_running_loop().create_task(self.dispatch(dict(signal)), name=f'strategy:{strategy.name}')
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def report(self):
+        return [{
+            'name': name,
+            'symbol': strategy.symbol,
+            'barSize': strategy.bar_size,
+            'enabled': self.enabled[name],
+            'dryRun': self.dry_run,
+            'state': strategy.state(),
+            **self.stats[name].report(),
+        } for name, strategy in self.strategies.items()]
+
+class EmaCross(Strategy):
+    """Buy (calls) when the fast EMA crosses above the slow one, Sell (puts) when it crosses below"""
+
+    def __init__(self, symbol: str = 'SPY', fast: int = 9, slow: int = 21, bar_size: int = 60,
+                 signal_symbol: str = None, name: str = None):
+        super().__init__(name or f'ema_cross_{symbol}_{fast}_{slow}_{bar_size}s')
+        self.symbol = symbol
+        self.signal_symbol = signal_symbol or symbol
+        self.bar_size = bar_size
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.above = None
+
+    def on_bar(self, bar):
+        close = bar[4]
+        fast, slow = self.fast.update(close), self.slow.update(close)
+        if fast is None or slow is None:
+            return None
+        above = fast > slow
+        crossed = self.above is not None and above != self.above
+        self.above = above
+        if crossed:
+            return {'symbol': self.signal_symbol, 'action': 'Buy' if above else 'Sell'}
+        return None
+
+    def state(self):
+        return {'fast': self.fast.value, 'slow': self.slow.value}
+
+class OpeningRangeBreakout(Strategy):
+    """Buy on the first close above the opening range high, Sell on the first close below its low"""
+
+    def __init__(self, symbol: str = 'SPY', minutes: int = 15, bar_size: int = 60, atr_period: int = 14,
+                 atr_buffer: float = 0.0, signal_symbol: str = None, name: str = None):
+        super().__init__(name or f'orb_{symbol}_{minutes}m')
+        self.symbol = symbol
+        self.signal_symbol = signal_symbol or symbol
+        self.bar_size = bar_size
+        self.range = OpeningRange(minutes)
+        self.atr = ATR(atr_period)
+        self.atr_buffer = atr_buffer  # Breakout must clear the range by this many ATRs
+        self.traded_day = None
+
+    def on_bar(self, bar):
+        self.atr.update(bar)
+        levels = self.range.update(bar)
+        if levels is None or self.traded_day == self.range._day_end:
+            return None
+        high, low = levels
+        buffer = self.atr_buffer * (self.atr.value or 0.0)
+        close = bar[4]
+        if close > high + buffer:
+            self.traded_day = self.range._day_end
+            return {'symbol': self.signal_symbol, 'action': 'Buy'}
+        if close < low - buffer:
+            self.traded_day = self.range._day_end
+            return {'symbol': self.signal_symbol, 'action': 'Sell'}
+        return None
+
+    def state(self):
+        return {'range': self.range.value, 'atr': self.atr.value}
@@ -0,0 +1,183 @@
+import json
+import uuid
+import time as time_lib
+from collections import OrderedDict
+
+# Stages reported in latency percentiles, measured from when the signal arrived
+LATENCY_STAGES = ['resolve_start', 'resolve_end', 'submit', 'ack', 'first_fill', 'filled']
+
+TERMINAL_STATUSES = {'Filled', 'Cancelled', 'ApiCancelled', 'Inactive'}
+
+class OrderTrace:
+    """Lifecycle of one signal: arrival, contract resolution, submission, ack and fills"""
+
+    def __init__(self, trace_id: str, source: str, signal: dict, quote: dict):
+        self.trace_id = trace_id
+        # Id the sender gave the signal; not unique, e.g. an alert template with a fixed id
+        self.client_id = signal.get('id') or signal.get('signal_id')
+        self.source = source
+        self.signal = signal
+        self.quote = quote  # Prices known at decision time
+        self.created = time_lib.time()
+        self.events = [('received', self.created, None)]
+        self.order_ids = []
+        self.orders = {}  # orderId -> {'action', 'quantity', 'filled', 'avgPrice', 'status', 'decisionPrice'}
+        self.result = None
+        self.completed = None
+
+    def mark(self, stage: str, detail=None):
+        self.events.append((stage, time_lib.time(), detail))
+
+    def first(self, stage: str):
+        for name, ts, _ in self.events:
+            if name == stage:
+                return ts
+        return None
+
+    def is_done(self):
+        if self.result is None:
+            return False
+        if self.result.get('status') != 'success':
+            return True
+        return bool(self.orders) and all(o['status'] in TERMINAL_STATUSES for o in self.orders.values())
+
+    def to_dict(self):
+        return {
+            'signalId': self.trace_id,
+            'clientSignalId': self.client_id,
+            'source': self.source,
+            'signal': self.signal,
+            'quote': self.quote,
+            'created': self.created,
+            'completed': self.completed,
+            'result': self.result,
+            'orders': self.orders,
+            'events': [
+                {'stage': stage, 'time': ts, 'sinceReceivedMs': round((ts - self.created) * 1000, 3), 'detail': detail}
+                for stage, ts, detail in self.events
+            ],
+        }
+
+class TimelineStore:
+    """Bounded in-memory store of order traces, persisted to the journal when complete"""
+
+    def __init__(self, journal=None, maxlen: int = 1000):
+        self.journal = journal
+        self.maxlen = maxlen
+        self.traces = OrderedDict()  # trace_id -> OrderTrace
+        self.by_order_id = {}
+
+    def start(self, source: str, signal: dict, quote: dict) -> OrderTrace:
+        trace_id = uuid.uuid4().hex[:12]
+        trace = OrderTrace(trace_id, source, signal, quote)
+        self.traces[trace_id] = trace
+        while len(self.traces) > self.maxlen:
+            _, evicted = self.traces.popitem(last=False)
+            for order_id in evicted.order_ids:
+                if self.by_order_id.get(order_id) is evicted:
+                    del self.by_order_id[order_id]
+        return trace
+
+    def attach(self, trace: OrderTrace, trade, decision_price: float = None):
+        """Link a placed order to its trace"""
+        order = trade.order
+        trace.order_ids.append(order.orderId)
+        trace.orders[order.orderId] = {
+            'localSymbol': trade.contract.localSymbol,
+            'action': order.action,
+            'quantity': float(order.totalQuantity),
+            'filled': 0.0,
+            'avgPrice': None,
+            'status': trade.orderStatus.status,
+            'decisionPrice': decision_price,
+            'slippage': None,
+        }
+        trace.mark('submit', {'orderId': order.orderId})
+        self.by_order_id[order.orderId] = trace
+
+    def finish_request(self, trace: OrderTrace, result: dict):
+        """Record the handler's response; persists if nothing is left outstanding"""
+        trace.result = result
+        trace.mark('responded', {'status': result.get('status') if isinstance(result, dict) else None})
+        self._maybe_complete(trace)
+
+    def on_status(self, trade):
+        trace = self.by_order_id.get(trade.order.orderId)
+        if not trace:
+            return
+        order = trace.orders[trade.order.orderId]
+        status = trade.orderStatus.status
+        if status == order['status']:
+            return
+        order['status'] = status
+        if status in ('PreSubmitted', 'Submitted') and trace.first('ack') is None:
+            trace.mark('ack', {'orderId': trade.order.orderId, 'status': status})
+        elif status in TERMINAL_STATUSES and status != 'Filled':
+            trace.mark(status.lower(), {'orderId': trade.order.orderId})
+        self._maybe_complete(trace)
+
+    def on_fill(self, trade, fill, spy_price: float = None):
+        trace = self.by_order_id.get(trade.order.orderId)
+        if not trace:
+            return
+        order = trace.orders[trade.order.orderId]
+        execution = fill.execution
+        order['filled'] += float(execution.shares)
+        order['avgPrice'] = float(execution.avgPrice)
+
+        if trace.first('first_fill') is None:
+            trace.mark('first_fill', {'orderId': trade.order.orderId})
+        trace.mark('fill', {
+            'orderId': trade.order.orderId,
+            'shares': float(execution.shares),
+            'price': float(execution.price),
+            'spyPrice': spy_price,
+        })
+
+        if order['filled'] >= order['quantity']:
+            order['status'] = 'Filled'
+            if order['decisionPrice']:
+                # Positive slippage is a cost: paid more on buys, received less on sells
+                direction = 1 if order['action'] == 'BUY' else -1
+                order['slippage'] = (order['avgPrice'] - order['decisionPrice']) * direction
+            if all(o['status'] == 'Filled' for o in trace.orders.values()):
+                trace.mark('filled')
+        self._maybe_complete(trace)
+
+    def _maybe_complete(self, trace: OrderTrace):
+        if trace.completed is None and trace.is_done():
+            trace.completed = time_lib.time()
+            if self.journal:
+                self.journal.record_timeline(trace.trace_id, trace.order_ids, trace.created, json.dumps(trace.to_dict(), default=str))
+
+    def get_by_order(self, order_id: int):
+        trace = self.by_order_id.get(order_id)
+        return trace.to_dict() if trace else None
+
+    def latency_percentiles(self, source: str = None):
+        """p50/p95/p99 in milliseconds from signal arrival to each stage"""
+        samples = {stage: [] for stage in LATENCY_STAGES}
+        for trace in self.traces.values():
+            if source and trace.source != source:
+                continue
+            for stage in LATENCY_STAGES:
+                ts = trace.first(stage)
+                if ts is not None:
+                    samples[stage].append((ts - trace.created) * 1000)
+
+        stats = {}
+        for stage, values in samples.items():
+            if not values:
+                continue
+            values.sort()
+            stats[stage] = {
+                'count': len(values),
+                'p50': _percentile(values, 50),
+                'p95': _percentile(values, 95),
+                'p99': _percentile(values, 99),
+            }
+        return stats
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 3)
@@ -0,0 +1,226 @@
+"""Server-side price triggers and trailing stops
+
+A trigger watches the price of one instrument (a position's own mark, or an
+underlying such as SPY) and fires once when the price reaches its level:
+
+- price: a fixed level, crossed `above` or `below`
+- trailing: a stop `distance` (or `percent`) behind the best price seen
+  since the trigger was set; `below` follows the high (long positions),
+  `above` follows the low (short positions)
+- pnl: an unrealized PnL threshold on a position, turned into the price of
+  that position at which the PnL is reached
+
+Each instrument keeps its triggers in lists sorted by level, so a tick finds
+the triggers it crosses with one bisect per side, and trailing stops in a
+list sorted by the price at which they next move. A tick costs O(log n + k)
+for the k triggers it fires or moves, however many are set.
+"""
+import itertools
+import time as time_lib
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+
+TRIGGER_KINDS = ('price', 'trailing', 'pnl')
+TRIGGER_OPS = ('above', 'below')
+
+class Trigger:
+    def __init__(self, trigger_id: int, kind: str, con_id: int, symbol: str, op: str, level: float = None,
+                 position_id: int = None, distance: float = None, percent: bool = False, pnl: float = None):
+        self.trigger_id = trigger_id
+        self.kind = kind
+        self.con_id = con_id  # Instrument whose price is watched
+        self.symbol = symbol
+        self.op = op
+        self.level = level
+        self.position_id = position_id  # Position closed when the trigger fires
+        self.distance = distance
+        self.percent = percent
+        self.pnl = pnl
+        self.extreme = None  # Best price seen by a trailing stop
+        self.created = time_lib.time()
+        self.fired_at = None
+        self.fired_price = None
+        self.result = None
+
+    def trail(self, price: float) -> float:
+        """Stop level of a trailing trigger whose best price is `price`"""
+        self.extreme = price
+        offset = price * self.distance / 100.0 if self.percent else self.distance
+        return price - offset if self.op == 'below' else price + offset
+
+    def describe(self):
+        return {
+            'id': self.trigger_id,
+            'kind': self.kind,
+            'conId': self.con_id,
+            'symbol': self.symbol,
+            'op': self.op,
+            'level': self.level,
+            'positionId': self.position_id,
+            'distance': self.distance,
+            'percent': self.percent,
+            'pnl': self.pnl,
+            'extreme': self.extreme,
+            'created': self.created,
+            'firedAt': self.fired_at,
+            'firedPrice': self.fired_price,
+            'result': self.result,
+        }
+
+class TriggerIndex:
+    """Triggers on one instrument, sorted by level and by where trailing stops next move"""
+
+    def __init__(self):
+        self.above = []  # (level, id) ascending; fire when price >= level
+        self.below = []  # (level, id) ascending; fire when price <= level
+        self.trail_high = []  # (high, id) ascending; move when price > high
+        self.trail_low = []  # (-low, id) ascending; move when price < low
+        self.triggers = {}  # id -> Trigger
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def _levels(self, trigger):
+        return self.above if trigger.op == 'above' else self.below
+
+    def add(self, trigger):
+        self.triggers[trigger.trigger_id] = trigger
+        insort(self._levels(trigger), (trigger.level, trigger.trigger_id))
+        if trigger.kind == 'trailing':
+            if trigger.op == 'below':
+                insort(self.trail_high, (trigger.extreme, trigger.trigger_id))
+            else:
+                insort(self.trail_low, (-trigger.extreme, trigger.trigger_id))
+
+    def remove(self, trigger):
+        if self.triggers.pop(trigger.trigger_id, None) is None:
+            return
+        _remove(self._levels(trigger), (trigger.level, trigger.trigger_id))
+        if trigger.kind == 'trailing':
+            if trigger.op == 'below':
+                _remove(self.trail_high, (trigger.extreme, trigger.trigger_id))
+            else:
+                _remove(self.trail_low, (-trigger.extreme, trigger.trigger_id))
+
+    def move(self, trigger, level: float):
+        levels = self._levels(trigger)
+        _remove(levels, (trigger.level, trigger.trigger_id))
+        trigger.level = level
+        insort(levels, (level, trigger.trigger_id))
+
+    def evaluate(self, price: float):
+        """Move the trailing stops `price` improves on, then return the triggers it reaches"""
+        if self.trail_high and self.trail_high[0][0] < price:
+            moved = bisect_left(self.trail_high, (price, -1))
+            ids = [trigger_id for _, trigger_id in self.trail_high[:moved]]
+            del self.trail_high[:moved]
+            for trigger_id in ids:
+                trigger = self.triggers[trigger_id]
+                self.move(trigger, trigger.trail(price))
+                insort(self.trail_high, (price, trigger_id))
+        if self.trail_low and -self.trail_low[0][0] > price:
+            moved = bisect_left(self.trail_low, (-price, -1))
+            ids = [trigger_id for _, trigger_id in self.trail_low[:moved]]
+            del self.trail_low[:moved]
+            for trigger_id in ids:
+                trigger = self.triggers[trigger_id]
+                self.move(trigger, trigger.trail(price))
+                insort(self.trail_low, (-price, trigger_id))
+
+        fired = []
+        if self.above and self.above[0][0] <= price:
+            reached = bisect_right(self.above, (price, float('inf')))
+            fired.extend(self.triggers[trigger_id] for _, trigger_id in self.above[:reached])
+        if self.below and self.below[-1][0] >= price:
+            reached = bisect_left(self.below, (price, -1))
+            fired.extend(self.triggers[trigger_id] for _, trigger_id in self.below[reached:])
+        return fired
+
+def _remove(entries, key):
+    index = bisect_left(entries, key)
+    if index < len(entries) and entries[index] == key:
+        del entries[index]
+
+class TriggerEngine:
+    def __init__(self, history: int = 200):
+        self.triggers = {}  # id -> Trigger
+        self.indexes = {}  # watched conId -> TriggerIndex
+        self.by_position = {}  # position conId -> {trigger id}
+        self.fired = deque(maxlen=history)
+        self.ids = itertools.count(1)
+        self.ticks = 0  # Ticks of instruments with triggers
+
+    def create(self, kind: str, con_id: int, symbol: str, op: str, price: float, level: float = None,
+               position_id: int = None, distance: float = None, percent: bool = False, pnl: float = None):
+        """Set a trigger; `price` is the instrument's current price, which it must not already have reached"""
+        trigger = Trigger(next(self.ids), kind, con_id, symbol, op, level, position_id, distance, percent, pnl)
+        if kind == 'trailing':
+            trigger.level = trigger.trail(price)
+        if trigger.op == 'above' and price >= trigger.level or trigger.op == 'below' and price <= trigger.level:
+            raise ValueError(f"{symbol} at {price} is already {op} {trigger.level}")
+        self.triggers[trigger.trigger_id] = trigger
+        self.indexes.setdefault(con_id, TriggerIndex()).add(trigger)
+        if position_id is not None:
+            self.by_position.setdefault(position_id, set()).add(trigger.trigger_id)
+        return trigger
+
+    def remove(self, trigger_id: int):
+        trigger = self.triggers.pop(trigger_id, None)
+        if trigger is None:
+            return None
+        index = self.indexes.get(trigger.con_id)
+        if index is not None:
+            index.remove(trigger)
+            if not index:
+                del self.indexes[trigger.con_id]
+        if trigger.position_id is not None:
+            siblings = self.by_position.get(trigger.position_id)
+            if siblings is not None:
+                siblings.discard(trigger_id)
+                if not siblings:
+                    del self.by_position[trigger.position_id]
+        return trigger
+
+    def remove_position(self, position_id: int):
+        """Drop every trigger that would close `position_id`"""
+        return [self.remove(trigger_id) for trigger_id in list(self.by_position.get(position_id, ()))]
+
+    def for_position(self, position_id: int):
+        return [self.triggers[trigger_id] for trigger_id in self.by_position.get(position_id, ())]
+
+    def move(self, trigger_id: int, level: float):
+        trigger = self.triggers.get(trigger_id)
+        if trigger is not None:
+            self.indexes[trigger.con_id].move(trigger, level)
+
+    def on_price(self, con_id: int, price: float):
+        """Triggers fired by a new price; they and the other triggers on their positions are removed"""
+        index = self.indexes.get(con_id)
+        if index is None:
+            return ()
+        self.ticks += 1
+        fired = index.evaluate(price)
+        if not fired:
+            return ()
+        now = time_lib.time()
+        result = []
+        for trigger in fired:
+            if trigger.trigger_id not in self.triggers:
+                continue  # Cancelled by a trigger on the same position fired just before it
+            trigger.fired_at = now
+            trigger.fired_price = price
+            self.remove(trigger.trigger_id)
+            if trigger.position_id is not None:
+                # The position is being closed; its other triggers are moot (one cancels the others)
+                self.remove_position(trigger.position_id)
+            self.fired.append(trigger)
+            result.append(trigger)
+        return result
+
+    def report(self):
+        return {
+            'active': [t.describe() for t in self.triggers.values()],
+            'fired': [t.describe() for t in reversed(self.fired)],
+            'instruments': len(self.indexes),
+            'ticks': self.ticks,
+        }
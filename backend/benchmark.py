@@ -0,0 +1,350 @@
+"""Benchmarks for the IB handler against the simulated gateway
+
+Runs the handler end to end on app.trading.fake_gateway and reports:
+
+- startup: time from connect() to ready
+- signal / quick_trade: end-to-end and signal-to-submit latency percentiles
+- market_data: market_data_monitor ticks per second
+- pnl_to_client: PnL callback to WebSocket send latency
+- fanout: broadcast time for 1/10/100/500 WebSocket clients
+- resync: resync_data() time against portfolio size
+
+Usage:
+
+    python benchmark.py -o results.json
+    python benchmark.py --baseline baseline.json --threshold 0.15
+
+With --baseline, each metric is compared against the baseline and the exit
+code is 1 if any metric regressed by more than the threshold.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import nest_asyncio
+from starlette.websockets import WebSocketState
+from ib_insync import Option, PnL, Ticker
+
+nest_asyncio.apply()
+
+from app.models.settings import load_settings
+from app.trading.fake_gateway import FakeGateway
+from app.trading.ib_handler import IBHandler
+
+FANOUT_CLIENTS = (1, 10, 100, 500)
+PORTFOLIO_SIZES = (1, 10, 50, 200)
+
+class BenchWebSocket:
+    """Stands in for a connected WebSocket; serializes like Starlette's send_json"""
+
+    client_state = WebSocketState.CONNECTED
+
+    def __init__(self, group):
+        self.group = group
+
+    async def send_json(self, data):
+        json.dumps(data)
+        self.group.received()
+
+class ReceiveGroup:
+    """Signals when every socket in a group has received one update"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.done = asyncio.Event()
+
+    def reset(self):
+        self.count = 0
+        self.done.clear()
+
+    def received(self):
+        self.count += 1
+        if self.count >= self.size:
+            self.done.set()
+
+def percentiles(values, unit_scale=1000.0):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * unit_scale
+
+    return {'p50': pct(50), 'p95': pct(95), 'p99': pct(99), 'mean': statistics.fmean(values) * unit_scale}
+
+class Bench:
+    def __init__(self, seed: int, iterations: int, workdir: Path, quiet: bool):
+        self.seed = seed
+        self.iterations = iterations
+        self.workdir = workdir
+        self.quiet = quiet
+        self.results = {}
+        self.settings = load_settings(workdir / 'settings.json')
+        self._handlers = 0
+
+    def record(self, name: str, value: float, unit: str, better: str = 'lower'):
+        self.results[name] = {'value': round(value, 4), 'unit': unit, 'better': better}
+
+    def record_percentiles(self, prefix: str, samples):
+        for key, value in percentiles(samples).items():
+            self.record(f'{prefix}.{key}_ms', value, 'ms')
+
+    @contextlib.contextmanager
+    def muted(self):
+        """The handler logs every event to stdout; keep it out of the report"""
+        if not self.quiet:
+            yield
+            return
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+
+    def gateway(self, **kwargs):
+        # No background PnL pushes, so measurements only see the updates they cause
+        options = {'seed': self.seed, 'tick_rate': 0, 'pnl_interval': 3600}
+        options.update(kwargs)
+        return FakeGateway(**options)
+
+    def handler(self, gateway):
+        self._handlers += 1
+        os.environ['EXECUTION_JOURNAL_PATH'] = str(self.workdir / f'executions-{self._handlers}.db')
+        with self.muted():
+            handler = IBHandler(self.settings, ib_factory=gateway.client)
+
+        async def no_telegram(message):
+            pass
+
+        # Notifications go to the Telegram API; leave the network out of the numbers
+        handler.send_telegram_message = no_telegram
+        return handler
+
+    async def connected_handler(self, gateway):
+        handler = self.handler(gateway)
+        with self.muted():
+            await handler.connect()
+        return handler
+
+    async def drain(self, handler):
+        while not handler.update_queue.empty():
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.01)
+
+    async def bench_startup(self, runs: int = 3):
+        samples = []
+        for _ in range(runs):
+            gateway = self.gateway()
+            handler = self.handler(gateway)
+            started = time.perf_counter()
+            with self.muted():
+                await handler.connect()
+            samples.append(time.perf_counter() - started)
+            with self.muted():
+                await handler.disconnect()
+        self.record('startup.median_ms', statistics.median(samples) * 1000, 'ms')
+
+    async def _signal_latency(self, name, handler, signals):
+        totals, submits = [], []
+        for _ in range(self.iterations):
+            for signal in signals:
+                started = time.perf_counter()
+                with self.muted():
+                    result = await getattr(handler, name)(dict(signal))
+                totals.append(time.perf_counter() - started)
+                order_id = result.get('order_id') if isinstance(result, dict) else None
+                timeline = await handler.get_order_timeline(order_id) if order_id else None
+                if timeline:
+                    submit = next((e for e in timeline['events'] if e['stage'] == 'submit'), None)
+                    if submit:
+                        submits.append(submit['sinceReceivedMs'] / 1000)
+        return totals, submits
+
+    async def bench_signals(self):
+        gateway = self.gateway()
+        handler = await self.connected_handler(gateway)
+        try:
+            totals, submits = await self._signal_latency('process_signal', handler, [
+                {'symbol': 'MES1!', 'action': 'Buy'},
+                {'symbol': 'MES1!', 'action': 'Buy Exit'},
+            ])
+            self.record_percentiles('signal.total', totals)
+            self.record_percentiles('signal.submit', submits)
+
+            totals, submits = await self._signal_latency('quick_trade_spy', handler, [
+                {'action': 'Buy Call', 'instrument': 'SPY', 'quantity': 1},
+                {'action': 'Buy', 'instrument': 'MES', 'quantity': 1},
+            ])
+            self.record_percentiles('quick_trade.total', totals)
+            self.record_percentiles('quick_trade.submit', submits)
+        finally:
+            with self.muted():
+                await handler.disconnect()
+
+    async def bench_market_data(self, positions: int = 50, rounds: int = 2000):
+        gateway = self.gateway()
+        handler = self.handler(gateway)
+        tickers = set()
+        for i in range(positions):
+            contract = gateway.resolve(Option('SPY', '20300118', 450 + i, 'C', 'SMART', currency='USD'))
+            handler.positions[contract.conId] = {'contract': {'secType': 'OPT'}, 'marketPrice': 0.0}
+            tickers.add(Ticker(contract=contract, last=1.0 + i / 100))
+        spy = Ticker(contract=gateway.resolve(gateway.contracts[756733]), last=500.0)
+        tickers.add(spy)
+
+        started = time.perf_counter()
+        with self.muted():
+            for _ in range(rounds):
+                handler.market_data_monitor(tickers)
+        elapsed = time.perf_counter() - started
+        self.record('market_data.ticks_per_s', len(tickers) * rounds / elapsed, 'ticks/s', better='higher')
+
+    async def bench_pnl_to_client(self, samples: int = 200):
+        gateway = self.gateway()
+        handler = await self.connected_handler(gateway)
+        try:
+            await self.drain(handler)
+            group = ReceiveGroup(1)
+            await handler.register_websocket(BenchWebSocket(group))
+            latencies = []
+            for i in range(samples):
+                group.reset()
+                pnl = PnL(account=handler.account, dailyPnL=float(i), unrealizedPnL=float(i), realizedPnL=0.0)
+                started = time.perf_counter()
+                with self.muted():
+                    handler.pnl_callback(pnl)
+                    await group.done.wait()
+                latencies.append(time.perf_counter() - started)
+            self.record_percentiles('pnl_to_client', latencies)
+        finally:
+            with self.muted():
+                await handler.disconnect()
+
+    async def bench_fanout(self, rounds: int = 50):
+        gateway = self.gateway()
+        handler = await self.connected_handler(gateway)
+        try:
+            for clients in FANOUT_CLIENTS:
+                await self.drain(handler)
+                handler.active_websockets.clear()
+                group = ReceiveGroup(clients)
+                for _ in range(clients):
+                    await handler.register_websocket(BenchWebSocket(group))
+                samples = []
+                for _ in range(rounds):
+                    group.reset()
+                    with self.muted():
+                        started = time.perf_counter()
+                        await handler.queue_update()
+                        await group.done.wait()
+                    samples.append(time.perf_counter() - started)
+                self.record(f'fanout.{clients}_clients.median_ms', statistics.median(samples) * 1000, 'ms')
+            handler.active_websockets.clear()
+        finally:
+            with self.muted():
+                await handler.disconnect()
+
+    async def bench_resync(self, rounds: int = 3):
+        for size in PORTFOLIO_SIZES:
+            gateway = self.gateway()
+            for i in range(size):
+                gateway.seed_position(Option('SPY', '20300118', 400 + i, 'C', 'SMART', currency='USD'), 1, 2.0)
+            handler = await self.connected_handler(gateway)
+            try:
+                samples = []
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    with self.muted():
+                        await handler.resync_data()
+                    samples.append(time.perf_counter() - started)
+                self.record(f'resync.{size}_positions.median_ms', statistics.median(samples) * 1000, 'ms')
+            finally:
+                with self.muted():
+                    await handler.disconnect()
+
+BENCHMARKS = ('startup', 'signals', 'market_data', 'pnl_to_client', 'fanout', 'resync')
+
+def compare(results, baseline, threshold):
+    """Print a regression table; returns the names of regressed metrics"""
+    regressions = []
+    rows = []
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if not base or not base['value']:
+            rows.append((name, '-', f"{current['value']:.3f}", 'new', ''))
+            continue
+        change = (current['value'] - base['value']) / base['value']
+        worse = change > threshold if current['better'] == 'lower' else change < -threshold
+        if worse:
+            regressions.append(name)
+        rows.append((name, f"{base['value']:.3f}", f"{current['value']:.3f}", f"{change:+.1%}", 'REGRESSED' if worse else ''))
+
+    widths = [max(len(str(row[i])) for row in rows + [('metric', 'baseline', 'current', 'change', '')]) for i in range(5)]
+    header = ('metric', 'baseline', 'current', 'change', '')
+    for row in [header] + rows:
+        print('  '.join(str(col).ljust(width) for col, width in zip(row, widths)).rstrip())
+    return regressions
+
+async def run(args):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # IBHandler writes its execution and event journals to the working directory
+        os.chdir(workdir)
+        try:
+            bench = Bench(args.seed, args.iterations, Path(workdir), quiet=not args.verbose)
+            for name in args.only or BENCHMARKS:
+                print(f"Running {name}...", file=sys.stderr)
+                await getattr(bench, f'bench_{name}')()
+        finally:
+            os.chdir(cwd)
+            # Handlers leave their broadcaster tasks running after disconnect
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+        return bench.results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IB handler against the simulated gateway")
+    parser.add_argument('-o', '--output', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against a previous results file")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed relative regression (default 0.10)")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help="Run only these benchmarks")
+    parser.add_argument('--iterations', type=int, default=10, help="Signal round trips per path")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Show handler output")
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(run(args))
+    report = {
+        'meta': {
+            'time': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'iterations': args.iterations,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
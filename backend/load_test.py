@@ -0,0 +1,327 @@
+"""Concurrent signal load generator for /api/signal and /api/quick-trade
+
+Replays scripted or randomized signal mixes at a target rate and reports
+latency histograms, error rates and throughput. Run it against a backend
+started with IB_FAKE_GATEWAY=1 unless you mean to send real orders.
+
+Closed loop (at most --concurrency requests in flight, each worker sends its
+next request when the previous one returns):
+
+    python load_test.py --mix random --concurrency 8 --duration 30
+
+Open loop (requests are sent on schedule whether or not earlier ones have
+returned, and latency counts from the scheduled time, so queueing shows up
+instead of slowing the sender down):
+
+    python load_test.py --open-loop --rate 20 --duration 30
+
+Step through rates to find the throughput ceiling:
+
+    python load_test.py --open-loop --ramp 5,10,20,40 --duration 15
+
+Send a single scenario:
+
+    python load_test.py --scenario mes_buy
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from bisect import bisect_left
+
+import aiohttp
+
+BASE_URL = "http://localhost:80"
+
+SCENARIOS = {
+    'mes_buy': ('/api/signal', {"symbol": "MES1!", "action": "Buy"}),
+    'mes_buy_exit': ('/api/signal', {"symbol": "MES1!", "action": "Buy Exit"}),
+    'mes_sell': ('/api/signal', {"symbol": "MES1!", "action": "Sell"}),
+    'mes_sell_exit': ('/api/signal', {"symbol": "MES1!", "action": "Sell Exit"}),
+    'spy_buy': ('/api/signal', {"symbol": "SPY", "action": "Buy"}),
+    'spy_buy_exit': ('/api/signal', {"symbol": "SPY", "action": "Buy Exit"}),
+    'spy_sell': ('/api/signal', {"symbol": "SPY", "action": "Sell"}),
+    'spy_sell_exit': ('/api/signal', {"symbol": "SPY", "action": "Sell Exit"}),
+    'quick_call': ('/api/quick-trade', {"action": "Buy Call", "instrument": "SPY", "quantity": 1}),
+    'quick_put': ('/api/quick-trade', {"action": "Buy Put", "instrument": "SPY", "quantity": 1}),
+    'quick_mes_buy': ('/api/quick-trade', {"action": "Buy", "instrument": "MES", "quantity": 1}),
+    'quick_mes_sell': ('/api/quick-trade', {"action": "Sell", "instrument": "MES", "quantity": 1}),
+}
+
+# Entries are always followed by their exit so positions stay flat over a run
+SCRIPTED_MIX = [
+    'mes_buy', 'mes_buy_exit', 'mes_sell', 'mes_sell_exit',
+    'spy_buy', 'spy_buy_exit', 'spy_sell', 'spy_sell_exit',
+    'quick_call', 'quick_put', 'quick_mes_buy', 'quick_mes_sell',
+]
+
+RANDOM_WEIGHTS = {
+    'mes_buy': 3, 'mes_buy_exit': 3, 'mes_sell': 3, 'mes_sell_exit': 3,
+    'spy_buy': 2, 'spy_buy_exit': 2, 'spy_sell': 2, 'spy_sell_exit': 2,
+    'quick_call': 1, 'quick_put': 1, 'quick_mes_buy': 1, 'quick_mes_sell': 1,
+}
+
+# Latency histogram bucket bounds in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+class Mix:
+    """Yields (name, endpoint, body) from a script, a file or a seeded random draw"""
+
+    def __init__(self, kind: str, seed: int = 0, script=None):
+        self.kind = kind
+        self.rng = random.Random(seed)
+        self.position = 0
+        self.script = script or [(name, *SCENARIOS[name]) for name in SCRIPTED_MIX]
+        self.names = list(RANDOM_WEIGHTS)
+        self.weights = [RANDOM_WEIGHTS[n] for n in self.names]
+
+    @classmethod
+    def from_file(cls, path: str):
+        """JSON list of {"endpoint": ..., "body": {...}} or {"scenario": name}"""
+        with open(path) as f:
+            entries = json.load(f)
+        script = []
+        for entry in entries:
+            if 'scenario' in entry:
+                script.append((entry['scenario'], *SCENARIOS[entry['scenario']]))
+            else:
+                script.append((entry.get('name', entry['endpoint']), entry['endpoint'], entry['body']))
+        return cls('scripted', script=script)
+
+    def next(self):
+        if self.kind == 'random':
+            name = self.rng.choices(self.names, self.weights)[0]
+            return (name, *SCENARIOS[name])
+        item = self.script[self.position % len(self.script)]
+        self.position += 1
+        return item
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.errors = {}  # kind -> count
+        self.by_scenario = {}  # name -> [count, errors]
+        self.sent = 0
+        self.dropped = 0
+        self.max_inflight = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, name: str, latency: float, error: str = None):
+        self.latencies.append(latency)
+        self.buckets[bisect_left(BUCKETS_MS, latency * 1000)] += 1
+        counts = self.by_scenario.setdefault(name, [0, 0])
+        counts[0] += 1
+        if error:
+            counts[1] += 1
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self):
+        completed = len(self.latencies)
+        errors = sum(self.errors.values())
+        elapsed = max((self.finished or time.perf_counter()) - self.started, 1e-9)
+        values = sorted(self.latencies)
+
+        def pct(p):
+            if not values:
+                return None
+            return round(values[min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)] * 1000, 2)
+
+        return {
+            'sent': self.sent,
+            'completed': completed,
+            'dropped': self.dropped,
+            'errors': errors,
+            'errorRate': round(errors / completed, 4) if completed else 0.0,
+            'errorKinds': self.errors,
+            'elapsedS': round(elapsed, 3),
+            'throughput': round((completed - errors) / elapsed, 2),
+            'maxInflight': self.max_inflight,
+            'latencyMs': {'p50': pct(50), 'p90': pct(90), 'p99': pct(99), 'max': pct(100)},
+            'histogramMs': {
+                (f'<={bound}' if i < len(BUCKETS_MS) else f'>{BUCKETS_MS[-1]}'): count
+                for i, (bound, count) in enumerate(zip(BUCKETS_MS + (None,), self.buckets))
+            },
+            'scenarios': {name: {'count': c, 'errors': e} for name, (c, e) in self.by_scenario.items()},
+        }
+
+async def send(session, url: str, name: str, endpoint: str, body: dict, stats: Stats, started: float, timeout: float):
+    """Send one request; latency counts from `started`, the scheduled send time"""
+    error = None
+    try:
+        async with session.post(url + endpoint, json=body, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status != 200:
+                error = f'http_{response.status}'
+            else:
+                result = await response.json()
+                if isinstance(result, dict) and result.get('status') == 'error':
+                    error = 'app_error'
+    except asyncio.TimeoutError:
+        error = 'timeout'
+    except aiohttp.ClientError as e:
+        error = type(e).__name__
+    stats.record(name, time.perf_counter() - started, error)
+
+async def run_closed_loop(args, mix: Mix, stats: Stats, session):
+    """`concurrency` workers, each sending back to back, paced to --rate overall if given"""
+    deadline = stats.started + args.duration if args.duration else None
+    interval = args.concurrency / args.rate if args.rate else 0
+    remaining = [args.requests] if args.requests else None
+    inflight = [0]
+
+    async def worker(offset):
+        next_send = stats.started + offset
+        while True:
+            if deadline and time.perf_counter() >= deadline:
+                return
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            if interval:
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_send += interval
+            name, endpoint, body = mix.next()
+            stats.sent += 1
+            inflight[0] += 1
+            stats.max_inflight = max(stats.max_inflight, inflight[0])
+            await send(session, args.url, name, endpoint, body, stats, time.perf_counter(), args.timeout)
+            inflight[0] -= 1
+
+    spacing = interval / args.concurrency if interval else 0
+    await asyncio.gather(*(worker(i * spacing) for i in range(args.concurrency)))
+
+async def run_open_loop(args, rate: float, mix: Mix, stats: Stats, session):
+    """Send on a fixed (or Poisson) schedule regardless of how many requests are still in flight"""
+    rng = random.Random(args.seed)
+    deadline = stats.started + args.duration if args.duration else None
+    tasks = set()
+    scheduled = stats.started
+    count = 0
+    while True:
+        if args.requests and count >= args.requests:
+            break
+        if deadline and scheduled >= deadline:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        count += 1
+        if args.max_inflight and len(tasks) >= args.max_inflight:
+            stats.dropped += 1
+        else:
+            name, endpoint, body = mix.next()
+            stats.sent += 1
+            task = asyncio.create_task(send(session, args.url, name, endpoint, body, stats, scheduled, args.timeout))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            stats.max_inflight = max(stats.max_inflight, len(tasks))
+        scheduled += rng.expovariate(rate) if args.poisson else 1.0 / rate
+    if tasks:
+        await asyncio.gather(*tasks)
+
+async def run_once(args, rate, mix):
+    stats = Stats()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        stats.started = time.perf_counter()
+        if args.open_loop:
+            await run_open_loop(args, rate, mix, stats, session)
+        else:
+            await run_closed_loop(args, mix, stats, session)
+        stats.finished = time.perf_counter()
+    summary = stats.summary()
+    summary['targetRate'] = rate
+    return summary
+
+def print_summary(summary):
+    latency = summary['latencyMs']
+    target = f" (target {summary['targetRate']}/s)" if summary.get('targetRate') else ''
+    print(f"\nSent {summary['sent']}, completed {summary['completed']}, dropped {summary['dropped']} "
+          f"in {summary['elapsedS']}s")
+    print(f"Throughput: {summary['throughput']} ok/s{target}, max in flight {summary['maxInflight']}")
+    print(f"Errors: {summary['errors']} ({summary['errorRate']:.1%}) {summary['errorKinds'] or ''}")
+    print(f"Latency ms: p50={latency['p50']} p90={latency['p90']} p99={latency['p99']} max={latency['max']}")
+    peak = max(summary['histogramMs'].values()) or 1
+    for bucket, count in summary['histogramMs'].items():
+        if count:
+            print(f"  {bucket:>8} ms | {'#' * max(1, round(40 * count / peak)):<40} {count}")
+
+async def run_scenario(args):
+    """One request, as the old interactive menu did"""
+    endpoint, body = SCENARIOS[args.scenario]
+    async with aiohttp.ClientSession() as session:
+        print(f"Sending {args.scenario}: {body}")
+        started = time.perf_counter()
+        async with session.post(args.url + endpoint, json=body) as response:
+            result = await response.json()
+        print(f"Response in {(time.perf_counter() - started) * 1000:.1f} ms: {result}")
+
+async def main_async(args):
+    if args.scenario:
+        await run_scenario(args)
+        return []
+
+    mix = Mix.from_file(args.script) if args.script else Mix(args.mix, args.seed)
+    rates = [float(r) for r in args.ramp.split(',')] if args.ramp else [args.rate]
+    results = []
+    for rate in rates:
+        if args.ramp:
+            print(f"\n=== {rate}/s ===")
+        summary = await run_once(args, rate, mix)
+        print_summary(summary)
+        results.append(summary)
+
+    if args.ramp:
+        # The ceiling is the highest step that kept up with its target without errors piling up
+        sustained = [
+            r for r in results
+            if r['throughput'] >= 0.95 * r['targetRate'] and r['errorRate'] < 0.01
+        ]
+        ceiling = max((r['targetRate'] for r in sustained), default=None)
+        print(f"\nThroughput ceiling: {ceiling or 'below the first step'}"
+              f"{'/s' if ceiling else ''}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Signal load generator")
+    parser.add_argument('--url', default=BASE_URL)
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), help="Send one scenario and exit")
+    parser.add_argument('--mix', choices=['scripted', 'random'], default='scripted')
+    parser.add_argument('--script', help="JSON file with the requests to cycle through")
+    parser.add_argument('--rate', type=float, default=None, help="Target requests per second")
+    parser.add_argument('--ramp', help="Comma-separated rates to step through (open loop)")
+    parser.add_argument('--concurrency', type=int, default=1, help="Workers in closed-loop mode")
+    parser.add_argument('--open-loop', action='store_true', help="Send on schedule regardless of responses")
+    parser.add_argument('--poisson', action='store_true', help="Poisson arrivals in open-loop mode")
+    parser.add_argument('--max-inflight', type=int, default=0, help="Open loop: drop sends beyond this many in flight")
+    parser.add_argument('--duration', type=float, default=None, help="Seconds per run")
+    parser.add_argument('--requests', type=int, default=None, help="Requests per run")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Write the run summaries to this file")
+    args = parser.parse_args()
+
+    if not args.scenario:
+        if args.duration is None and args.requests is None:
+            parser.error("one of --duration or --requests is required")
+        if (args.open_loop or args.ramp) and not (args.rate or args.ramp):
+            parser.error("open-loop mode needs --rate or --ramp")
+        if args.ramp:
+            args.open_loop = True
+
+    results = asyncio.get_event_loop().run_until_complete(main_async(args))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if any(r['errors'] for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()